@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backtesting', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PredictionSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_symbol', models.CharField(max_length=10)),
+                ('name', models.CharField(blank=True, default='', max_length=100)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('num_points', models.IntegerField()),
+                ('dates', models.BinaryField()),
+                ('values', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='backtestresults',
+            name='prediction_series',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='backtests', to='backtesting.predictionseries'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backtesting', '0002_prediction_series'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backtesttrade',
+            name='symbol',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+    ]
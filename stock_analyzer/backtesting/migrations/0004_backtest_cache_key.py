@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backtesting', '0003_portfolio_trades'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backtestresults',
+            name='cache_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
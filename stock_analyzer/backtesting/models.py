@@ -1,5 +1,19 @@
 from django.db import models
 
+class PredictionSeries(models.Model):
+    """Predicted closes for one symbol, registered once and reused across backtests"""
+    stock_symbol = models.CharField(max_length=10)
+    name = models.CharField(max_length=100, blank=True, default='')
+    start_date = models.DateField()
+    end_date = models.DateField()
+    num_points = models.IntegerField()
+    dates = models.BinaryField()  # int32 days since 1970-01-01, ascending
+    values = models.BinaryField()  # float64 predicted prices, aligned with dates
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.stock_symbol} predictions {self.name or self.id} ({self.start_date} to {self.end_date})"
+
 class BacktestResults(models.Model):
     stock_symbol = models.CharField(max_length=10)
     start_date = models.DateField()
@@ -9,6 +23,11 @@ class BacktestResults(models.Model):
     total_return = models.DecimalField(max_digits=10, decimal_places=2)
     num_trades = models.IntegerField()
     max_drawdown = models.DecimalField(max_digits=10, decimal_places=2)
+    prediction_series = models.ForeignKey(
+        PredictionSeries, on_delete=models.SET_NULL, null=True, blank=True, related_name='backtests'
+    )
+    # Hash of symbol, range, simulated prices, parameters and predictions (see backtest_cache_key)
+    cache_key = models.CharField(max_length=64, null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -16,6 +35,7 @@ class BacktestResults(models.Model):
 
 class BacktestTrade(models.Model):
     backtest = models.ForeignKey(BacktestResults, on_delete=models.CASCADE, related_name='trades')
+    symbol = models.CharField(max_length=10, null=True, blank=True)  # set for portfolio backtests
     entry_date = models.DateField()
     entry_price = models.DecimalField(max_digits=10, decimal_places=2)
     exit_date = models.DateField(null=True)  # null=True because we might not have exited yet
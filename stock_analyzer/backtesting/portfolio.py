@@ -0,0 +1,198 @@
+# backtesting/portfolio.py
+"""
+Portfolio backtests: the ML strategy run across many symbols at once,
+drawing on one shared pool of capital.
+
+Prices and predictions are held as (dates x symbols) matrices aligned on
+the union of trading days; a symbol without a bar on some day has NaN
+there and is neither entered nor exited that day. Each position follows
+the single-symbol rules of simulate_ml_strategy: entry at the signal
+day's close, exits checked against the following closes and filled at
+the take profit / stop loss price. Drawdown is measured on each day's
+equity at that day's closes, so unlike simulate_ml_strategy's (which
+books an exit on the day before it fills) it can differ for one symbol.
+"""
+import numpy as np
+import pandas as pd
+
+from stock_analyzer.instrumentation import phase
+from stock_data.services import StockDataService
+from .predictions import align_predictions, get_prediction_series, parse_date_keyed, series_arrays
+from .services import save_backtest
+
+PORTFOLIO_SYMBOL = 'PORTFOLIO'
+
+
+def load_price_matrix(symbols, start_date=None, end_date=None):
+    """
+    Closes for every symbol over the range as (dates, close matrix), loaded
+    with a single query for all symbols not in the price cache. dates are
+    int32 days since 1970-01-01; missing bars are NaN.
+    """
+    with phase('db_load'):
+        series = StockDataService.get_price_series_many({symbol: (start_date, end_date) for symbol in symbols})
+    days = np.unique(np.concatenate([series[symbol].dates for symbol in symbols]))
+
+    close = np.full((len(days), len(symbols)), np.nan)
+    for column, symbol in enumerate(symbols):
+        rows = np.searchsorted(days, series[symbol].dates)
+        close[rows, column] = series[symbol].close
+    return days, close
+
+
+def resolve_portfolio_predictions(data: dict, symbols, days, close) -> np.ndarray:
+    """
+    Prediction matrix aligned with close. Per symbol, predictions come from
+    prediction_series_ids[symbol], or predictions[symbol] as a {date: value}
+    object or a list with one value per bar the symbol has in range.
+    """
+    predictions = data.get('predictions') or {}
+    series_ids = data.get('prediction_series_ids') or {}
+    missing = data.get('missing', 'ffill')
+
+    predicted = np.full(close.shape, np.nan)
+    for column, symbol in enumerate(symbols):
+        if symbol in series_ids:
+            series = get_prediction_series(series_ids[symbol], symbol)
+            predicted[:, column] = align_predictions(*series_arrays(series), days, missing)
+        elif isinstance(predictions.get(symbol), dict):
+            predicted[:, column] = align_predictions(*parse_date_keyed(predictions[symbol]), days, missing)
+        elif isinstance(predictions.get(symbol), list):
+            rows = np.flatnonzero(~np.isnan(close[:, column]))
+            if len(predictions[symbol]) != len(rows):
+                raise ValueError(
+                    f'Number of predictions for {symbol} ({len(predictions[symbol])}) does not match '
+                    f'its historical data length ({len(rows)})'
+                )
+            predicted[rows, column] = np.asarray(predictions[symbol], dtype=np.float64)
+        else:
+            raise ValueError(f'No predictions given for {symbol}')
+    return predicted
+
+
+def simulate_portfolio(
+    close: np.ndarray,
+    predicted: np.ndarray,
+    initial_capital: float = 100000,
+    max_positions: int = 10,
+    position_size: float = None,
+    cash_reserve: float = 0,
+    prediction_threshold: float = 0.02,
+    stop_loss: float = 0.05,
+    take_profit: float = 0.05
+) -> dict:
+    """
+    Simulate the strategy over (dates x symbols) close/prediction matrices.
+
+    At most max_positions are open at once; each new position is sized at
+    position_size (default 1 / max_positions) of current equity, limited
+    by the cash left above cash_reserve. When more symbols signal than
+    there are free slots, the largest predicted returns are taken first.
+    Trades carry row and column indices; no DB access happens here.
+    """
+    num_days, num_symbols = close.shape
+    position_size = position_size or 1.0 / max_positions
+
+    # Held positions are valued at their latest known close
+    valuation = pd.DataFrame(close).ffill().fillna(0.0).to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        predicted_return = (predicted - close) / close
+    signals = predicted_return > prediction_threshold
+    signals[-1:] = False  # the last day has no following close to exit on
+    any_signal = signals.any(axis=1)
+
+    cash = float(initial_capital)
+    held = np.zeros(num_symbols, dtype=bool)
+    shares = np.zeros(num_symbols, dtype=np.int64)
+    entry_day = np.zeros(num_symbols, dtype=np.int64)
+    entry_price = np.zeros(num_symbols)
+    take_profit_price = np.full(num_symbols, np.inf)
+    stop_loss_price = np.full(num_symbols, -np.inf)
+    equity = np.empty(num_days)
+    trades = []
+
+    def close_position(column, day, price, reason):
+        nonlocal cash
+        cash += shares[column] * price
+        trades.append({
+            'symbol_index': int(column),
+            'entry_index': int(entry_day[column]),
+            'entry_price': float(entry_price[column]),
+            'exit_index': int(day),
+            'exit_price': float(price),
+            'shares': int(shares[column]),
+            'profit_loss': ((price - entry_price[column]) / entry_price[column]) * 100,
+            'exit_reason': reason
+        })
+        held[column] = False
+        shares[column] = 0
+
+    for day in range(num_days):
+        if held.any():
+            # Exits are checked from the second day after entry, against that day's close
+            today = close[day]
+            due = held & (entry_day <= day - 2)
+            hit_take_profit = due & (today >= take_profit_price)
+            hit_stop_loss = due & ~hit_take_profit & (today <= stop_loss_price)
+            for column in np.flatnonzero(hit_take_profit):
+                close_position(column, day, take_profit_price[column], 'take_profit')
+            for column in np.flatnonzero(hit_stop_loss):
+                close_position(column, day, stop_loss_price[column], 'stop_loss')
+
+        free = max_positions - int(held.sum())
+        if free > 0 and any_signal[day]:
+            candidates = np.flatnonzero(signals[day] & ~held)
+            candidates = candidates[np.argsort(-predicted_return[day, candidates], kind='stable')][:free]
+            total = cash + float(shares @ valuation[day])
+            for column in candidates:
+                price = close[day, column]
+                budget = min(total * position_size, cash - total * cash_reserve)
+                count = int(budget // price) if budget > 0 else 0
+                if count <= 0:
+                    continue
+                cash -= count * price
+                held[column] = True
+                shares[column] = count
+                entry_day[column] = day
+                entry_price[column] = price
+                take_profit_price[column] = price * (1 + take_profit)
+                stop_loss_price[column] = price * (1 - stop_loss)
+
+        equity[day] = cash + float(shares @ valuation[day])
+
+    # Close what is still open at each symbol's last known close
+    for column in np.flatnonzero(held):
+        last_day = int(np.flatnonzero(~np.isnan(close[:, column]))[-1])
+        close_position(column, last_day, close[last_day, column], 'end_of_period')
+
+    max_drawdown = 0.0
+    if num_days:
+        highest = np.maximum.accumulate(np.concatenate(([float(initial_capital)], equity)))[1:]
+        max_drawdown = float(((highest - equity) / highest).max())
+
+    trades.sort(key=lambda trade: (trade['entry_index'], trade['symbol_index']))
+    return {
+        'final_capital': cash,
+        'total_return': ((cash - float(initial_capital)) / float(initial_capital)) * 100,
+        'max_drawdown': max_drawdown,
+        'num_trades': len(trades),
+        'trades': trades
+    }
+
+
+def run_portfolio_backtest(symbols, days, close, predicted, initial_capital: float = 100000,
+                           persistence: str = 'deferred', **params):
+    """
+    Simulate a portfolio and store it as one BacktestResults row (stock
+    symbol PORTFOLIO) whose trades name their own symbols.
+    Returns (backtest, result).
+    """
+    with phase('simulate'):
+        result = simulate_portfolio(close, predicted, initial_capital=initial_capital, **params)
+    for trade in result['trades']:
+        trade['symbol'] = symbols[trade['symbol_index']]
+
+    dates = days.astype('datetime64[D]').tolist()
+    with phase('persist'):
+        backtest = save_backtest(PORTFOLIO_SYMBOL, dates, initial_capital, result, persistence=persistence)
+    return backtest, result
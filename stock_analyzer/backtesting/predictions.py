@@ -0,0 +1,150 @@
+# backtesting/predictions.py
+"""
+Prediction inputs for backtests.
+
+Predictions can arrive as a positional JSON list (one value per stored
+price row), a date-keyed JSON object, a binary body (raw little-endian
+float64 or a .npy array), or the id of a registered PredictionSeries.
+Every form is resolved to one float64 value per price row; NaN means
+"no prediction", which never triggers an entry.
+"""
+import io
+import json
+from datetime import datetime
+
+import numpy as np
+
+from .models import PredictionSeries
+
+MISSING_MODES = ('ffill', 'skip')
+BINARY_CONTENT_TYPES = ('application/octet-stream', 'application/x-npy')
+
+
+def to_days(dates) -> np.ndarray:
+    """Dates (date objects or YYYY-MM-DD strings) as int32 days since 1970-01-01"""
+    return np.array(dates, dtype='datetime64[D]').astype(np.int32)
+
+
+def read_request(request):
+    """
+    Split a backtest request into (parameters, binary predictions).
+    JSON bodies carry everything; binary bodies carry only the predictions
+    and the parameters come from the query string.
+    """
+    if request.content_type in BINARY_CONTENT_TYPES:
+        return request.GET.dict(), parse_binary_predictions(request.body, request.content_type)
+    return json.loads(request.body), None
+
+
+def parse_binary_predictions(body: bytes, content_type: str) -> np.ndarray:
+    if content_type == 'application/x-npy':
+        try:
+            values = np.load(io.BytesIO(body), allow_pickle=False)
+        except (OSError, ValueError) as e:
+            raise ValueError(f'Invalid .npy body: {e}')
+        if values.ndim != 1 or values.dtype.kind not in 'iuf':
+            raise ValueError('The .npy body must hold a one-dimensional numeric array')
+        return values.astype(np.float64)
+
+    if len(body) % 8:
+        raise ValueError('Raw prediction bodies must be little-endian float64 values (8 bytes each)')
+    return np.frombuffer(body, dtype='<f8').astype(np.float64)
+
+
+def parse_date_keyed(predictions: dict):
+    """{YYYY-MM-DD: value} as date-sorted (int32 days, float64 values) arrays"""
+    try:
+        dates = [datetime.strptime(date, '%Y-%m-%d').date() for date in predictions]
+        values = np.array([np.nan if value is None else value for value in predictions.values()], dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError('Date-keyed predictions must map YYYY-MM-DD dates to numbers')
+
+    days = to_days(dates)
+    order = np.argsort(days, kind='stable')
+    return days[order], values[order]
+
+
+def align_predictions(prediction_days, values, days, missing: str = 'ffill') -> np.ndarray:
+    """
+    Values for each of days from a sparse date-keyed series. 'ffill' carries
+    the latest earlier prediction forward, 'skip' leaves days without their
+    own prediction as NaN. Days before the first prediction are always NaN.
+    """
+    if missing not in MISSING_MODES:
+        raise ValueError(f"Invalid missing mode '{missing}'. Choose from: {', '.join(MISSING_MODES)}")
+
+    aligned = np.full(len(days), np.nan)
+    if not len(prediction_days):
+        return aligned
+
+    index = np.searchsorted(prediction_days, days, side='right') - 1
+    known = index >= 0
+    if missing == 'skip':
+        known &= prediction_days[np.maximum(index, 0)] == days
+    aligned[known] = values[index[known]]
+    return aligned
+
+
+def get_prediction_series(series_id, symbol: str) -> PredictionSeries:
+    try:
+        series = PredictionSeries.objects.get(id=int(series_id))
+    except (PredictionSeries.DoesNotExist, TypeError, ValueError):
+        raise ValueError(f'Prediction series {series_id} not found')
+    if series.stock_symbol != symbol:
+        raise ValueError(f'Prediction series {series.id} is for {series.stock_symbol}, not {symbol}')
+    return series
+
+
+def series_arrays(series: PredictionSeries):
+    return np.frombuffer(bytes(series.dates), dtype='<i4'), np.frombuffer(bytes(series.values), dtype='<f8')
+
+
+def resolve_predictions(data: dict, binary, stock_data, symbol: str):
+    """
+    One prediction per row of stock_data (a date-sorted DataFrame) and the
+    PredictionSeries used, if any. Raises ValueError when the input is
+    missing, malformed or doesn't line up with the price rows.
+    """
+    days = to_days(stock_data['date'])
+    missing = data.get('missing', 'ffill')
+    series = None
+
+    if binary is not None:
+        predictions = binary
+    elif data.get('prediction_series_id') is not None:
+        series = get_prediction_series(data['prediction_series_id'], symbol)
+        return align_predictions(*series_arrays(series), days, missing), series
+    else:
+        predictions = data.get('predictions')
+        if isinstance(predictions, dict) and predictions:
+            return align_predictions(*parse_date_keyed(predictions), days, missing), None
+        if not predictions:
+            raise ValueError('Predictions are required in request body')
+
+    if len(predictions) != len(stock_data):
+        raise ValueError(
+            f'Number of predictions ({len(predictions)}) does not match '
+            f'historical data length ({len(stock_data)}) for the specified '
+            f'date range ({stock_data.date.min()} to {stock_data.date.max()})'
+        )
+    try:
+        return np.asarray(predictions, dtype=np.float64), series
+    except (TypeError, ValueError):
+        raise ValueError('Predictions must be numbers')
+
+
+def register_prediction_series(symbol: str, days, values, name: str = '') -> PredictionSeries:
+    """Store a date-sorted prediction series for later backtests"""
+    if not len(days):
+        raise ValueError('A prediction series needs at least one value')
+
+    days = np.ascontiguousarray(days, dtype='<i4')
+    return PredictionSeries.objects.create(
+        stock_symbol=symbol,
+        name=name,
+        start_date=np.datetime64(int(days[0]), 'D').item(),
+        end_date=np.datetime64(int(days[-1]), 'D').item(),
+        num_points=len(days),
+        dates=days.tobytes(),
+        values=np.ascontiguousarray(values, dtype='<f8').tobytes()
+    )
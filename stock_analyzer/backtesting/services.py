@@ -1,14 +1,45 @@
-from decimal import Decimal
-import pandas as pd
-from .models import BacktestResults, BacktestTrade
-
 # backtesting/services.py
 from decimal import Decimal, ROUND_HALF_UP
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from multiprocessing import shared_memory
+import hashlib
+import json
+import logging
+import multiprocessing
+import numpy as np
 import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from stock_analyzer.instrumentation import phase
 from .models import BacktestResults, BacktestTrade
+from .sweep_pool import init_worker, run_task
+
+logger = logging.getLogger(__name__)
+
+BACKTEST_ENGINES = ('vectorized', 'legacy')
+# How a finished simulation is stored, always in one transaction: 'deferred'
+# bulk-inserts all trades at once, 'immediate' saves them one INSERT at a time
+PERSISTENCE_MODES = ('deferred', 'immediate')
+
+# Strategy parameters a sweep may vary, with the defaults used by run_ml_backtest
+SWEEP_PARAMETERS = {
+    'prediction_threshold': 0.02,
+    'stop_loss': 0.05,
+    'take_profit': 0.05,
+    'position_size': 1,
+    'cash_reserve': 0
+}
+# Sweep ranking metrics; True means higher is better
+SWEEP_METRICS = {
+    'total_return': True,
+    'final_capital': True,
+    'max_drawdown': False,
+    'num_trades': True
+}
 
 # backtesting/services.py
-def run_ml_backtest(
+def _run_ml_backtest_legacy(
     stock_data: pd.DataFrame,
     symbol: str,
     initial_capital: float = 10000,
@@ -19,13 +50,17 @@ def run_ml_backtest(
     take_profit: float = 0.05
 ):
     """
-    Run ML strategy backtest and store results in DB
+    Original row-by-row backtest loop, kept selectable for comparison
+    with the vectorized engine. Stores results in DB as it goes.
     """
     # Make a copy of the dataframe and prep the data
     df = stock_data.copy()
     df['date'] = pd.to_datetime(df['date'])
     df = df.sort_values('date').reset_index(drop=True)
 
+    # Per-day logging is costly; decide once whether it is wanted
+    debug = logger.isEnabledFor(logging.DEBUG)
+
     # Initialize tracking variables
     capital = float(initial_capital)
     position = None
@@ -56,7 +91,11 @@ def run_ml_backtest(
             predicted_price = float(today['predicted_price'])
             predicted_return = (predicted_price - current_price) / current_price
             
-            print(f"Day {today['date']}: Price=${current_price:.2f}, Predicted=${predicted_price:.2f}, Return={predicted_return:.2%}")
+            if debug:
+                logger.debug(
+                    "Day %s: Price=$%.2f, Predicted=$%.2f, Return=%.2f%%",
+                    today['date'], current_price, predicted_price, predicted_return * 100
+                )
             
             if predicted_return > prediction_threshold:
                 available_capital = capital * (1 - cash_reserve)
@@ -79,9 +118,11 @@ def run_ml_backtest(
                         shares=shares
                     )
                     position['trade_id'] = trade.id
-                    print(f"Bought {shares} shares at ${current_price:.2f}")
-                    print(f"Take profit at ${position['take_profit_price']:.2f}")
-                    print(f"Stop loss at ${position['stop_loss_price']:.2f}")
+                    if debug:
+                        logger.debug(
+                            "Bought %d shares at $%.2f (take profit $%.2f, stop loss $%.2f)",
+                            shares, current_price, position['take_profit_price'], position['stop_loss_price']
+                        )
         
         # Sell logic
         elif position is not None:
@@ -94,13 +135,11 @@ def run_ml_backtest(
                 should_sell = True
                 exit_reason = 'take_profit'
                 exit_price = position['take_profit_price']  # Use take profit price instead of overshoot
-                print(f"Take profit triggered: Next price ${next_price:.2f} >= ${position['take_profit_price']:.2f}")
             
             elif next_price <= position['stop_loss_price']:
                 should_sell = True
                 exit_reason = 'stop_loss'
                 exit_price = position['stop_loss_price']  # Use stop loss price instead of overshoot
-                print(f"Stop loss triggered: Next price ${next_price:.2f} <= ${position['stop_loss_price']:.2f}")
             
             if should_sell:
                 trade = BacktestTrade.objects.get(id=position['trade_id'])
@@ -111,7 +150,11 @@ def run_ml_backtest(
                 trade.save()
                 
                 capital += position['shares'] * exit_price
-                print(f"Sold {position['shares']} shares at ${exit_price:.2f} due to {exit_reason}")
+                if debug:
+                    logger.debug(
+                        "Sold %d shares at $%.2f due to %s (next close $%.2f)",
+                        position['shares'], exit_price, exit_reason, next_price
+                    )
                 position = None
         
         # Track maximum drawdown
@@ -134,7 +177,7 @@ def run_ml_backtest(
         trade.save()
         
         capital += position['shares'] * final_price
-        print(f"Closed final position: {position['shares']} shares at ${final_price:.2f}")
+        logger.debug("Closed final position: %d shares at $%.2f", position['shares'], final_price)
 
     # Update final results
     final_return = Decimal(str(((capital - float(initial_capital)) / float(initial_capital)) * 100))
@@ -145,4 +188,462 @@ def run_ml_backtest(
     backtest.max_drawdown = Decimal(str(max_drawdown * 100)).quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP)
     backtest.save()
 
-    return backtest
\ No newline at end of file
+    return backtest
+
+def simulate_ml_strategy(
+    close: np.ndarray,
+    predicted: np.ndarray,
+    initial_capital: float = 10000,
+    cash_reserve: float = 0,
+    position_size: float = 1,
+    prediction_threshold: float = 0.02,
+    stop_loss: float = 0.05,
+    take_profit: float = 0.05
+) -> dict:
+    """
+    Simulate the ML strategy over contiguous close/prediction arrays.
+
+    Produces the same trades and metrics as the legacy loop: entries use
+    today's close, exits are checked against the next day's close and
+    filled at the take profit / stop loss price. Trades are returned as
+    dicts holding row indices rather than dates; no DB access happens here.
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    predicted = np.ascontiguousarray(predicted, dtype=np.float64)
+    n = len(close)
+
+    capital = float(initial_capital)
+    trades = []
+    # Total value at the end of each simulated day (the legacy loop skips the last row)
+    equity = np.empty(max(n - 1, 0), dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        predicted_return = (predicted[:-1] - close[:-1]) / close[:-1]
+    signal_days = np.flatnonzero(predicted_return > prediction_threshold)
+    closes = close.tolist()
+
+    day = 0
+    while day < n - 1:
+        # Jump straight to the next entry signal, holding cash until then
+        k = np.searchsorted(signal_days, day)
+        if k == len(signal_days):
+            equity[day:] = capital
+            break
+        entry = int(signal_days[k])
+        equity[day:entry] = capital
+
+        current_price = closes[entry]
+        available_capital = capital * (1 - cash_reserve)
+        shares = int((available_capital * position_size) // current_price)
+        if shares <= 0:
+            equity[entry] = capital
+            day = entry + 1
+            continue
+
+        capital -= shares * current_price
+        take_profit_price = current_price * (1 + take_profit)
+        stop_loss_price = current_price * (1 - stop_loss)
+
+        # Exits are checked from the day after entry, against the following close
+        next_prices = close[entry + 2:]
+        hits = np.flatnonzero((next_prices >= take_profit_price) | (next_prices <= stop_loss_price))
+
+        if hits.size == 0:
+            equity[entry:] = capital + shares * close[entry:n - 1]
+            final_price = closes[-1]
+            capital += shares * final_price
+            trades.append({
+                'entry_index': entry,
+                'entry_price': current_price,
+                'exit_index': n - 1,
+                'exit_price': final_price,
+                'shares': shares,
+                'profit_loss': ((final_price - current_price) / current_price) * 100,
+                'exit_reason': 'end_of_period'
+            })
+            break
+
+        exit_day = entry + 1 + int(hits[0])
+        if closes[exit_day + 1] >= take_profit_price:
+            exit_reason = 'take_profit'
+            exit_price = take_profit_price
+        else:
+            exit_reason = 'stop_loss'
+            exit_price = stop_loss_price
+
+        equity[entry:exit_day] = capital + shares * close[entry:exit_day]
+        capital += shares * exit_price
+        equity[exit_day] = capital
+        trades.append({
+            'entry_index': entry,
+            'entry_price': current_price,
+            'exit_index': exit_day + 1,
+            'exit_price': exit_price,
+            'shares': shares,
+            'profit_loss': ((exit_price - current_price) / current_price) * 100,
+            'exit_reason': exit_reason
+        })
+        day = exit_day + 1
+
+    max_drawdown = 0.0
+    if len(equity):
+        highest = np.maximum.accumulate(np.concatenate(([float(initial_capital)], equity)))[1:]
+        max_drawdown = max(max_drawdown, float(((highest - equity) / highest).max()))
+
+    return {
+        'final_capital': capital,
+        'total_return': ((capital - float(initial_capital)) / float(initial_capital)) * 100,
+        'max_drawdown': max_drawdown,
+        'num_trades': len(trades),
+        'trades': trades
+    }
+
+
+def _build_trade(backtest, dates, trade) -> BacktestTrade:
+    return BacktestTrade(
+        backtest=backtest,
+        symbol=trade.get('symbol'),
+        entry_date=dates[trade['entry_index']],
+        entry_price=Decimal(str(trade['entry_price'])),
+        exit_date=dates[trade['exit_index']],
+        exit_price=Decimal(str(trade['exit_price'])),
+        shares=trade['shares'],
+        profit_loss=Decimal(str(trade['profit_loss'])),
+        exit_reason=trade['exit_reason']
+    )
+
+
+def backtest_cache_key(symbol, start_date, end_date, stock_data: pd.DataFrame, params: dict, predicted) -> str:
+    """
+    Content address of a backtest: identical symbol, range, parameters,
+    predictions and simulated prices (stock_data's dates and closes)
+    always produce the same result. Hashing the prices actually simulated,
+    rather than a version of the stored rows, keeps a result computed from
+    an outdated copy of the prices from being reused for the current ones.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps({
+        'symbol': symbol,
+        'start_date': str(start_date) if start_date else None,
+        'end_date': str(end_date) if end_date else None,
+        'params': params
+    }, sort_keys=True).encode())
+    digest.update(np.asarray(stock_data['date'], dtype='datetime64[D]').astype('<i8').tobytes())
+    digest.update(np.ascontiguousarray(stock_data['close'], dtype='<f8').tobytes())
+    digest.update(np.ascontiguousarray(predicted, dtype='<f8').tobytes())
+    return digest.hexdigest()
+
+
+def find_cached_backtest(cache_key: str):
+    """The most recent stored backtest with this cache key, or None"""
+    return BacktestResults.objects.filter(cache_key=cache_key).order_by('-created_at', '-id').first()
+
+
+def save_backtest(symbol, dates, initial_capital, result: dict, persistence: str = 'deferred',
+                  prediction_series=None, cache_key=None) -> BacktestResults:
+    """
+    Store a simulate_ml_strategy result and its trades in one transaction.
+    Deferred persistence needs two INSERTs in total; immediate persistence
+    saves each trade separately.
+    """
+    backtest = BacktestResults(
+        stock_symbol=symbol,
+        start_date=dates[0],
+        end_date=dates[-1],
+        initial_capital=Decimal(str(initial_capital)),
+        final_capital=Decimal(str(result['final_capital'])),
+        total_return=Decimal(str(result['total_return'])).quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP),
+        num_trades=result['num_trades'],
+        max_drawdown=Decimal(str(result['max_drawdown'] * 100)).quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP),
+        prediction_series=prediction_series,
+        cache_key=cache_key
+    )
+
+    with transaction.atomic():
+        backtest.save()
+        if persistence == 'immediate':
+            for trade in result['trades']:
+                _build_trade(backtest, dates, trade).save()
+        else:
+            BacktestTrade.objects.bulk_create(
+                [_build_trade(backtest, dates, trade) for trade in result['trades']]
+            )
+
+    return backtest
+
+
+def run_ml_backtest(
+    stock_data: pd.DataFrame,
+    symbol: str,
+    initial_capital: float = 10000,
+    cash_reserve: float = 0,
+    position_size: float = 1,
+    prediction_threshold: float = 0.02,
+    stop_loss: float = 0.05,
+    take_profit: float = 0.05,
+    engine: str = 'vectorized',
+    persistence: str = 'deferred',
+    prediction_series=None,
+    cache_key=None
+):
+    """
+    Run ML strategy backtest and store results in DB.
+    engine='legacy' selects the original row-by-row loop, which always
+    writes trades as it goes; persistence only applies to the vectorized engine.
+    prediction_series is the registered PredictionSeries the predictions came from, if any;
+    cache_key is stored so identical requests can reuse the result.
+    """
+    if engine not in BACKTEST_ENGINES:
+        raise ValueError(f"Unknown backtest engine '{engine}'. Choose from: {', '.join(BACKTEST_ENGINES)}")
+    if persistence not in PERSISTENCE_MODES:
+        raise ValueError(f"Unknown persistence mode '{persistence}'. Choose from: {', '.join(PERSISTENCE_MODES)}")
+
+    if engine == 'legacy':
+        with phase('simulate'):  # the legacy loop persists as it simulates
+            backtest = _run_ml_backtest_legacy(
+                stock_data=stock_data,
+                symbol=symbol,
+                initial_capital=initial_capital,
+                cash_reserve=cash_reserve,
+                position_size=position_size,
+                prediction_threshold=prediction_threshold,
+                stop_loss=stop_loss,
+                take_profit=take_profit
+            )
+        backtest.prediction_series = prediction_series
+        backtest.cache_key = cache_key
+        backtest.save(update_fields=['prediction_series', 'cache_key'])
+        return backtest
+
+    with phase('frame_build'):
+        df = stock_data.copy()
+        df['date'] = pd.to_datetime(df['date'])
+        df = df.sort_values('date').reset_index(drop=True)
+        dates = df['date'].dt.date.to_numpy()
+
+    with phase('simulate'):
+        result = simulate_ml_strategy(
+            close=df['close'].to_numpy(dtype=np.float64),
+            predicted=df['predicted_price'].to_numpy(dtype=np.float64),
+            initial_capital=initial_capital,
+            cash_reserve=cash_reserve,
+            position_size=position_size,
+            prediction_threshold=prediction_threshold,
+            stop_loss=stop_loss,
+            take_profit=take_profit
+        )
+
+    with phase('persist'):
+        return save_backtest(
+            symbol, dates, initial_capital, result,
+            persistence=persistence,
+            prediction_series=prediction_series,
+            cache_key=cache_key
+        )
+
+
+def expand_parameter_grid(grid: dict = None, combinations: list = None) -> list:
+    """
+    Turn a parameter grid ({name: [values]}) or an explicit list of
+    parameter dicts into full parameter sets, filling in defaults.
+    """
+    if combinations is None:
+        grid = grid or {}
+        names = list(grid)
+        value_lists = [v if isinstance(v, (list, tuple)) else [v] for v in grid.values()]
+        combinations = [dict(zip(names, values)) for values in product(*value_lists)]
+
+    expanded = []
+    for combo in combinations:
+        unknown = set(combo) - set(SWEEP_PARAMETERS)
+        if unknown:
+            raise ValueError(
+                f"Unknown sweep parameter(s): {', '.join(sorted(unknown))}. "
+                f"Choose from: {', '.join(SWEEP_PARAMETERS)}"
+            )
+        params = dict(SWEEP_PARAMETERS)
+        params.update({name: float(value) for name, value in combo.items()})
+        expanded.append(params)
+
+    return expanded
+
+
+# Read-only price/prediction arrays the sweep tasks simulate over
+_sweep_arrays = {}
+
+
+def _set_sweep_arrays(close, predicted):
+    _sweep_arrays['close'] = close
+    _sweep_arrays['predicted'] = predicted
+
+
+def _sweep_worker(task):
+    """Simulate one (index, params, initial_capital, lo, hi) task over rows lo:hi"""
+    index, params, initial_capital, lo, hi = task
+    result = simulate_ml_strategy(
+        _sweep_arrays['close'][lo:hi],
+        _sweep_arrays['predicted'][lo:hi],
+        initial_capital=initial_capital,
+        **params
+    )
+    metrics = {metric: result[metric] for metric in SWEEP_METRICS}
+    metrics['max_drawdown'] *= 100  # percent, as reported by backtest_view
+    return index, metrics
+
+
+def _run_sweep_tasks(close, predicted, tasks, max_workers=None) -> list:
+    """
+    Run sweep tasks inline or over a process pool. Pool workers map
+    close/predicted from one shared memory block (see sweep_pool).
+    """
+    max_workers = max_workers or settings.BACKTEST_SWEEP_MAX_WORKERS
+    if max_workers <= 1 or len(tasks) < settings.BACKTEST_SWEEP_MIN_POOL_SIZE:
+        _set_sweep_arrays(close, predicted)
+        return [_sweep_worker(task) for task in tasks]
+
+    workers = min(max_workers, len(tasks))
+    memory = shared_memory.SharedMemory(create=True, size=max(close.nbytes + predicted.nbytes, 1))
+    try:
+        shared = np.ndarray((2, len(close)), dtype=np.float64, buffer=memory.buf)
+        shared[0], shared[1] = close, predicted
+        del shared  # the block can't be closed while an array views it
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(settings.BACKTEST_SWEEP_START_METHOD),
+            initializer=init_worker,
+            initargs=(memory.name, len(close))
+        ) as executor:
+            return list(executor.map(run_task, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def run_parameter_sweep(
+    symbol: str,
+    dates,
+    close: np.ndarray,
+    predicted: np.ndarray,
+    combinations: list,
+    initial_capital: float = 10000,
+    rank_by: str = 'total_return',
+    top_n: int = None,
+    persist_top: int = 0,
+    max_workers: int = None,
+    prediction_series=None
+) -> list:
+    """
+    Simulate every parameter combination over one price series and return
+    the metrics ranked by rank_by. Combinations fan out over a process pool;
+    only the best persist_top runs are re-simulated and stored in DB.
+    """
+    if rank_by not in SWEEP_METRICS:
+        raise ValueError(f"Unknown ranking metric '{rank_by}'. Choose from: {', '.join(SWEEP_METRICS)}")
+
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    predicted = np.ascontiguousarray(predicted, dtype=np.float64)
+    tasks = [(i, params, initial_capital, 0, len(close)) for i, params in enumerate(combinations)]
+    with phase('simulate'):
+        metrics = _run_sweep_tasks(close, predicted, tasks, max_workers)
+
+    higher_is_better = SWEEP_METRICS[rank_by]
+    metrics.sort(key=lambda item: (-item[1][rank_by] if higher_is_better else item[1][rank_by], item[0]))
+    if top_n:
+        metrics = metrics[:top_n]
+
+    ranked = []
+    for rank, (index, result) in enumerate(metrics, start=1):
+        entry = {'rank': rank, 'parameters': combinations[index], **result, 'backtest_id': None}
+        if rank <= persist_top:
+            full_result = simulate_ml_strategy(close, predicted, initial_capital=initial_capital, **combinations[index])
+            entry['backtest_id'] = save_backtest(
+                symbol, dates, initial_capital, full_result, prediction_series=prediction_series
+            ).id
+        ranked.append(entry)
+
+    return ranked
+
+
+WALK_FORWARD_UNITS = ('bars', 'months')
+
+
+def walk_forward_windows(dates, window: int, step: int, unit: str = 'bars') -> list:
+    """
+    (lo, hi) row ranges of complete rolling windows over date-sorted dates.
+    unit='bars' counts rows; unit='months' uses calendar months starting
+    with the first date's month, so a window holds whatever trading days
+    fall inside it.
+    """
+    if unit not in WALK_FORWARD_UNITS:
+        raise ValueError(f"Unknown window unit '{unit}'. Choose from: {', '.join(WALK_FORWARD_UNITS)}")
+    if window < 2 or step < 1:
+        raise ValueError('window must be at least 2 and step at least 1')
+
+    n = len(dates)
+    if unit == 'bars':
+        return [(lo, lo + window) for lo in range(0, n - window + 1, step)]
+
+    days = np.array(dates, dtype='datetime64[D]')
+    windows = []
+    start_month = days[0].astype('datetime64[M]')
+    while True:
+        end_month = start_month + window
+        if days[-1].astype('datetime64[M]') < end_month - 1:  # data ends before the window's last month
+            break
+        lo, hi = np.searchsorted(days, [start_month.astype('datetime64[D]'), end_month.astype('datetime64[D]')])
+        if hi - lo >= 2:
+            windows.append((int(lo), int(hi)))
+        start_month += step
+    return windows
+
+
+def run_walk_forward(
+    dates,
+    close: np.ndarray,
+    predicted: np.ndarray,
+    windows: list,
+    params: dict,
+    initial_capital: float = 10000,
+    max_workers: int = None
+) -> dict:
+    """
+    Simulate each (lo, hi) window as an independent backtest starting with
+    initial_capital. The arrays are shared with the sweep worker pool once;
+    returns per-window metrics and stability statistics across windows.
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    predicted = np.ascontiguousarray(predicted, dtype=np.float64)
+    tasks = [(i, params, initial_capital, lo, hi) for i, (lo, hi) in enumerate(windows)]
+    with phase('simulate'):
+        metrics = sorted(_run_sweep_tasks(close, predicted, tasks, max_workers))
+
+    results = []
+    for index, result in metrics:
+        lo, hi = windows[index]
+        results.append({
+            'window': index,
+            'start_date': dates[lo].strftime('%Y-%m-%d'),
+            'end_date': dates[hi - 1].strftime('%Y-%m-%d'),
+            'total_days': hi - lo,
+            **result
+        })
+
+    returns = np.array([result['total_return'] for result in results])
+    drawdowns = np.array([result['max_drawdown'] for result in results])
+    summary = {'num_windows': len(results)}
+    if len(results):
+        summary.update({
+            'mean_return': float(returns.mean()),
+            'median_return': float(np.median(returns)),
+            'std_return': float(returns.std()),
+            'min_return': float(returns.min()),
+            'max_return': float(returns.max()),
+            'profitable_windows': float((returns > 0).mean()),
+            'mean_max_drawdown': float(drawdowns.mean()),
+            'worst_max_drawdown': float(drawdowns.max()),
+            'mean_num_trades': float(np.mean([result['num_trades'] for result in results]))
+        })
+
+    return {'windows': results, 'summary': summary}
+
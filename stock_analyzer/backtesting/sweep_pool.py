@@ -0,0 +1,34 @@
+# backtesting/sweep_pool.py
+"""
+Worker side of the sweep / walk-forward process pool.
+
+The pool is started with BACKTEST_SWEEP_START_METHOD ('forkserver' or
+'spawn'), never by forking the request's threaded process and its open
+DB connections. Workers therefore start with a fresh interpreter: this
+module sets Django up before importing the simulation code, and maps
+close/predicted from one shared memory block instead of receiving a
+pickled copy each.
+"""
+from multiprocessing import shared_memory
+
+import django
+import numpy as np
+
+# The worker's mapping of the shared block, kept open for its lifetime
+_memory = {}
+
+
+def init_worker(name: str, length: int):
+    django.setup()
+    from .services import _set_sweep_arrays
+
+    memory = _memory['block'] = shared_memory.SharedMemory(name=name)
+    arrays = np.ndarray((2, length), dtype=np.float64, buffer=memory.buf)
+    arrays.flags.writeable = False
+    _set_sweep_arrays(arrays[0], arrays[1])
+
+
+def run_task(task):
+    from .services import _sweep_worker
+
+    return _sweep_worker(task)
@@ -1,3 +1,423 @@
-from django.test import TestCase
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.test import TestCase, override_settings
+
+from stock_data.models import StockPrice
+from stock_data.payloads import PriceColumns
+from stock_data.price_cache import get_price_cache
+from stock_data.provider_stub import synthetic_daily_prices
+from stock_data.services import StockDataService
+
+from .models import BacktestResults, BacktestTrade
+from .portfolio import PORTFOLIO_SYMBOL, run_portfolio_backtest, simulate_portfolio
+from .services import (
+    PERSISTENCE_MODES, expand_parameter_grid, run_ml_backtest, run_parameter_sweep, save_backtest,
+    simulate_ml_strategy, walk_forward_windows
+)
+
+
+def seed(symbol: str, num_days: int = 250, end_date: date = date(2024, 6, 28)):
+    prices = synthetic_daily_prices(symbol, num_days, end_date)
+    StockDataService.bulk_upsert_prices(
+        symbol, PriceColumns.from_values(*(prices[name] for name in ('date', 'open', 'high', 'low', 'close', 'volume')))
+    )
+    return prices
+
+
+def random_prices(rng, num_days):
+    """Random-walk closes in cents with noisy predictions that cross the threshold now and then"""
+    close = np.round(50 * np.exp(np.cumsum(rng.normal(0, 0.03, num_days))), 2)
+    return close, close * (1 + rng.normal(0, 0.04, num_days))
+
+
+def random_params(rng):
+    return {
+        'prediction_threshold': float(rng.uniform(0, 0.05)),
+        'stop_loss': float(rng.uniform(0.01, 0.1)),
+        'take_profit': float(rng.uniform(0.01, 0.1)),
+    }
+
+
+class BacktestReuseTests(TestCase):
+    def setUp(self):
+        get_price_cache().invalidate()
+        prices = seed('REUSE')
+        self.body = json.dumps({'predictions': (prices['close'] * 1.05).tolist()})
+
+    def post(self):
+        response = self.client.post('/backtest/REUSE/', self.body, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_identical_request_reuses_result(self):
+        first = self.post()
+        second = self.post()
+        self.assertFalse(first['cached'])
+        self.assertTrue(second['cached'])
+        self.assertEqual(first['backtest_id'], second['backtest_id'])
+
+    def test_key_follows_the_simulated_prices(self):
+        first = self.post()
+
+        # A write this process's price cache hasn't seen yet: the stale
+        # prices are simulated, so the result for them may be reused...
+        StockPrice.objects.filter(symbol='REUSE', date=date(2024, 6, 28)).update(close_price=1)
+        self.assertEqual(self.post()['backtest_id'], first['backtest_id'])
+
+        # ...but never for the current prices once they are loaded
+        get_price_cache().invalidate('REUSE')
+        current = self.post()
+        self.assertFalse(current['cached'])
+        self.assertNotEqual(current['backtest_id'], first['backtest_id'])
+
+
+class EngineEquivalenceTests(TestCase):
+    RESULT_FIELDS = ('start_date', 'end_date', 'final_capital', 'total_return', 'num_trades', 'max_drawdown')
+    TRADE_FIELDS = ('entry_date', 'entry_price', 'exit_date', 'exit_price', 'shares', 'profit_loss', 'exit_reason')
+
+    def random_series(self, rng, num_days):
+        close, predicted = random_prices(rng, num_days)
+        return pd.DataFrame({
+            'date': pd.bdate_range('2020-01-01', periods=num_days),
+            'close': close,
+            'predicted_price': predicted,
+        })
+
+    def stored(self, backtest):
+        backtest = BacktestResults.objects.get(id=backtest.id)
+        trades = list(backtest.trades.order_by('entry_date').values_list(*self.TRADE_FIELDS))
+        return [getattr(backtest, field) for field in self.RESULT_FIELDS], trades
+
+    def test_vectorized_engine_matches_legacy_loop(self):
+        rng = np.random.default_rng(20240628)
+        for trial in range(40):
+            df = self.random_series(rng, int(rng.integers(2, 200)))
+            params = {
+                'initial_capital': float(rng.choice([1000, 10000, 25000])),
+                'cash_reserve': float(rng.choice([0, 0.1, 0.25])),
+                'position_size': float(rng.choice([0.5, 1])),
+                **random_params(rng),
+            }
+            with self.subTest(trial=trial, days=len(df), **params):
+                legacy = self.stored(run_ml_backtest(df, 'EQ', engine='legacy', **params))
+                vectorized = self.stored(run_ml_backtest(df, 'EQ', engine='vectorized', **params))
+                self.assertEqual(vectorized, legacy)
+
+
+class PersistenceTests(TestCase):
+    def setUp(self):
+        close, predicted = random_prices(np.random.default_rng(11), 250)
+        self.dates = pd.bdate_range('2020-01-01', periods=250).date
+        self.result = simulate_ml_strategy(close, predicted)
+        self.assertGreater(self.result['num_trades'], 1)
+
+    def stored(self, backtest):
+        trades = backtest.trades.order_by('entry_date').values_list(*EngineEquivalenceTests.TRADE_FIELDS)
+        return [getattr(backtest, field) for field in EngineEquivalenceTests.RESULT_FIELDS], list(trades)
+
+    def test_modes_store_the_same_rows(self):
+        deferred, immediate = (
+            BacktestResults.objects.get(id=save_backtest('PERSIST', self.dates, 10000, self.result, persistence=mode).id)
+            for mode in ('deferred', 'immediate')
+        )
+        self.assertEqual(self.stored(immediate), self.stored(deferred))
+
+    def test_immediate_failure_stores_nothing(self):
+        with mock.patch.object(BacktestTrade, 'save', side_effect=[None, RuntimeError('connection lost')]), \
+                self.assertRaises(RuntimeError):
+            save_backtest('PERSIST', self.dates, 10000, self.result, persistence='immediate')
+        self.assertFalse(BacktestResults.objects.filter(stock_symbol='PERSIST').exists())
+
+
+class PortfolioTests(TestCase):
+    # Three symbols at 10: on day 0 A predicts +5%, B +10% and C +3%;
+    # C keeps predicting +3% and A reaches its take profit on day 2
+    CLOSE = np.array([
+        [10, 10, 10],
+        [10, 10, 10],
+        [11, 10, 10],
+        [11, 10, 10],
+        [11, 10, 10],
+    ], dtype=np.float64)
+    PREDICTED = np.array([
+        [10.5, 11, 10.3],
+        *[[np.nan, np.nan, 10.3]] * 4,
+    ])
+
+    def simulate(self, close=CLOSE, predicted=PREDICTED, **params):
+        return simulate_portfolio(close, predicted, initial_capital=1000, **params)
+
+    def summary(self, result):
+        return [
+            (trade['symbol_index'], trade['entry_index'], trade['exit_index'], trade['shares'], trade['exit_reason'])
+            for trade in result['trades']
+        ]
+
+    def test_one_symbol_matches_single_symbol_engine(self):
+        rng = np.random.default_rng(7)
+        for trial in range(40):
+            close, predicted = random_prices(rng, int(rng.integers(2, 200)))
+            params = random_params(rng)
+            with self.subTest(trial=trial, days=len(close), **params):
+                single = simulate_ml_strategy(close, predicted, initial_capital=10000, **params)
+                portfolio = simulate_portfolio(
+                    close[:, None], predicted[:, None], initial_capital=10000, max_positions=1, **params
+                )
+                trades = [{k: v for k, v in trade.items() if k != 'symbol_index'} for trade in portfolio['trades']]
+                self.assertEqual(trades, single['trades'])
+                self.assertEqual(portfolio['final_capital'], single['final_capital'])
+                self.assertEqual(portfolio['total_return'], single['total_return'])
+
+    def test_capital_is_split_across_the_strongest_signals(self):
+        result = self.simulate(max_positions=2)
+        # B and A take both slots at half of equity each; C waits for
+        # A's exit, then gets half of the equity the exit left
+        self.assertEqual(self.summary(result), [
+            (0, 0, 2, 50, 'take_profit'),
+            (1, 0, 4, 50, 'end_of_period'),
+            (2, 2, 4, 51, 'end_of_period'),
+        ])
+        self.assertEqual(result['trades'][0]['exit_price'], 10.5)
+        self.assertAlmostEqual(result['final_capital'], 1025)
+
+    def test_position_size_and_cash_reserve_limit_entries(self):
+        result = self.simulate(max_positions=3, position_size=0.4, cash_reserve=0.3)
+        # B gets 40% of equity; A only the 300 above the 30% reserve; nothing is left for C
+        entries = [(trade['symbol_index'], trade['shares']) for trade in result['trades'] if trade['entry_index'] == 0]
+        self.assertEqual(entries, [(0, 30), (1, 40)])
+
+    def test_missing_bars_neither_enter_nor_exit(self):
+        close = self.CLOSE.copy()
+        close[2, 0] = np.nan  # A would reach its take profit here
+        close[3:, 0] = [10.2, np.nan]
+        close[0, 2] = np.nan  # C has no bar on the signal day
+        predicted = self.PREDICTED.copy()
+        predicted[1:, 2] = np.nan
+        result = self.simulate(close, predicted, max_positions=3)
+
+        self.assertEqual(self.summary(result), [
+            (0, 0, 3, 33, 'end_of_period'),
+            (1, 0, 4, 33, 'end_of_period'),
+        ])
+        # A closes at its last known bar
+        self.assertEqual(result['trades'][0]['exit_price'], 10.2)
+        self.assertTrue(np.isfinite(result['max_drawdown']))
+
+    def test_trades_are_stored_with_their_symbols(self):
+        days = np.arange(19000, 19005, dtype=np.int32)
+        for persistence in PERSISTENCE_MODES:
+            with self.subTest(persistence=persistence):
+                backtest, result = run_portfolio_backtest(
+                    ['AAA', 'BBB', 'CCC'], days, self.CLOSE, self.PREDICTED, initial_capital=1000,
+                    persistence=persistence, max_positions=2
+                )
+                self.assertEqual(backtest.stock_symbol, PORTFOLIO_SYMBOL)
+                self.assertEqual(backtest.num_trades, 3)
+                self.assertEqual(
+                    list(BacktestTrade.objects.filter(backtest=backtest).order_by('entry_date', 'symbol')
+                         .values_list('symbol', 'entry_date', 'exit_date')),
+                    [('AAA', date(2022, 1, 8), date(2022, 1, 10)),
+                     ('BBB', date(2022, 1, 8), date(2022, 1, 12)),
+                     ('CCC', date(2022, 1, 10), date(2022, 1, 12))]
+                )
+
+    def test_view(self):
+        get_price_cache().invalidate()
+        closes = {symbol: seed(symbol, 60)['close'] for symbol in ('PA', 'PB')}
+        response = self.client.post('/backtest/portfolio/', json.dumps({
+            'symbols': ['PA', 'PB'],
+            'predictions': {symbol: (close * 1.05).tolist() for symbol, close in closes.items()},
+            'max_positions': 2,
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        body = response.json()
+        stored = BacktestTrade.objects.filter(backtest_id=body['backtest_id'])
+        self.assertEqual(body['num_trades'], stored.count())
+        self.assertEqual(set(stored.values_list('symbol', flat=True)), {'PA', 'PB'})
+
+
+class SweepTests(TestCase):
+    GRID = {'prediction_threshold': [0, 0.02, 0.04], 'stop_loss': [0.02, 0.05], 'take_profit': [0.03, 0.06]}
+
+    def sweep(self, close, predicted, max_workers):
+        dates = pd.bdate_range('2020-01-01', periods=len(close)).date
+        return run_parameter_sweep(
+            'SWEEP', dates, close, predicted, expand_parameter_grid(self.GRID), max_workers=max_workers
+        )
+
+    def test_pool_matches_inline(self):
+        close, predicted = random_prices(np.random.default_rng(3), 300)
+        inline = self.sweep(close, predicted, max_workers=1)
+        with override_settings(BACKTEST_SWEEP_MIN_POOL_SIZE=1), \
+                mock.patch('backtesting.services.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as pool:
+            pooled = self.sweep(close, predicted, max_workers=2)
+        self.assertTrue(pool.called)
+
+        self.assertEqual(len(inline), 12)
+        self.assertEqual(pooled, inline)
+        returns = [entry['total_return'] for entry in inline]
+        self.assertEqual(returns, sorted(returns, reverse=True))
+
+    def test_view(self):
+        get_price_cache().invalidate()
+        prices = seed('SWEEP')
+        response = self.client.post('/backtest/sweep/SWEEP/', json.dumps({
+            'predictions': (prices['close'] * 1.05).tolist(),
+            'grid': self.GRID,
+            'rank_by': 'max_drawdown',
+            'persist_top': 1,
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        body = response.json()
+        self.assertEqual(body['num_combinations'], 12)
+        drawdowns = [entry['max_drawdown'] for entry in body['results']]
+        self.assertEqual(drawdowns, sorted(drawdowns))
+        best = BacktestResults.objects.get(id=body['results'][0]['backtest_id'])
+        self.assertAlmostEqual(float(best.total_return), body['results'][0]['total_return'], delta=0.005)
+        self.assertIsNone(body['results'][1]['backtest_id'])
+
+
+class PredictionInputTests(TestCase):
+    def setUp(self):
+        get_price_cache().invalidate()
+        prices = seed('PRED')
+        self.dates = prices['date'].astype('datetime64[D]').astype(str).tolist()
+        self.predicted = prices['close'] * 1.05
+        self.expected = self.post({'predictions': self.predicted.tolist()})
+        self.assertGreater(self.expected['num_trades'], 0)
+
+    def post(self, body, content_type='application/json', status=200):
+        # force skips result reuse, so every form is simulated
+        if content_type == 'application/json':
+            body, query = json.dumps({**body, 'force': True}), ''
+        else:
+            query = '?force=1'
+        if status == 200:
+            response = self.client.post(f'/backtest/PRED/{query}', body, content_type=content_type)
+        else:
+            with self.assertLogs('django.request', 'WARNING'):
+                response = self.client.post(f'/backtest/PRED/{query}', body, content_type=content_type)
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def outcome(self, body):
+        return {key: body[key] for key in ('total_return', 'num_trades', 'max_drawdown', 'trades')}
+
+    def npy(self, values):
+        buffer = io.BytesIO()
+        np.save(buffer, values)
+        return buffer.getvalue()
+
+    def test_every_form_gives_the_same_backtest(self):
+        expected = self.outcome(self.expected)
+        forms = {
+            'date_keyed': ({'predictions': dict(zip(self.dates, self.predicted.tolist()))}, 'application/json'),
+            'raw': (self.predicted.astype('<f8').tobytes(), 'application/octet-stream'),
+            'npy': (self.npy(self.predicted), 'application/x-npy'),
+        }
+        for name, (body, content_type) in forms.items():
+            with self.subTest(name):
+                self.assertEqual(self.outcome(self.post(body, content_type)), expected)
+
+        response = self.client.post('/backtest/predictions/', json.dumps({
+            'symbol': 'PRED', 'predictions': dict(zip(self.dates, self.predicted.tolist()))
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['num_points'], len(self.dates))
+        registered = self.post({'prediction_series_id': response.json()['id']})
+        self.assertEqual(self.outcome(registered), expected)
+
+    def test_missing_dates_ffill_or_skip(self):
+        # Every third day has no prediction
+        sparse = {date: value for i, (date, value) in enumerate(zip(self.dates, self.predicted.tolist())) if i % 3}
+        skipped = self.predicted.copy()
+        skipped[::3] = np.nan
+        filled = pd.Series(skipped).ffill().to_numpy()
+
+        for missing, values in (('ffill', filled), ('skip', skipped)):
+            with self.subTest(missing):
+                date_keyed = self.post({'predictions': sparse, 'missing': missing})
+                raw = self.post(values.astype('<f8').tobytes(), 'application/octet-stream')
+                self.assertEqual(self.outcome(date_keyed), self.outcome(raw))
+
+        self.post({'predictions': sparse, 'missing': 'interpolate'}, status=400)
+
+    def test_mismatched_predictions_are_rejected(self):
+        self.assertIn('does not match', self.post({'predictions': self.predicted[:-1].tolist()}, status=400)['error'])
+        self.assertIn('does not match', self.post(
+            self.predicted[:-1].astype('<f8').tobytes(), 'application/octet-stream', status=400
+        )['error'])
+        self.assertIn('8 bytes', self.post(b'\0' * 12, 'application/octet-stream', status=400)['error'])
+        self.post(self.npy(self.predicted.reshape(-1, 2)), 'application/x-npy', status=400)
+        self.post(self.npy(np.array(['1.0'] * len(self.predicted))), 'application/x-npy', status=400)
+        self.post(b'not an npy file', 'application/x-npy', status=400)
+
+        series = self.client.post('/backtest/predictions/', json.dumps({
+            'symbol': 'OTHER', 'predictions': {'2024-06-28': 1.0}
+        }), content_type='application/json').json()
+        self.assertIn('is for OTHER', self.post({'prediction_series_id': series['id']}, status=400)['error'])
+        self.assertIn('not found', self.post({'prediction_series_id': 999999}, status=400)['error'])
+
+
+class WalkForwardTests(TestCase):
+    def test_bar_windows(self):
+        dates = pd.bdate_range('2024-01-01', periods=10).date
+        self.assertEqual(walk_forward_windows(dates, window=4, step=4), [(0, 4), (4, 8)])
+        self.assertEqual(walk_forward_windows(dates, window=4, step=3), [(0, 4), (3, 7), (6, 10)])
+        self.assertEqual(walk_forward_windows(dates, window=4, step=2), [(0, 4), (2, 6), (4, 8), (6, 10)])
+        self.assertEqual(walk_forward_windows(dates, window=3, step=5), [(0, 3), (5, 8)])
+        self.assertEqual(walk_forward_windows(dates, window=11, step=1), [])
+
+    def test_month_windows(self):
+        dates = pd.bdate_range('2024-01-15', '2024-06-10').date
+        windows = walk_forward_windows(dates, window=2, step=1, unit='months')
+        self.assertEqual(
+            [(str(dates[lo]), str(dates[hi - 1])) for lo, hi in windows],
+            [('2024-01-15', '2024-02-29'), ('2024-02-01', '2024-03-29'), ('2024-03-01', '2024-04-30'),
+             ('2024-04-01', '2024-05-31'), ('2024-05-01', '2024-06-10')]
+        )
+        self.assertEqual(len(walk_forward_windows(dates, window=3, step=3, unit='months')), 2)
+        self.assertEqual(walk_forward_windows(dates, window=12, step=1, unit='months'), [])
+
+    def test_windows_with_under_two_bars_are_skipped(self):
+        dates = [date(2024, 1, 31), date(2024, 3, 1), date(2024, 3, 4), date(2024, 5, 2)]
+        # Jan-Feb and Apr-May hold one bar each; May-Jun runs past the data
+        self.assertEqual(walk_forward_windows(dates, window=2, step=1, unit='months'), [(1, 3), (1, 3)])
+
+    def test_invalid_arguments(self):
+        dates = pd.bdate_range('2024-01-01', periods=10).date
+        for kwargs in ({'window': 1, 'step': 1}, {'window': 4, 'step': 0}, {'window': 4, 'step': 1, 'unit': 'weeks'}):
+            with self.subTest(**kwargs), self.assertRaises(ValueError):
+                walk_forward_windows(dates, **kwargs)
+
+    def test_view(self):
+        get_price_cache().invalidate()
+        prices = seed('WALK')
+        predictions = (prices['close'] * 1.05).tolist()
+
+        response = self.client.post('/backtest/walk-forward/WALK/', json.dumps({
+            'predictions': predictions, 'window': 100, 'step': 50
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        self.assertEqual(body['summary']['num_windows'], 4)
+        dates = prices['date'].astype('datetime64[D]').astype(str)
+        self.assertEqual(
+            [(window['start_date'], window['end_date'], window['total_days']) for window in body['windows']],
+            [(dates[lo], dates[lo + 99], 100) for lo in (0, 50, 100, 150)]
+        )
+
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.post('/backtest/walk-forward/WALK/', json.dumps({
+                'predictions': predictions, 'window': 251
+            }), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'The date range is shorter than one window')
@@ -2,5 +2,10 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
+    path('sweep/<str:symbol>/', views.sweep_view, name='backtest_sweep'),
+    path('walk-forward/<str:symbol>/', views.walk_forward_view, name='backtest_walk_forward'),
+    path('portfolio/', views.portfolio_backtest_view, name='backtest_portfolio'),
+    path('predictions/', views.register_predictions_view, name='register_predictions'),
+    path('predictions/<int:series_id>/', views.prediction_series_view, name='prediction_series'),
     path('<str:symbol>/', views.backtest_view, name='backtest'),
 ]
\ No newline at end of file
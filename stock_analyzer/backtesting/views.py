@@ -1,83 +1,132 @@
+from django.conf import settings
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 import json
+import numpy as np
 import pandas as pd
 from datetime import datetime
-from .services import run_ml_backtest
-from .models import BacktestResults, BacktestTrade
-from stock_data.models import StockPrice
+from .services import (
+    run_ml_backtest, run_parameter_sweep, expand_parameter_grid,
+    walk_forward_windows, run_walk_forward, backtest_cache_key, find_cached_backtest,
+    BACKTEST_ENGINES, PERSISTENCE_MODES, SWEEP_METRICS, SWEEP_PARAMETERS
+)
+from .models import BacktestResults, BacktestTrade, PredictionSeries
+from .portfolio import load_price_matrix, resolve_portfolio_predictions, run_portfolio_backtest
+from .predictions import (
+    read_request, resolve_predictions, parse_date_keyed,
+    register_prediction_series, to_days
+)
+from stock_analyzer.instrumentation import phase
+from stock_data.services import StockDataService
 from django.core.exceptions import ObjectDoesNotExist
 
+def _parse_date_range(data):
+    """Parse optional YYYY-MM-DD start/end dates, raising ValueError if malformed"""
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    if start_date:
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+    if end_date:
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+    return start_date, end_date
+
+
+def _load_stock_data(symbol, start_date=None, end_date=None):
+    """Load closes for the range as a date-sorted DataFrame, or None if empty"""
+    with phase('db_load'):
+        series = StockDataService.get_price_series(symbol, start_date, end_date)
+    if not len(series):
+        return None
+
+    with phase('frame_build'):
+        return pd.DataFrame({'date': series.date_objects(), 'close': series.close})
+
+
+def _is_true(value):
+    """Flag from a JSON body (bool) or a query string ('1', 'true')"""
+    return value is True or str(value).lower() in ('1', 'true')
+
+
+def _no_data_response(symbol, start_date, end_date):
+    error_msg = f'No historical data found for symbol {symbol}'
+    if start_date or end_date:
+        error_msg += ' in the specified date range'
+    return JsonResponse({'error': error_msg}, status=404)
+
+
 @csrf_exempt
 def backtest_view(request, symbol):
     if request.method != 'POST':
         return JsonResponse({'error': 'Only POST requests allowed'}, status=400)
     
     try:
-        data = json.loads(request.body)
-        
+        try:
+            data, binary_predictions = read_request(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
         # Parse date parameters
-        start_date = data.get('start_date')
-        end_date = data.get('end_date')
-        
-        # Validate date format if provided
         try:
-            if start_date:
-                start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            if end_date:
-                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+            start_date, end_date = _parse_date_range(data)
         except ValueError:
             return JsonResponse({
                 'error': 'Invalid date format. Please use YYYY-MM-DD'
             }, status=400)
-        
-        # Build the query
-        query = StockPrice.objects.filter(symbol=symbol)
-        if start_date:
-            query = query.filter(date__gte=start_date)
-        if end_date:
-            query = query.filter(date__lte=end_date)
-            
-        # Fetch historical data
-        historical_data = query.order_by('date').values('date', 'close_price')
-        
-        if not historical_data:
-            error_msg = f'No historical data found for symbol {symbol}'
-            if start_date or end_date:
-                error_msg += ' in the specified date range'
-            return JsonResponse({'error': error_msg}, status=404)
-        
-        # Create DataFrame from DB data
-        stock_data = pd.DataFrame(historical_data)
-        stock_data = stock_data.rename(columns={'close_price': 'close'})
-        
-        # Validate predictions
-        predictions = data.get('predictions')
-        if not predictions:
+
+        stock_data = _load_stock_data(symbol, start_date, end_date)
+        if stock_data is None:
+            return _no_data_response(symbol, start_date, end_date)
+
+        # Predictions: positional list, {date: value}, binary body or a registered series id
+        try:
+            predictions, prediction_series = resolve_predictions(data, binary_predictions, stock_data, symbol)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        stock_data['predicted_price'] = predictions
+
+        engine = data.get('engine', 'vectorized')
+        if engine not in BACKTEST_ENGINES:
             return JsonResponse({
-                'error': 'Predictions are required in request body'
+                'error': f"Invalid engine '{engine}'. Choose from: {', '.join(BACKTEST_ENGINES)}"
             }, status=400)
-            
-        if len(predictions) != len(stock_data):
+
+        persistence = data.get('persistence', 'deferred')
+        if persistence not in PERSISTENCE_MODES:
             return JsonResponse({
-                'error': (
-                    f'Number of predictions ({len(predictions)}) does not match '
-                    f'historical data length ({len(stock_data)}) for the specified '
-                    f'date range ({stock_data.date.min()} to {stock_data.date.max()})'
-                )
+                'error': f"Invalid persistence mode '{persistence}'. Choose from: {', '.join(PERSISTENCE_MODES)}"
             }, status=400)
-            
-        stock_data['predicted_price'] = predictions
 
-        # Run backtest
-        result = run_ml_backtest(
-            stock_data=stock_data,
-            symbol=symbol,
-            initial_capital=float(data.get('initial_capital', 10000)),
-            prediction_threshold=float(data.get('prediction_threshold', 0.02)),
-            stop_loss=float(data.get('stop_loss', 0.05)),
-            take_profit=float(data.get('take_profit', 0.05))
+        strategy = {
+            'initial_capital': float(data.get('initial_capital', 10000)),
+            'prediction_threshold': float(data.get('prediction_threshold', 0.02)),
+            'stop_loss': float(data.get('stop_loss', 0.05)),
+            'take_profit': float(data.get('take_profit', 0.05))
+        }
+
+        # Identical requests over unchanged prices reuse the stored backtest unless force is set
+        cache_key = backtest_cache_key(
+            symbol, start_date, end_date,
+            stock_data,
+            {**strategy, 'engine': engine},
+            predictions
         )
+        result = None
+        if not _is_true(data.get('force')):
+            result = find_cached_backtest(cache_key)
+        cached = result is not None
+
+        # Run backtest
+        if result is None:
+            result = run_ml_backtest(
+                stock_data=stock_data,
+                symbol=symbol,
+                engine=engine,
+                persistence=persistence,
+                prediction_series=prediction_series,
+                cache_key=cache_key,
+                **strategy
+            )
 
         # Get trades from DB for this backtest
         trades = BacktestTrade.objects.filter(backtest=result).values(
@@ -92,6 +141,7 @@ def backtest_view(request, symbol):
 
         return JsonResponse({
             'backtest_id': result.id,
+            'cached': cached,
             'symbol': symbol,
             'total_return': float(result.total_return),
             'num_trades': result.num_trades,
@@ -105,10 +155,359 @@ def backtest_view(request, symbol):
                 'initial_capital': float(data.get('initial_capital', 10000)),
                 'prediction_threshold': float(data.get('prediction_threshold', 0.02)),
                 'stop_loss': float(data.get('stop_loss', 0.05)),
-                'take_profit': float(data.get('take_profit', 0.05))
+                'take_profit': float(data.get('take_profit', 0.05)),
+                'engine': engine,
+                'persistence': persistence,
+                'prediction_series_id': prediction_series.id if prediction_series else None
             },
             'trades': list(trades)
         })
 
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+def sweep_view(request, symbol):
+    """
+    Run a parameter sweep over one symbol and date range. The price series
+    is loaded once and every combination of `grid` (or each entry of
+    `combinations`) is simulated; results come back ranked by `rank_by`.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST requests allowed'}, status=400)
+
+    try:
+        try:
+            data, binary_predictions = read_request(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        try:
+            start_date, end_date = _parse_date_range(data)
+        except ValueError:
+            return JsonResponse({
+                'error': 'Invalid date format. Please use YYYY-MM-DD'
+            }, status=400)
+
+        stock_data = _load_stock_data(symbol, start_date, end_date)
+        if stock_data is None:
+            return _no_data_response(symbol, start_date, end_date)
+
+        try:
+            predictions, prediction_series = resolve_predictions(data, binary_predictions, stock_data, symbol)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        try:
+            # With a binary body the grid arrives JSON-encoded in the query string
+            grid, combinations = data.get('grid'), data.get('combinations')
+            if binary_predictions is not None:
+                grid = json.loads(grid) if grid else None
+                combinations = json.loads(combinations) if combinations else None
+            combinations = expand_parameter_grid(grid=grid, combinations=combinations)
+        except (TypeError, ValueError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if len(combinations) > settings.BACKTEST_SWEEP_MAX_COMBINATIONS:
+            return JsonResponse({
+                'error': (
+                    f'Sweep has {len(combinations)} combinations; the maximum is '
+                    f'{settings.BACKTEST_SWEEP_MAX_COMBINATIONS}'
+                )
+            }, status=400)
+
+        rank_by = data.get('rank_by', 'total_return')
+        if rank_by not in SWEEP_METRICS:
+            return JsonResponse({
+                'error': f"Invalid rank_by '{rank_by}'. Choose from: {', '.join(SWEEP_METRICS)}"
+            }, status=400)
+
+        initial_capital = float(data.get('initial_capital', 10000))
+        top_n = data.get('top_n')
+        persist_top = int(data.get('persist_top', 0))
+
+        stock_data['date'] = pd.to_datetime(stock_data['date'])
+        results = run_parameter_sweep(
+            symbol=symbol,
+            dates=stock_data['date'].dt.date.to_numpy(),
+            close=stock_data['close'].to_numpy(dtype=float),
+            predicted=predictions,
+            combinations=combinations,
+            initial_capital=initial_capital,
+            rank_by=rank_by,
+            top_n=int(top_n) if top_n else None,
+            persist_top=persist_top,
+            prediction_series=prediction_series
+        )
+
+        return JsonResponse({
+            'symbol': symbol,
+            'data_period': {
+                'start_date': stock_data['date'].min().strftime('%Y-%m-%d'),
+                'end_date': stock_data['date'].max().strftime('%Y-%m-%d'),
+                'total_days': len(stock_data)
+            },
+            'initial_capital': initial_capital,
+            'num_combinations': len(combinations),
+            'rank_by': rank_by,
+            'results': results
+        })
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+def _series_summary(series):
+    return {
+        'id': series.id,
+        'symbol': series.stock_symbol,
+        'name': series.name,
+        'start_date': series.start_date.strftime('%Y-%m-%d'),
+        'end_date': series.end_date.strftime('%Y-%m-%d'),
+        'num_points': series.num_points,
+        'created_at': series.created_at.isoformat()
+    }
+
+@csrf_exempt
+def register_predictions_view(request):
+    """
+    Register a prediction series once and reference it from backtests as
+    prediction_series_id. Accepts the same forms as backtest_view: a
+    {date: value} object, a positional list (or binary body) aligned with
+    the stored prices between start_date and end_date.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST requests allowed'}, status=400)
+
+    try:
+        try:
+            data, binary_predictions = read_request(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        symbol = data.get('symbol')
+        if not symbol:
+            return JsonResponse({'error': 'symbol is required'}, status=400)
+
+        predictions = data.get('predictions')
+        try:
+            if binary_predictions is None and isinstance(predictions, dict) and predictions:
+                days, values = parse_date_keyed(predictions)
+            else:
+                start_date, end_date = _parse_date_range(data)
+                stock_data = _load_stock_data(symbol, start_date, end_date)
+                if stock_data is None:
+                    return _no_data_response(symbol, start_date, end_date)
+                values, _ = resolve_predictions(data, binary_predictions, stock_data, symbol)
+                days = to_days(stock_data['date'])
+
+            series = register_prediction_series(symbol, days, values, name=data.get('name', ''))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return JsonResponse(_series_summary(series), status=201)
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+def prediction_series_view(request, series_id):
+    """GET a registered prediction series' summary, or DELETE it"""
+    try:
+        series = PredictionSeries.objects.get(id=series_id)
+    except PredictionSeries.DoesNotExist:
+        return JsonResponse({'error': f'Prediction series {series_id} not found'}, status=404)
+
+    if request.method == 'DELETE':
+        series.delete()
+        return JsonResponse({'deleted': series_id})
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET and DELETE requests allowed'}, status=400)
+
+    return JsonResponse(_series_summary(series))
+
+@csrf_exempt
+def portfolio_backtest_view(request):
+    """
+    Backtest many symbols over one shared pool of capital.
+
+    {"symbols": ["AAPL", "MSFT"], "start_date": ..., "end_date": ...,
+     "predictions": {"AAPL": {date: value} or [values]},
+     "prediction_series_ids": {"MSFT": 12},
+     "max_positions": 10, "position_size": 0.1, ...}
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST requests allowed'}, status=400)
+
+    try:
+        data = json.loads(request.body)
+
+        symbols = data.get('symbols')
+        if not symbols or not isinstance(symbols, list):
+            return JsonResponse({'error': 'Please provide a list of symbols'}, status=400)
+        symbols = list(dict.fromkeys(symbols))
+        if len(symbols) > settings.BACKTEST_PORTFOLIO_MAX_SYMBOLS:
+            return JsonResponse({
+                'error': f'At most {settings.BACKTEST_PORTFOLIO_MAX_SYMBOLS} symbols per portfolio'
+            }, status=400)
+
+        try:
+            start_date, end_date = _parse_date_range(data)
+        except ValueError:
+            return JsonResponse({
+                'error': 'Invalid date format. Please use YYYY-MM-DD'
+            }, status=400)
+
+        days, close = load_price_matrix(symbols, start_date, end_date)
+        empty = [symbol for column, symbol in enumerate(symbols) if np.isnan(close[:, column]).all()]
+        if empty:
+            return _no_data_response(', '.join(empty), start_date, end_date)
+
+        persistence = data.get('persistence', 'deferred')
+        if persistence not in PERSISTENCE_MODES:
+            return JsonResponse({
+                'error': f"Invalid persistence mode '{persistence}'. Choose from: {', '.join(PERSISTENCE_MODES)}"
+            }, status=400)
+
+        try:
+            predicted = resolve_portfolio_predictions(data, symbols, days, close)
+            max_positions = int(data.get('max_positions', 10))
+            if max_positions < 1:
+                raise ValueError('max_positions must be at least 1')
+            parameters = {
+                'initial_capital': float(data.get('initial_capital', 100000)),
+                'max_positions': max_positions,
+                'position_size': float(data.get('position_size', 1.0 / max_positions)),
+                'cash_reserve': float(data.get('cash_reserve', 0)),
+                'prediction_threshold': float(data.get('prediction_threshold', 0.02)),
+                'stop_loss': float(data.get('stop_loss', 0.05)),
+                'take_profit': float(data.get('take_profit', 0.05))
+            }
+        except (TypeError, ValueError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        backtest, result = run_portfolio_backtest(
+            symbols, days, close, predicted, persistence=persistence, **parameters
+        )
+
+        dates = days.astype('datetime64[D]').astype(str)
+        per_symbol = {symbol: {'num_trades': 0, 'profit': 0.0} for symbol in symbols}
+        trades = []
+        for trade in result['trades']:
+            stats = per_symbol[trade['symbol']]
+            stats['num_trades'] += 1
+            stats['profit'] += trade['shares'] * (trade['exit_price'] - trade['entry_price'])
+            trades.append({
+                'symbol': trade['symbol'],
+                'entry_date': dates[trade['entry_index']],
+                'entry_price': trade['entry_price'],
+                'exit_date': dates[trade['exit_index']],
+                'exit_price': trade['exit_price'],
+                'shares': trade['shares'],
+                'profit_loss': trade['profit_loss'],
+                'exit_reason': trade['exit_reason']
+            })
+
+        return JsonResponse({
+            'backtest_id': backtest.id,
+            'symbols': symbols,
+            'final_capital': float(backtest.final_capital),
+            'total_return': float(backtest.total_return),
+            'num_trades': backtest.num_trades,
+            'max_drawdown': float(backtest.max_drawdown),
+            'data_period': {
+                'start_date': dates[0],
+                'end_date': dates[-1],
+                'total_days': len(dates)
+            },
+            'parameters_used': {**parameters, 'persistence': persistence},
+            'per_symbol': per_symbol,
+            'trades': trades
+        })
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+def walk_forward_view(request, symbol):
+    """
+    Walk-forward validation: the strategy is run on rolling windows of
+    `window` bars (or months, with unit='months') advancing by `step`,
+    each starting fresh with initial_capital. The series is loaded once.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST requests allowed'}, status=400)
+
+    try:
+        try:
+            data, binary_predictions = read_request(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        try:
+            start_date, end_date = _parse_date_range(data)
+        except ValueError:
+            return JsonResponse({
+                'error': 'Invalid date format. Please use YYYY-MM-DD'
+            }, status=400)
+
+        stock_data = _load_stock_data(symbol, start_date, end_date)
+        if stock_data is None:
+            return _no_data_response(symbol, start_date, end_date)
+
+        try:
+            predictions, prediction_series = resolve_predictions(data, binary_predictions, stock_data, symbol)
+            params = expand_parameter_grid(combinations=[{
+                name: data[name] for name in SWEEP_PARAMETERS if name in data
+            }])[0]
+            if 'window' not in data:
+                raise ValueError('window is required')
+            windows = walk_forward_windows(
+                stock_data['date'].tolist(),
+                window=int(data['window']),
+                step=int(data.get('step', data['window'])),
+                unit=data.get('unit', 'bars')
+            )
+        except (TypeError, ValueError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if not windows:
+            return JsonResponse({'error': 'The date range is shorter than one window'}, status=400)
+        if len(windows) > settings.BACKTEST_WALK_FORWARD_MAX_WINDOWS:
+            return JsonResponse({
+                'error': (
+                    f'Walk-forward has {len(windows)} windows; the maximum is '
+                    f'{settings.BACKTEST_WALK_FORWARD_MAX_WINDOWS}'
+                )
+            }, status=400)
+
+        initial_capital = float(data.get('initial_capital', 10000))
+        result = run_walk_forward(
+            dates=stock_data['date'].tolist(),
+            close=stock_data['close'].to_numpy(dtype=float),
+            predicted=predictions,
+            windows=windows,
+            params=params,
+            initial_capital=initial_capital
+        )
+
+        return JsonResponse({
+            'symbol': symbol,
+            'data_period': {
+                'start_date': stock_data['date'].min().strftime('%Y-%m-%d'),
+                'end_date': stock_data['date'].max().strftime('%Y-%m-%d'),
+                'total_days': len(stock_data)
+            },
+            'parameters_used': {
+                'initial_capital': initial_capital,
+                **params,
+                'window': int(data['window']),
+                'step': int(data.get('step', data['window'])),
+                'unit': data.get('unit', 'bars'),
+                'prediction_series_id': prediction_series.id if prediction_series else None
+            },
+            'summary': result['summary'],
+            'windows': result['windows']
+        })
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
@@ -0,0 +1,185 @@
+# stock_analyzer/instrumentation.py
+"""
+Per-phase timing for requests and background work.
+
+    with phase('simulate'):
+        result = simulate_ml_strategy(...)
+
+Every phase is recorded in a per-process latency histogram. Phases timed
+while serving a request are also reported back to the client in a
+Server-Timing header by ServerTimingMiddleware; /metrics/ returns the
+histograms as JSON.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# {phase name: [total seconds, count]} for the request being served, if any
+_request_phases = contextvars.ContextVar('request_phases', default=None)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with count, sum and max"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(BUCKETS_MS) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q: float):
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip((*BUCKETS_MS, None), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound if bound is not None else round(self.max_ms, 2)
+        return round(self.max_ms, 2)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, count in zip((*BUCKETS_MS, '+Inf'), self.counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            return {
+                'count': self.count,
+                'sum_ms': round(self.total_ms, 2),
+                'avg_ms': round(self.total_ms / self.count, 2) if self.count else None,
+                'max_ms': round(self.max_ms, 2),
+                'p50_ms': self.quantile(0.5),
+                'p95_ms': self.quantile(0.95),
+                'p99_ms': self.quantile(0.99),
+                'buckets': buckets
+            }
+
+
+class MetricsRegistry:
+    """Named latency histograms, created on first use"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, name: str, seconds: float):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, LatencyHistogram())
+        histogram.observe(seconds * 1000)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {name: histograms[name].snapshot() for name in sorted(histograms)}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+phase_metrics = MetricsRegistry()
+request_metrics = MetricsRegistry()
+
+
+@contextmanager
+def phase(name: str):
+    """Time a block as phase `name`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        phase_metrics.observe(name, elapsed)
+        phases = _request_phases.get()
+        if phases is not None:
+            totals = phases.setdefault(name, [0.0, 0])
+            totals[0] += elapsed
+            totals[1] += 1
+
+
+def _server_timing(phases: Dict, total: float) -> str:
+    entries = [
+        f'{name};dur={seconds * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else '')
+        for name, (seconds, count) in phases.items()
+    ]
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    Collect the phases timed while handling a request into a Server-Timing
+    header, and record each request's latency under its URL name.
+    Async-capable, so async views under ASGI stay on the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = _request_phases.set({})
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            phases = _request_phases.get()
+        finally:
+            _request_phases.reset(token)
+        return self._finish(request, response, phases, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        token = _request_phases.set({})
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            phases = _request_phases.get()
+        finally:
+            _request_phases.reset(token)
+        return self._finish(request, response, phases, time.perf_counter() - start)
+
+    @staticmethod
+    def _finish(request, response, phases, total):
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match else 'unresolved'
+        request_metrics.observe(f'{request.method} {route}', total)
+        response['Server-Timing'] = _server_timing(phases, total)
+        return response
+
+
+@require_GET
+def metrics_view(request):
+    """Latency histograms per phase and per route, plus provider call counters"""
+    from stock_data.services import provider_metrics
+
+    return JsonResponse({
+        'phases': phase_metrics.snapshot(),
+        'requests': request_metrics.snapshot(),
+        'provider': provider_metrics.snapshot()
+    })
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import multiprocessing
 import os
 from dotenv import load_dotenv
 from pathlib import Path
@@ -46,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'stock_analyzer.instrumentation.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,6 +92,28 @@ DATABASES = {
     }
 }
 
+# DB_ENGINE=sqlite runs against a local SQLite file instead (benchmarks, quick local work)
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DB_NAME') or BASE_DIR / 'db.sqlite3',
+    }
+
+# Cache
+# The price cache's invalidation counters live here. The default in-process
+# cache works out of the box but is per process: deployments with several web
+# workers or a separate backfill command must opt in to a shared backend, e.g.
+# CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache with
+# CACHE_LOCATION=django_cache, after creating its table once with
+# python manage.py createcachetable
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'stock_analyzer'),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -130,3 +154,98 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Stock data ingestion
+
+# Point this at a local provider stub (python -m stock_data.provider_stub) in tests
+ALPHA_VANTAGE_BASE_URL = os.environ.get('ALPHA_VANTAGE_BASE_URL', 'https://www.alphavantage.co/query')
+# Provider quota, enforced by a token bucket shared across processes (free tier: 5/min)
+ALPHA_VANTAGE_CALLS_PER_MINUTE = float(os.environ.get('ALPHA_VANTAGE_CALLS_PER_MINUTE', 5))
+ALPHA_VANTAGE_BURST = float(os.environ.get('ALPHA_VANTAGE_BURST', 1))
+ALPHA_VANTAGE_POOL_SIZE = 10
+ALPHA_VANTAGE_CONNECT_TIMEOUT = float(os.environ.get('ALPHA_VANTAGE_CONNECT_TIMEOUT', 5))
+ALPHA_VANTAGE_READ_TIMEOUT = float(os.environ.get('ALPHA_VANTAGE_READ_TIMEOUT', 60))
+# Retries on network errors, 5XX and throttle payloads, with jittered exponential backoff
+ALPHA_VANTAGE_MAX_RETRIES = int(os.environ.get('ALPHA_VANTAGE_MAX_RETRIES', 4))
+ALPHA_VANTAGE_BACKOFF_BASE = float(os.environ.get('ALPHA_VANTAGE_BACKOFF_BASE', 2))
+ALPHA_VANTAGE_BACKOFF_MAX = float(os.environ.get('ALPHA_VANTAGE_BACKOFF_MAX', 60))
+# Compressed raw provider payloads; set the directory to '' to disable.
+# Replay with: python manage.py replay_provider_cache
+ALPHA_VANTAGE_CACHE_DIR = os.environ.get('ALPHA_VANTAGE_CACHE_DIR', str(BASE_DIR / '.provider_cache'))
+ALPHA_VANTAGE_CACHE_TTL = int(os.environ.get('ALPHA_VANTAGE_CACHE_TTL', 12 * 60 * 60))
+ALPHA_VANTAGE_CACHE_MAX_BYTES = int(os.environ.get('ALPHA_VANTAGE_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# Payload format requested from the provider: 'csv' (smaller, parsed column-wise) or 'json'
+ALPHA_VANTAGE_DATATYPE = os.environ.get('ALPHA_VANTAGE_DATATYPE', 'csv')
+
+STOCK_DATA_BULK_BATCH_SIZE = int(os.environ.get('STOCK_DATA_BULK_BATCH_SIZE', 1000))
+# Refreshes request only the latest 100 trading days ('compact') while the
+# newest stored row is at most this many calendar days old
+STOCK_DATA_COMPACT_MAX_GAP_DAYS = int(os.environ.get('STOCK_DATA_COMPACT_MAX_GAP_DAYS', 100))
+# Import jobs without progress for this long are failed as interrupted
+# (their worker was restarted or redeployed)
+IMPORT_JOB_STALE_SECONDS = int(os.environ.get('IMPORT_JOB_STALE_SECONDS', 15 * 60))
+# Worker processes for: python manage.py backfill <files or directories>
+STOCK_DATA_BACKFILL_WORKERS = int(os.environ.get('STOCK_DATA_BACKFILL_WORKERS', os.cpu_count() or 1))
+
+# Daily price table: 'decimal' (StockPrice) or 'compact' (CompactStockPrice:
+# integer cents keyed by a small Ticker id, about half the size). Move
+# existing rows when switching with: python manage.py convert_price_storage
+STOCK_PRICE_STORAGE = os.environ.get('STOCK_PRICE_STORAGE', 'decimal')
+
+# Per-process columnar price cache shared by the history and backtest endpoints
+STOCK_PRICE_CACHE_MAX_BYTES = int(os.environ.get('STOCK_PRICE_CACHE_MAX_BYTES', 256 * 1024 ** 2))
+# Seconds a cached series is served before it is reloaded, even without an invalidation
+STOCK_PRICE_CACHE_TTL = int(os.environ.get('STOCK_PRICE_CACHE_TTL', 300))
+# Rows fetched per round trip when streaming history (?stream=1)
+STOCK_HISTORY_STREAM_CHUNK_SIZE = 2000
+# Keyset pagination of history (?page_size=N&cursor=...)
+STOCK_HISTORY_PAGE_SIZE = 5000
+STOCK_HISTORY_MAX_PAGE_SIZE = 50000
+# Computed indicator series kept per process, keyed by (symbol, indicator, parameters)
+STOCK_INDICATOR_CACHE_SIZE = int(os.environ.get('STOCK_INDICATOR_CACHE_SIZE', 1000))
+
+
+# Backtesting
+
+BACKTEST_SWEEP_MAX_WORKERS = int(os.environ.get('BACKTEST_SWEEP_MAX_WORKERS', os.cpu_count() or 1))
+BACKTEST_SWEEP_MAX_COMBINATIONS = int(os.environ.get('BACKTEST_SWEEP_MAX_COMBINATIONS', 20000))
+# Smaller sweeps run in-process; pool start-up would cost more than it saves
+BACKTEST_SWEEP_MIN_POOL_SIZE = 64
+# How sweep pool workers are started: 'forkserver' or 'spawn'. Forking the
+# threaded server process (with its open DB connections) is not safe.
+BACKTEST_SWEEP_START_METHOD = os.environ.get(
+    'BACKTEST_SWEEP_START_METHOD', 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+BACKTEST_WALK_FORWARD_MAX_WINDOWS = int(os.environ.get('BACKTEST_WALK_FORWARD_MAX_WINDOWS', 5000))
+BACKTEST_PORTFOLIO_MAX_SYMBOLS = int(os.environ.get('BACKTEST_PORTFOLIO_MAX_SYMBOLS', 1000))
+
+
+# Logging
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'standard': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'standard',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        # Set LOG_LEVEL=DEBUG to trace every simulated day of the legacy backtest loop
+        'stock_data': {'level': LOG_LEVEL},
+        'backtesting': {'level': LOG_LEVEL},
+    },
+}
@@ -0,0 +1,66 @@
+import json
+
+from django.test import TestCase
+
+from backtesting.tests import seed
+from stock_data.price_cache import get_price_cache
+
+from .instrumentation import _server_timing, phase_metrics, request_metrics
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        get_price_cache().invalidate()
+        phase_metrics.reset()
+        request_metrics.reset()
+        prices = seed('TIME')
+        self.body = json.dumps({'predictions': (prices['close'] * 1.05).tolist(), 'force': True})
+
+    def backtest(self):
+        response = self.client.post('/backtest/TIME/', self.body, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def timings(self, response):
+        """{name: description or None} from a Server-Timing header, checking every entry has a duration"""
+        entries = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, duration, *description = entry.split(';')
+            self.assertRegex(duration, r'^dur=\d+\.\d$')
+            entries[name] = description[0] if description else None
+        return entries
+
+    def test_server_timing_header(self):
+        # frame_build runs twice: once in the view and once in the engine
+        self.assertEqual(self.timings(self.backtest()), {
+            'db_load': None, 'frame_build': 'desc="x2"', 'simulate': None, 'persist': None, 'total': None
+        })
+
+        response = self.client.post('/api/stocks/history/async/', json.dumps([{'symbol': 'TIME'}]),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('total', self.timings(response))
+
+    def test_server_timing_format(self):
+        self.assertEqual(
+            _server_timing({'db_load': [0.01234, 1], 'parse': [0.002, 3]}, 0.05),
+            'db_load;dur=12.3, parse;dur=2.0;desc="x3", total;dur=50.0'
+        )
+
+    def test_metrics_view_reports_histogram_counts(self):
+        self.backtest()
+        self.backtest()
+        metrics = self.client.get('/metrics/').json()
+
+        self.assertEqual(set(metrics), {'phases', 'requests', 'provider'})
+        self.assertEqual(
+            {name: histogram['count'] for name, histogram in metrics['phases'].items()},
+            {'db_load': 2, 'frame_build': 4, 'simulate': 2, 'persist': 2}
+        )
+        requests = metrics['requests']['POST backtest']
+        self.assertEqual(requests['count'], 2)
+        self.assertEqual(requests['buckets']['+Inf'], 2)
+        self.assertLessEqual(requests['max_ms'], requests['sum_ms'])
+
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.client.post('/metrics/').status_code, 405)
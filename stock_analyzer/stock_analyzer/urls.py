@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from .instrumentation import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('stock_data.urls')),  # Add this line
     path('backtest/', include('backtesting.urls')),
-]
\ No newline at end of file
+    path('metrics/', metrics_view, name='metrics'),
+]
@@ -2,11 +2,31 @@ from django.contrib import admin
 
 # Register your models here.
 from django.contrib import admin
-from .models import StockPrice
+from .models import CompactStockPrice, ImportJob, StockPrice, Ticker
 
 @admin.register(StockPrice)
 class StockPriceAdmin(admin.ModelAdmin):
     list_display = ['symbol', 'date', 'open_price', 'close_price', 'volume']
     list_filter = ['symbol', 'date']
     search_fields = ['symbol']
-    ordering = ['-date']
\ No newline at end of file
+    ordering = ['-date']
+
+@admin.register(Ticker)
+class TickerAdmin(admin.ModelAdmin):
+    list_display = ['id', 'symbol']
+    search_fields = ['symbol']
+    ordering = ['symbol']
+
+@admin.register(CompactStockPrice)
+class CompactStockPriceAdmin(admin.ModelAdmin):
+    list_display = ['ticker', 'date', 'open_price', 'close_price', 'volume']
+    list_filter = ['date']
+    list_select_related = ['ticker']
+    search_fields = ['ticker__symbol']
+    ordering = ['-date']
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'full_resync', 'created_at', 'finished_at']
+    list_filter = ['status']
+    ordering = ['-created_at']
\ No newline at end of file
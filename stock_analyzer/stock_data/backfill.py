@@ -0,0 +1,414 @@
+# stock_data/backfill.py
+"""
+Bulk backfill of daily prices from local dumps, outside the provider's quota.
+
+Accepted files (optionally gzipped):
+- the provider's daily CSV (timestamp,open,high,low,close,volume)
+- any OHLCV CSV with date (or timestamp), open, high, low, close and
+  volume columns, plus an optional symbol column for multi-symbol files
+- the provider's TIME_SERIES_DAILY JSON payload
+
+CSV files are read in chunks with pandas' C parser. On PostgreSQL each
+chunk is COPYed into a temporary staging table and merged into the daily
+price table (StockPrice, or CompactStockPrice with its Ticker rows) with
+one INSERT ... ON CONFLICT per file; other databases go through
+StockDataService.bulk_upsert_prices. Either way a file is loaded in one
+transaction together with its rollup refresh, so a crashed run can be
+resumed file by file from the manifest written by run_backfill().
+"""
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from django.db import connection, connections, transaction
+
+from .models import CompactStockPrice, StockPrice, Ticker, daily_price_model
+from .payloads import PriceColumns, to_cents
+from .price_cache import get_price_cache
+from .rollups import update_rollups
+from .services import StockDataService
+
+COLUMNS = ('symbol', 'date', 'open', 'high', 'low', 'close', 'volume')
+PRICE_COLUMNS = ('open', 'high', 'low', 'close')
+# Header spellings accepted for each column, compared lowercased and stripped
+COLUMN_ALIASES = {
+    'symbol': 'symbol', 'ticker': 'symbol',
+    'date': 'date', 'timestamp': 'date',
+    'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close', 'volume': 'volume',
+}
+PROVIDER_JSON_FIELDS = {'1. open': 'open', '2. high': 'high', '3. low': 'low', '4. close': 'close', '5. volume': 'volume'}
+SUFFIXES = ('.csv', '.csv.gz', '.json', '.json.gz')
+SYMBOL_MAX_LENGTH = StockPrice._meta.get_field('symbol').max_length
+
+
+class BackfillError(ValueError):
+    """A file can't be backfilled (unknown layout, bad symbol, unparsable values)"""
+
+
+def find_files(paths) -> List[Path]:
+    """Backfill files among paths, searching directories recursively, in a stable order"""
+    found = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            found.extend(sorted(p for p in path.rglob('*') if p.is_file() and p.name.lower().endswith(SUFFIXES)))
+        elif path.exists():
+            found.append(path)
+        else:
+            raise BackfillError(f'{path} does not exist')
+    return list(dict.fromkeys(found))
+
+
+def symbol_from_path(path: Path, symbol_regex: Optional[str] = None) -> str:
+    """Symbol for single-symbol files: the regex's first group on the file name, else the name minus its suffix"""
+    name = path.name
+    for suffix in SUFFIXES:
+        if name.lower().endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    if symbol_regex:
+        match = re.search(symbol_regex, path.name)
+        if not match:
+            raise BackfillError(f'{path.name} does not match --symbol-regex')
+        name = match.group(1)
+    return name.upper()
+
+
+def _normalize(frame: pd.DataFrame, symbol: str, skipped: List[int]) -> pd.DataFrame:
+    """Typed COLUMNS frame; rows missing any value are dropped and counted in skipped[0]"""
+    if 'symbol' not in frame:
+        frame['symbol'] = symbol
+    # A blank cell reads as NaN, which astype(str) would turn into the symbol 'NAN'
+    frame['symbol'] = frame['symbol'].fillna('').astype(str).str.strip().str.upper()
+    frame['date'] = pd.to_datetime(frame['date'], format='ISO8601', errors='coerce').dt.normalize()
+    for column in PRICE_COLUMNS:
+        frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    frame['volume'] = pd.to_numeric(frame['volume'], errors='coerce')
+
+    complete = frame[list(COLUMNS)].notna().all(axis=1) & (frame['symbol'] != '')
+    skipped[0] += int((~complete).sum())
+    frame = frame.loc[complete, list(COLUMNS)]
+    frame['volume'] = frame['volume'].astype(np.int64)
+
+    too_long = frame['symbol'].str.len() > SYMBOL_MAX_LENGTH
+    if too_long.any():
+        raise BackfillError(f"Symbol {frame['symbol'][too_long].iloc[0]!r} is longer than {SYMBOL_MAX_LENGTH} characters")
+    return frame
+
+
+def read_chunks(path: Path, symbol_regex: Optional[str] = None, chunk_size: int = 200_000,
+                skipped: Optional[List[int]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield a file's rows as frames with COLUMNS, at most chunk_size rows each.
+    Rows with a missing or unparsable value are dropped and counted in
+    skipped[0]. Raises BackfillError if the file can't be read at all.
+    """
+    skipped = skipped if skipped is not None else [0]
+    lower = path.name.lower()
+
+    if lower.endswith(('.json', '.json.gz')):
+        with (gzip.open(path, 'rt') if lower.endswith('.gz') else open(path)) as f:
+            try:
+                payload = json.load(f)
+            except ValueError as e:
+                raise BackfillError(f'{path.name} is not valid JSON: {e}')
+        if 'Error Message' in payload or 'Time Series (Daily)' not in payload:
+            raise BackfillError(f'{path.name} is not a TIME_SERIES_DAILY payload')
+        symbol = payload.get('Meta Data', {}).get('2. Symbol') or symbol_from_path(path, symbol_regex)
+        frame = pd.DataFrame.from_dict(payload['Time Series (Daily)'], orient='index')
+        frame = frame.rename(columns=PROVIDER_JSON_FIELDS).rename_axis('date').reset_index()
+        if frame.empty:
+            return
+        yield _normalize(frame, symbol, skipped)
+        return
+
+    header = pd.read_csv(path, nrows=0).columns
+    columns = {name: COLUMN_ALIASES[name.strip().lower()] for name in header if name.strip().lower() in COLUMN_ALIASES}
+    missing = {'date', *PRICE_COLUMNS, 'volume'} - set(columns.values())
+    if missing:
+        raise BackfillError(f"{path.name} has no {', '.join(sorted(missing))} column")
+
+    symbol = None if 'symbol' in columns.values() else symbol_from_path(path, symbol_regex)
+    for frame in pd.read_csv(path, usecols=list(columns), dtype=str, chunksize=chunk_size):
+        yield _normalize(frame.rename(columns=columns), symbol, skipped)
+
+
+# PostgreSQL: COPY into a staging table, then one merge per file. The
+# bigserial keeps file order so the last row for a (symbol, date) wins.
+_STAGE_SQL = '''
+    CREATE TEMPORARY TABLE backfill_stage (
+        seq bigserial,
+        symbol varchar({max_length}) NOT NULL,
+        date date NOT NULL,
+        open_price numeric(10, 2) NOT NULL,
+        high_price numeric(10, 2) NOT NULL,
+        low_price numeric(10, 2) NOT NULL,
+        close_price numeric(10, 2) NOT NULL,
+        volume bigint NOT NULL
+    ) ON COMMIT DROP
+'''
+_COPY_SQL = (
+    'COPY backfill_stage (symbol, date, open_price, high_price, low_price, close_price, volume) '
+    'FROM STDIN WITH (FORMAT csv)'
+)
+_MERGE_SQL = '''
+    WITH latest AS (
+        SELECT DISTINCT ON (symbol, date) symbol, date, open_price, high_price, low_price, close_price, volume
+        FROM backfill_stage
+        ORDER BY symbol, date, seq DESC
+    ), written AS (
+        INSERT INTO {table} AS stored
+            (symbol, date, open_price, high_price, low_price, close_price, volume, created_at, updated_at)
+        SELECT symbol, date, open_price, high_price, low_price, close_price, volume, now(), now()
+        FROM latest
+        ON CONFLICT (symbol, date) DO UPDATE SET
+            open_price = EXCLUDED.open_price,
+            high_price = EXCLUDED.high_price,
+            low_price = EXCLUDED.low_price,
+            close_price = EXCLUDED.close_price,
+            volume = EXCLUDED.volume,
+            updated_at = EXCLUDED.updated_at
+        WHERE (stored.open_price, stored.high_price, stored.low_price, stored.close_price, stored.volume)
+            IS DISTINCT FROM
+            (EXCLUDED.open_price, EXCLUDED.high_price, EXCLUDED.low_price, EXCLUDED.close_price, EXCLUDED.volume)
+        RETURNING stored.symbol, stored.date, (stored.xmax = 0) AS inserted
+    )
+    SELECT symbol, min(date), count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+    FROM written
+    GROUP BY symbol
+'''
+# The same merge into CompactStockPrice. Tickers are created first, in their
+# own statement so the merge can join them; staged prices become integer cents.
+_TICKER_SQL = '''
+    INSERT INTO {ticker_table} (symbol)
+    SELECT DISTINCT symbol FROM backfill_stage
+    ON CONFLICT (symbol) DO NOTHING
+'''
+_COMPACT_MERGE_SQL = '''
+    WITH latest AS (
+        SELECT DISTINCT ON (symbol, date) symbol, date, open_price, high_price, low_price, close_price, volume
+        FROM backfill_stage
+        ORDER BY symbol, date, seq DESC
+    ), written AS (
+        INSERT INTO {table} AS stored
+            (ticker_id, date, open_price, high_price, low_price, close_price, volume, updated_at)
+        SELECT ticker.id, latest.date, (latest.open_price * 100)::integer, (latest.high_price * 100)::integer,
+            (latest.low_price * 100)::integer, (latest.close_price * 100)::integer, latest.volume, now()
+        FROM latest
+        JOIN {ticker_table} AS ticker ON ticker.symbol = latest.symbol
+        ON CONFLICT (ticker_id, date) DO UPDATE SET
+            open_price = EXCLUDED.open_price,
+            high_price = EXCLUDED.high_price,
+            low_price = EXCLUDED.low_price,
+            close_price = EXCLUDED.close_price,
+            volume = EXCLUDED.volume,
+            updated_at = EXCLUDED.updated_at
+        WHERE (stored.open_price, stored.high_price, stored.low_price, stored.close_price, stored.volume)
+            IS DISTINCT FROM
+            (EXCLUDED.open_price, EXCLUDED.high_price, EXCLUDED.low_price, EXCLUDED.close_price, EXCLUDED.volume)
+        RETURNING stored.ticker_id, stored.date, (stored.xmax = 0) AS inserted
+    )
+    SELECT ticker.symbol, min(written.date), count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+    FROM written
+    JOIN {ticker_table} AS ticker ON ticker.id = written.ticker_id
+    GROUP BY ticker.symbol
+'''
+
+
+def _copy(cursor, data: str):
+    if hasattr(cursor.cursor, 'copy_expert'):  # psycopg2
+        cursor.copy_expert(_COPY_SQL, io.StringIO(data))
+    else:  # psycopg 3
+        with cursor.copy(_COPY_SQL) as copy:
+            copy.write(data)
+
+
+def _copy_data(frame: pd.DataFrame) -> str:
+    """
+    A frame as COPY input, prices already rounded to cents with to_cents
+    (half to even, like bulk_upsert_prices) rather than by Postgres's
+    numeric cast, which rounds half away from zero.
+    """
+    cents = {column: to_cents(frame[column].to_numpy()) / 100 for column in PRICE_COLUMNS}
+    return frame.assign(**cents).to_csv(header=False, index=False, float_format='%.2f', date_format='%Y-%m-%d')
+
+
+def _load_postgresql(chunks) -> tuple:
+    """(counts, symbols whose rows changed) after staging every chunk and merging once"""
+    counts = {'rows': 0, 'inserted': 0, 'updated': 0, 'symbols': set()}
+    with connection.cursor() as cursor:
+        cursor.execute(_STAGE_SQL.format(max_length=SYMBOL_MAX_LENGTH))
+        for frame in chunks:
+            counts['rows'] += len(frame)
+            counts['symbols'].update(frame['symbol'].unique())
+            _copy(cursor, _copy_data(frame))
+
+        quote = connection.ops.quote_name
+        if daily_price_model() is CompactStockPrice:
+            ticker_table = quote(Ticker._meta.db_table)
+            cursor.execute(_TICKER_SQL.format(ticker_table=ticker_table))
+            cursor.execute(_COMPACT_MERGE_SQL.format(
+                table=quote(CompactStockPrice._meta.db_table), ticker_table=ticker_table
+            ))
+        else:
+            cursor.execute(_MERGE_SQL.format(table=quote(StockPrice._meta.db_table)))
+        written = cursor.fetchall()
+
+    for symbol, since, inserted, updated in written:
+        counts['inserted'] += inserted
+        counts['updated'] += updated
+        update_rollups(symbol, since=since)
+    return counts, [symbol for symbol, *_ in written]
+
+
+def _load_generic(chunks) -> tuple:
+    """_load_postgresql for other databases, by way of bulk_upsert_prices (which also refreshes rollups)"""
+    counts = {'rows': 0, 'inserted': 0, 'updated': 0, 'symbols': set()}
+    changed = set()
+    for frame in chunks:
+        counts['rows'] += len(frame)
+        frame = frame.drop_duplicates(['symbol', 'date'], keep='last')
+        for symbol, group in frame.groupby('symbol', sort=False):
+            counts['symbols'].add(symbol)
+            prices = PriceColumns.from_values(*(group[column].to_numpy() for column in COLUMNS[1:]))
+            written = StockDataService.bulk_upsert_prices(symbol, prices)
+            counts['inserted'] += written['inserted']
+            counts['updated'] += written['updated']
+            if written['inserted'] or written['updated']:
+                changed.add(symbol)
+    return counts, sorted(changed)
+
+
+def load_file(path: str, symbol_regex: Optional[str] = None, chunk_size: int = 200_000) -> Dict:
+    """
+    Load one file in a single transaction and refresh the rollups of the
+    symbols it changed. Returns rows/inserted/updated/unchanged/skipped
+    counts, the symbols seen and the elapsed seconds.
+    """
+    started = time.perf_counter()
+    skipped = [0]
+    chunks = read_chunks(Path(path), symbol_regex, chunk_size, skipped)
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            counts, changed = _load_postgresql(chunks)
+        else:
+            counts, changed = _load_generic(chunks)
+
+    for symbol in changed:
+        get_price_cache().invalidate(symbol)
+
+    return {
+        'rows': counts['rows'],
+        'inserted': counts['inserted'],
+        'updated': counts['updated'],
+        'unchanged': counts['rows'] - counts['inserted'] - counts['updated'],
+        'skipped': skipped[0],
+        'symbols': sorted(counts['symbols']),
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+
+
+def _init_backfill_worker():
+    import django
+    django.setup()
+
+
+def _backfill_worker(task):
+    path, symbol_regex, chunk_size = task
+    try:
+        return path, load_file(path, symbol_regex, chunk_size), None
+    except Exception as e:
+        return path, None, f'{type(e).__name__}: {e}'
+    finally:
+        connections.close_all()
+
+
+class Manifest:
+    """
+    Per-file backfill state in a JSON file, keyed by path. A file counts as
+    done while its size and modification time match what was loaded.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.entries = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    @staticmethod
+    def _stamp(path: Path) -> Dict:
+        stat = path.stat()
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def is_done(self, path: Path) -> bool:
+        entry = self.entries.get(str(path))
+        return bool(entry) and entry.get('status') == 'done' and all(
+            entry.get(key) == value for key, value in self._stamp(path).items()
+        )
+
+    def record(self, path: Path, status: str, **details):
+        self.entries[str(path)] = {'status': status, **self._stamp(path), **details}
+        # Write-then-rename, so an interrupted run never leaves a truncated manifest
+        with tempfile.NamedTemporaryFile('w', dir=self.path.parent, delete=False) as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(f.name, self.path)
+
+
+def run_backfill(paths, manifest_path, workers: int = 1, symbol_regex: Optional[str] = None,
+                 chunk_size: int = 200_000, restart: bool = False,
+                 progress: Optional[Callable] = None) -> Dict:
+    """
+    Load every backfill file under paths with a pool of worker processes,
+    skipping files the manifest records as already loaded unless restart.
+    SQLite always loads one file at a time.
+    progress(path, result, error, done, total) is called as files finish.
+    Returns totals across the files loaded by this run.
+    """
+    manifest = Manifest(manifest_path)
+    files = [path for path in find_files(paths) if path.resolve() != manifest.path.resolve()]
+    pending = files if restart else [path for path in files if not manifest.is_done(path)]
+    totals = {
+        'files': len(files), 'skipped_files': len(files) - len(pending), 'loaded_files': 0, 'failed_files': 0,
+        'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'seconds': 0.0
+    }
+    if not pending:
+        return totals
+
+    started = time.perf_counter()
+    tasks = [(str(path), symbol_regex, chunk_size) for path in pending]
+    if connection.vendor == 'sqlite':
+        workers = 1  # a single writer at a time; parallel loads would only wait on the lock
+    # Forked workers must open their own connections
+    connections.close_all()
+
+    def finished(path, result, error, done):
+        path = Path(path)
+        if error:
+            totals['failed_files'] += 1
+            manifest.record(path, 'failed', error=error)
+        else:
+            totals['loaded_files'] += 1
+            for key in ('rows', 'inserted', 'updated', 'unchanged', 'skipped'):
+                totals[key] += result[key]
+            manifest.record(path, 'done', **{key: value for key, value in result.items() if key != 'symbols'})
+        if progress:
+            progress(path, result, error, done, len(pending))
+
+    if workers <= 1:
+        for done, task in enumerate(tasks, 1):
+            path, result, error = _backfill_worker(task)
+            finished(path, result, error, done)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_backfill_worker) as executor:
+            futures = [executor.submit(_backfill_worker, task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                finished(*future.result(), done)
+
+    totals['seconds'] = round(time.perf_counter() - started, 3)
+    return totals
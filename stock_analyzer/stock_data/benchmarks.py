@@ -0,0 +1,261 @@
+# stock_data/benchmarks.py
+"""
+Reproducible benchmarks for ingestion, the history endpoint and backtests.
+
+Run with: python manage.py benchmark --output results.json [--compare baseline.json]
+
+Everything runs inside a throwaway test database created from the
+configured DATABASES (set DB_ENGINE=sqlite for SQLite, or point the DB_*
+variables at a local Postgres). Prices come from the deterministic
+synthetic generator in provider_stub with a fixed end date, so two runs
+on the same commit and machine do the same work.
+"""
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import date
+
+import django
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.test import Client, override_settings
+
+from .models import daily_price_model
+from .payloads import PriceColumns
+from .price_cache import get_price_cache
+from .provider_stub import ProviderStub, synthetic_daily_prices
+
+END_DATE = date(2024, 12, 31)
+TWENTY_YEARS = 5040  # trading days
+
+DEFAULT_SYMBOL_COUNTS = (1, 10, 100, 1000)
+DEFAULT_SERIES_LENGTHS = (1000, 5040, 20000)
+# Fraction of days on which the synthetic predictions signal an entry
+TRADE_DENSITIES = {'sparse': 0.01, 'medium': 0.1, 'dense': 0.5}
+
+
+def _symbol(index: int) -> str:
+    return f'BM{index:04d}'
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summarize(times: list, **extra) -> dict:
+    return {
+        'runs': len(times),
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'mean_s': statistics.fmean(times),
+        'max_s': max(times),
+        **extra
+    }
+
+
+def _time(function, repeat: int, setup=None) -> list:
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+@contextmanager
+def _provider_stub(num_days: int):
+    """Local provider with the quota, retries and response cache out of the way"""
+    with ProviderStub(num_days=num_days, end_date=END_DATE) as stub:
+        with override_settings(
+            ALPHA_VANTAGE_BASE_URL=stub.url,
+            ALPHA_VANTAGE_CACHE_DIR='',
+            ALPHA_VANTAGE_CALLS_PER_MINUTE=10 ** 9,
+            ALPHA_VANTAGE_BURST=10 ** 9,
+            ALPHA_VANTAGE_MAX_RETRIES=0
+        ):
+            yield stub
+
+
+def seed_prices(symbols, num_days: int = TWENTY_YEARS, batch_size: int = 5000):
+    """
+    Insert synthetic daily rows for symbols that don't have them yet, into
+    the configured daily price table (see STOCK_PRICE_STORAGE)
+    """
+    from .services import StockDataService
+
+    model = daily_price_model()
+    existing = set(
+        model.objects.filter(**{f'{model.symbol_path}__in': symbols})
+        .values_list(model.symbol_path, flat=True).distinct()
+    )
+    for symbol in symbols:
+        if symbol in existing:
+            continue
+        prices = synthetic_daily_prices(symbol, num_days, END_DATE)
+        StockDataService.bulk_upsert_prices(
+            symbol,
+            PriceColumns.from_values(*(prices[name] for name in ('date', 'open', 'high', 'low', 'close', 'volume'))),
+            batch_size=batch_size
+        )
+
+
+def bench_ingestion(repeat: int, num_symbols: int = 5, num_days: int = TWENTY_YEARS) -> dict:
+    """fetch_stock_data against the provider stub: first import, unchanged re-import, compact refresh"""
+    from .tasks import fetch_stock_data
+
+    symbols = [f'IN{index:04d}' for index in range(num_symbols)]
+    results = {}
+
+    def clear():
+        model = daily_price_model()
+        model.objects.filter(**{f'{model.symbol_path}__in': symbols}).delete()
+
+    def fetch_all(full_resync):
+        for symbol in symbols:
+            fetch_stock_data(symbol, full_resync=full_resync)
+
+    with _provider_stub(num_days):
+        params = {'symbols': num_symbols, 'days': num_days}
+        results[f'ingest.initial[symbols={num_symbols},days={num_days}]'] = _summarize(
+            _time(lambda: fetch_all(True), repeat, setup=clear), rows=num_symbols * num_days, **params
+        )
+        results[f'ingest.unchanged_resync[symbols={num_symbols},days={num_days}]'] = _summarize(
+            _time(lambda: fetch_all(True), repeat), rows=num_symbols * num_days, **params
+        )
+
+        # Compact fetches only happen when the stored history is recent; the
+        # series still ends at END_DATE, however old that is by now
+        with override_settings(STOCK_DATA_COMPACT_MAX_GAP_DAYS=10 ** 6):
+            results[f'ingest.compact_refresh[symbols={num_symbols}]'] = _summarize(
+                _time(lambda: fetch_all(False), repeat), symbols=num_symbols
+            )
+
+    clear()
+    return results
+
+
+def bench_history(repeat: int, symbol_counts=DEFAULT_SYMBOL_COUNTS, num_days: int = TWENTY_YEARS) -> dict:
+    """POST /api/stocks/history/ for N symbols x num_days, with a cold and a warm price cache"""
+    client = Client()
+    results = {}
+
+    seed_prices([_symbol(index) for index in range(max(symbol_counts))], num_days)
+
+    for count in symbol_counts:
+        body = json.dumps([{'symbol': _symbol(index)} for index in range(count)])
+
+        def request():
+            response = client.post('/api/stocks/history/', body, content_type='application/json')
+            assert response.status_code == 200, response.content[:200]
+
+        params = {'symbols': count, 'days': num_days, 'rows': count * num_days}
+        results[f'history.cold[symbols={count}]'] = _summarize(
+            _time(request, repeat, setup=get_price_cache().invalidate), **params
+        )
+        results[f'history.warm[symbols={count}]'] = _summarize(_time(request, repeat), **params)
+
+    return results
+
+
+def _backtest_inputs(length: int, density: float):
+    """A deterministic close series and predictions that signal on about `density` of the days"""
+    rng = np.random.default_rng(length)
+    close = 50 * np.exp(np.cumsum(rng.normal(0.0002, 0.015, length)))
+    signal = rng.random(length) < density
+    predicted = close * np.where(signal, 1.05, 1.0)
+    days = np.busday_offset(np.datetime64(END_DATE, 'D'), -np.arange(length)[::-1], roll='backward')
+    return days.astype('datetime64[D]').tolist(), close, predicted
+
+
+def bench_backtest(repeat: int, series_lengths=DEFAULT_SERIES_LENGTHS, engines=('vectorized',)) -> dict:
+    """run_ml_backtest, including persistence, per series length, trade density and engine"""
+    import pandas as pd
+    from backtesting.services import run_ml_backtest
+
+    results = {}
+    for length in series_lengths:
+        for density_name, density in TRADE_DENSITIES.items():
+            dates, close, predicted = _backtest_inputs(length, density)
+            stock_data = pd.DataFrame({'date': dates, 'close': close, 'predicted_price': predicted})
+
+            for engine in engines:
+                outcome = {}
+
+                def run():
+                    outcome['trades'] = run_ml_backtest(stock_data, 'BENCH', engine=engine).num_trades
+
+                times = _time(run, repeat)
+                results[f'backtest.{engine}[days={length},density={density_name}]'] = _summarize(
+                    times, days=length, density=density, trades=outcome['trades']
+                )
+    return results
+
+
+def run_benchmarks(suites=('ingestion', 'history', 'backtest'), repeat: int = 3,
+                   symbol_counts=DEFAULT_SYMBOL_COUNTS, series_lengths=DEFAULT_SERIES_LENGTHS,
+                   engines=('vectorized',), progress=None) -> dict:
+    """Run the selected suites in a fresh test database and return the report"""
+    logging.disable(logging.WARNING)
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    # The history suite goes through the test client, which sends Host: testserver
+    allowed_hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'])
+    allowed_hosts.enable()
+    try:
+        results = {}
+        for suite in suites:
+            if progress:
+                progress(f'Running {suite} benchmarks')
+            if suite == 'ingestion':
+                results.update(bench_ingestion(repeat))
+            elif suite == 'history':
+                results.update(bench_history(repeat, symbol_counts))
+            elif suite == 'backtest':
+                results.update(bench_backtest(repeat, series_lengths, engines))
+            else:
+                raise ValueError(f'Unknown benchmark suite: {suite}')
+    finally:
+        allowed_hosts.disable()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        logging.disable(logging.NOTSET)
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'database': connection.vendor,
+            'price_storage': settings.STOCK_PRICE_STORAGE,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'repeat': repeat
+        },
+        'results': results
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float = 0.1) -> list:
+    """
+    (case, baseline median, current median, ratio, regressed) for every case
+    in both reports; regressed means slower than baseline by over threshold.
+    """
+    rows = []
+    for case, current in report['results'].items():
+        previous = baseline.get('results', {}).get(case)
+        if previous is None:
+            continue
+        ratio = current['median_s'] / previous['median_s'] if previous['median_s'] else float('inf')
+        rows.append((case, previous['median_s'], current['median_s'], ratio, ratio > 1 + threshold))
+    return rows
@@ -0,0 +1,183 @@
+# stock_data/indicators.py
+"""
+Technical indicators computed over a symbol's stored daily closes.
+
+Every indicator is a function (close, start, state, **params) returning
+(outputs, state): outputs hold the values for close[start:] and state is
+whatever it needs to continue from the last bar. Called with start=0 and
+no state it computes the whole series; IndicatorCache uses start/state to
+extend a memoized result when new bars arrive instead of recomputing it.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+
+def _ewm(values: np.ndarray, alpha: float, prev: Optional[float] = None) -> np.ndarray:
+    """Exponential moving average seeded with prev, or with the first value"""
+    if prev is None:
+        return pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    return pd.Series(np.r_[prev, values]).ewm(alpha=alpha, adjust=False).mean().to_numpy()[1:]
+
+
+def _rolling(close: np.ndarray, start: int, period: int) -> Tuple:
+    """Rolling window over just enough history for close[start:], and how many leading values to drop"""
+    offset = max(0, start - period + 1)
+    return pd.Series(close[offset:]).rolling(period), start - offset
+
+
+def sma(close, start=0, state=None, period=20):
+    rolling, skip = _rolling(close, start, period)
+    return {'sma': rolling.mean().to_numpy()[skip:]}, None
+
+
+def ema(close, start=0, state=None, period=20):
+    values = _ewm(close[start:], 2.0 / (period + 1), state)
+    return {'ema': values}, (values[-1] if len(values) else state)
+
+
+def _rsi_values(gains: np.ndarray, losses: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(losses == 0, 100.0, 100.0 - 100.0 / (1.0 + gains / losses))
+
+
+def rsi(close, start=0, state=None, period=14):
+    """
+    Wilder's RSI: average gain and loss start as the simple mean of the
+    first period changes and are then smoothed by 1/period. The first
+    period bars are NaN; until they have passed there is no state, and
+    an extension recomputes from the first bar.
+    """
+    if state is None:
+        values = np.full(len(close), np.nan)
+        changes = np.diff(close)
+        if len(changes) < period:
+            return {'rsi': values[start:]}, None
+
+        gains, losses = np.clip(changes, 0, None), np.clip(-changes, 0, None)
+        gains = np.r_[gains[:period].mean(), _ewm(gains[period:], 1.0 / period, gains[:period].mean())]
+        losses = np.r_[losses[:period].mean(), _ewm(losses[period:], 1.0 / period, losses[:period].mean())]
+        values[period:] = _rsi_values(gains, losses)
+        return {'rsi': values[start:]}, (gains[-1], losses[-1])
+
+    changes = np.diff(close[start - 1:])
+    gains = _ewm(np.clip(changes, 0, None), 1.0 / period, state[0])
+    losses = _ewm(np.clip(-changes, 0, None), 1.0 / period, state[1])
+    if len(gains):
+        state = (gains[-1], losses[-1])
+    return {'rsi': _rsi_values(gains, losses)}, state
+
+
+def macd(close, start=0, state=None, fast=12, slow=26, signal=9):
+    fast_prev, slow_prev, signal_prev = state or (None, None, None)
+    fast_ema = _ewm(close[start:], 2.0 / (fast + 1), fast_prev)
+    slow_ema = _ewm(close[start:], 2.0 / (slow + 1), slow_prev)
+    line = fast_ema - slow_ema
+    signal_line = _ewm(line, 2.0 / (signal + 1), signal_prev)
+
+    if len(line):
+        state = (fast_ema[-1], slow_ema[-1], signal_line[-1])
+    return {'macd': line, 'signal': signal_line, 'histogram': line - signal_line}, state
+
+
+def bollinger(close, start=0, state=None, period=20, num_std=2.0):
+    rolling, skip = _rolling(close, start, period)
+    middle = rolling.mean().to_numpy()[skip:]
+    deviation = rolling.std(ddof=0).to_numpy()[skip:] * num_std
+    return {'middle': middle, 'upper': middle + deviation, 'lower': middle - deviation}, None
+
+
+# name -> (function, default parameters)
+INDICATORS = {
+    'sma': (sma, {'period': 20}),
+    'ema': (ema, {'period': 20}),
+    'rsi': (rsi, {'period': 14}),
+    'macd': (macd, {'fast': 12, 'slow': 26, 'signal': 9}),
+    'bollinger': (bollinger, {'period': 20, 'num_std': 2.0}),
+}
+
+
+def resolve_params(name: str, params: Dict) -> Dict:
+    """Indicator parameters with defaults filled in; raises ValueError if invalid"""
+    if name not in INDICATORS:
+        raise ValueError(f"Unknown indicator '{name}'. Available: {', '.join(INDICATORS)}")
+
+    defaults = INDICATORS[name][1]
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown parameters for {name}: {', '.join(sorted(unknown))}")
+
+    resolved = {}
+    for key, default in defaults.items():
+        value = params.get(key, default)
+        try:
+            value = type(default)(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{name} {key} must be a number')
+        if value <= 0:
+            raise ValueError(f'{name} {key} must be positive')
+        resolved[key] = value
+    return resolved
+
+
+class IndicatorCache:
+    """
+    Per-process LRU of computed indicators keyed by (symbol, name, params).
+
+    An entry remembers the dates and closes it was computed from. When the
+    current series starts with exactly those bars, only the new ones are
+    computed; any change to already-seen bars triggers a full recompute.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (dates, close, outputs, state)
+        self._lock = threading.Lock()
+
+    def compute(self, series, name: str, params: Dict) -> Dict[str, np.ndarray]:
+        """Outputs for every bar of series (a full PriceSeries), aligned with series.dates"""
+        function = INDICATORS[name][0]
+        key = (series.symbol, name, tuple(sorted(params.items())))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        outputs = None
+        if entry is not None:
+            dates, close, cached, state = entry
+            seen = len(dates)
+            if (seen <= len(series)
+                    and np.array_equal(series.dates[:seen], dates)
+                    and np.array_equal(series.close[:seen], close)):
+                if seen == len(series):
+                    return cached
+                extra, state = function(series.close, seen, state, **params)
+                outputs = {field: np.concatenate([cached[field], extra[field]]) for field in cached}
+
+        if outputs is None:
+            outputs, state = function(series.close, 0, None, **params)
+
+        with self._lock:
+            self._entries[key] = (series.dates.copy(), series.close.copy(), outputs, state)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return outputs
+
+
+_indicator_cache = None
+_indicator_cache_lock = threading.Lock()
+
+
+def get_indicator_cache() -> IndicatorCache:
+    global _indicator_cache
+    with _indicator_cache_lock:
+        if _indicator_cache is None:
+            _indicator_cache = IndicatorCache(settings.STOCK_INDICATOR_CACHE_SIZE)
+    return _indicator_cache
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from stock_data.backfill import BackfillError, run_backfill
+
+
+class Command(BaseCommand):
+    help = 'Load daily prices from local provider CSV/JSON dumps or OHLCV CSV files, without the provider quota'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Files or directories (searched for .csv, .json and .gz)')
+        parser.add_argument('--workers', type=int, default=settings.STOCK_DATA_BACKFILL_WORKERS,
+                            help='Worker processes, one file each at a time')
+        parser.add_argument('--manifest', default='backfill-manifest.json',
+                            help='Progress file used to skip already loaded files on the next run')
+        parser.add_argument('--restart', action='store_true', help='Reload every file, ignoring the manifest')
+        parser.add_argument('--symbol-regex',
+                            help="Regex whose first group is the symbol in a file name, e.g. 'daily_(\\w+)\\.csv' "
+                                 '(default: the name without its extension; unused for files with a symbol column)')
+        parser.add_argument('--chunk-size', type=int, default=200_000, help='CSV rows parsed and staged at a time')
+
+    def handle(self, *args, **options):
+        def progress(path, result, error, done, total):
+            prefix = f'[{done}/{total}] {path}'
+            if error:
+                self.stderr.write(f'{prefix}: {error}')
+                return
+            rate = result['rows'] / result['seconds'] * 60 if result['seconds'] else 0
+            self.stdout.write(
+                f"{prefix}: {result['rows']} rows for {len(result['symbols'])} symbols, "
+                f"{result['inserted']} inserted, {result['updated']} updated, {result['unchanged']} unchanged, "
+                f"{result['skipped']} skipped ({rate:,.0f} rows/min)"
+            )
+
+        try:
+            totals = run_backfill(
+                options['paths'],
+                options['manifest'],
+                workers=options['workers'],
+                symbol_regex=options['symbol_regex'],
+                chunk_size=options['chunk_size'],
+                restart=options['restart'],
+                progress=progress
+            )
+        except BackfillError as e:
+            raise CommandError(str(e))
+
+        rate = totals['rows'] / totals['seconds'] * 60 if totals['seconds'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {totals['loaded_files']} files ({totals['failed_files']} failed, "
+            f"{totals['skipped_files']} already done): {totals['rows']} rows, {totals['inserted']} inserted, "
+            f"{totals['updated']} updated in {totals['seconds']:.1f}s ({rate:,.0f} rows/min)"
+        ))
+        if totals['failed_files']:
+            raise CommandError(f"{totals['failed_files']} files failed; rerun to retry them")
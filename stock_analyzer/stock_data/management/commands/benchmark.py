@@ -0,0 +1,76 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stock_data.benchmarks import (
+    DEFAULT_SERIES_LENGTHS, DEFAULT_SYMBOL_COUNTS, compare, run_benchmarks
+)
+
+SUITES = ('ingestion', 'history', 'backtest')
+
+
+def _int_list(value):
+    return tuple(int(item) for item in value.split(',') if item)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ingestion, the history endpoint and backtests against a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suites', nargs='*', help=f"Suites to run: {', '.join(SUITES)} (default: all)")
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case')
+        parser.add_argument('--symbols', type=_int_list, default=DEFAULT_SYMBOL_COUNTS,
+                            help='Comma separated symbol counts for the history suite')
+        parser.add_argument('--lengths', type=_int_list, default=DEFAULT_SERIES_LENGTHS,
+                            help='Comma separated series lengths for the backtest suite')
+        parser.add_argument('--legacy', action='store_true', help='Also time the legacy backtest engine')
+        parser.add_argument('--quick', action='store_true', help='Small sizes and one run per case, for smoke testing')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--compare', help='Baseline JSON report to compare medians against')
+        parser.add_argument('--threshold', type=float, default=0.1,
+                            help='Slowdown over the baseline, as a fraction, that counts as a regression')
+
+    def handle(self, *args, **options):
+        unknown = set(options['suites']) - set(SUITES)
+        if unknown:
+            raise CommandError(f"Unknown suites: {', '.join(sorted(unknown))}")
+
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read baseline {options['compare']}: {e}")
+
+        repeat, symbol_counts, series_lengths = options['repeat'], options['symbols'], options['lengths']
+        if options['quick']:
+            repeat, symbol_counts, series_lengths = 1, (1, 10), (1000,)
+
+        report = run_benchmarks(
+            suites=options['suites'] or SUITES,
+            repeat=repeat,
+            symbol_counts=symbol_counts,
+            series_lengths=series_lengths,
+            engines=('vectorized', 'legacy') if options['legacy'] else ('vectorized',),
+            progress=self.stdout.write
+        )
+
+        for case, result in report['results'].items():
+            self.stdout.write(f"{case:<60} median {result['median_s'] * 1000:10.1f} ms  "
+                              f"min {result['min_s'] * 1000:10.1f} ms")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+
+        if baseline is not None:
+            regressions = 0
+            for case, before, after, ratio, regressed in compare(report, baseline, options['threshold']):
+                regressions += regressed
+                line = f'{case:<60} {before * 1000:10.1f} -> {after * 1000:10.1f} ms  x{ratio:.2f}'
+                self.stdout.write(self.style.ERROR(line) if regressed else line)
+            if regressions:
+                raise CommandError(f'{regressions} cases regressed by more than {options["threshold"]:.0%}')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from stock_data.price_cache import get_price_cache
+from stock_data.storage import to_compact, to_decimal
+
+
+class Command(BaseCommand):
+    help = 'Move stored daily prices between the decimal (StockPrice) and compact (CompactStockPrice) tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('storage', choices=['compact', 'decimal'], help='Layout to move the rows into')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT (default: 5000)')
+
+    def handle(self, *args, **options):
+        def progress(symbol, rows):
+            self.stdout.write(f'{symbol}: {rows} rows moved')
+
+        convert = to_compact if options['storage'] == 'compact' else to_decimal
+        try:
+            moved = convert(batch_size=options['batch_size'], progress=progress)
+        except ValueError as e:
+            raise CommandError(str(e))
+        get_price_cache().invalidate()
+
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} rows to {options['storage']} storage"))
+        if settings.STOCK_PRICE_STORAGE != options['storage']:
+            self.stdout.write(self.style.WARNING(
+                f"STOCK_PRICE_STORAGE is '{settings.STOCK_PRICE_STORAGE}'; "
+                f"set it to '{options['storage']}' to read and write the moved rows"
+            ))
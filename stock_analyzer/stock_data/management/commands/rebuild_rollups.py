@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from stock_data.models import daily_price_model
+from stock_data.rollups import delete_rollups, update_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the weekly and monthly rollup bars from the stored daily rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('symbols', nargs='*', help='Only rebuild these symbols (default: every stored symbol)')
+
+    def handle(self, *args, **options):
+        symbols = [symbol.upper() for symbol in options['symbols']]
+        if not symbols:
+            delete_rollups()
+            model = daily_price_model()
+            symbols = list(
+                model.objects.order_by(model.symbol_path).values_list(model.symbol_path, flat=True).distinct()
+            )
+
+        for symbol in symbols:
+            update_rollups(symbol)
+            self.stdout.write(f'{symbol}: rebuilt')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rollups for {len(symbols)} symbols'))
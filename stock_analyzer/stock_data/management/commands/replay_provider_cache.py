@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stock_data.tasks import replay_cached_prices
+
+
+class Command(BaseCommand):
+    help = 'Rebuild daily price rows from cached provider responses, without network access'
+
+    def add_arguments(self, parser):
+        parser.add_argument('symbols', nargs='*', help='Only replay these symbols (default: everything cached)')
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete existing rows for the replayed symbols (all rows if none given) first'
+        )
+
+    def handle(self, *args, **options):
+        symbols = [symbol.upper() for symbol in options['symbols']] or None
+
+        def progress(symbol, result):
+            if result['status'] == 'success':
+                self.stdout.write(
+                    f"{symbol}: {result['inserted']} inserted, {result['updated']} updated, "
+                    f"{result['unchanged']} unchanged"
+                )
+            else:
+                self.stderr.write(result['message'])
+
+        try:
+            results = replay_cached_prices(symbols, clear=options['clear'], progress=progress)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        failed = sum(1 for result in results.values() if result['status'] != 'success')
+        self.stdout.write(self.style.SUCCESS(f'Replayed {len(results) - failed} symbols ({failed} failed)'))
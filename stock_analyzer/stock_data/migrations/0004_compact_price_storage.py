@@ -0,0 +1,50 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock_data', '0003_price_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompactStockPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('open_price', models.IntegerField()),
+                ('close_price', models.IntegerField()),
+                ('high_price', models.IntegerField()),
+                ('low_price', models.IntegerField()),
+                ('volume', models.BigIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Ticker',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('symbol', models.CharField(max_length=10, unique=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='stockprice',
+            name='stock_data__symbol_3d5dc5_idx',
+        ),
+        migrations.AddField(
+            model_name='compactstockprice',
+            name='ticker',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='stock_data.ticker'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='compactstockprice',
+            unique_together={('ticker', 'date')},
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 
 # Create your models here.
@@ -5,6 +6,10 @@ from django.db import models
 from django.db import models
 
 class StockPrice(models.Model):
+    # How the price accessors query a daily price table; see CompactStockPrice
+    symbol_path = 'symbol'
+    price_scale = 1
+
     symbol = models.CharField(max_length=10)
     date = models.DateField()
     open_price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -16,12 +21,114 @@ class StockPrice(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
+        # The unique constraint's index also serves (symbol, date) range scans
         unique_together = ['symbol', 'date']
         indexes = [
-            models.Index(fields=['symbol', 'date']),
             models.Index(fields=['date']),
         ]
         ordering = ['-date']
 
     def __str__(self):
-        return f"{self.symbol} - {self.date}"
\ No newline at end of file
+        return f"{self.symbol} - {self.date}"
+
+class ImportJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    symbols = models.JSONField()
+    full_resync = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    results = models.JSONField(default=dict)  # per-symbol fetch_stock_data results
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    # Refreshed by the runner as symbols finish; see expire_stale_import_jobs
+    heartbeat_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"Import job {self.id} ({self.status})"
+
+class RateLimitBucket(models.Model):
+    """Shared token bucket state, one row per rate-limited resource"""
+    name = models.CharField(max_length=50, unique=True)
+    tokens = models.FloatField()
+    refilled_at = models.FloatField()  # epoch seconds of the last refill
+
+    def __str__(self):
+        return f"{self.name}: {self.tokens:.2f} tokens"
+
+class PriceRollup(models.Model):
+    """
+    OHLCV bars aggregated from StockPrice over a calendar period.
+    date is the period's first calendar day (Monday, or the 1st of the month).
+    """
+    symbol_path = 'symbol'
+    price_scale = 1
+
+    symbol = models.CharField(max_length=10)
+    date = models.DateField()
+    open_price = models.DecimalField(max_digits=10, decimal_places=2)
+    close_price = models.DecimalField(max_digits=10, decimal_places=2)
+    high_price = models.DecimalField(max_digits=10, decimal_places=2)
+    low_price = models.DecimalField(max_digits=10, decimal_places=2)
+    volume = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+        unique_together = ['symbol', 'date']
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"{self.symbol} - {self.date}"
+
+class WeeklyStockPrice(PriceRollup):
+    class Meta(PriceRollup.Meta):
+        pass
+
+class MonthlyStockPrice(PriceRollup):
+    class Meta(PriceRollup.Meta):
+        pass
+
+class Ticker(models.Model):
+    """Symbols of the compact price storage, referenced by a two-byte id"""
+    id = models.SmallAutoField(primary_key=True)
+    symbol = models.CharField(max_length=10, unique=True)
+
+    def __str__(self):
+        return self.symbol
+
+class CompactStockPrice(models.Model):
+    """
+    Daily bars in the compact storage (STOCK_PRICE_STORAGE = 'compact'):
+    the symbol as a Ticker id and prices as integer cents, with a single
+    (ticker, date) index. Prices are limited to 21,474,836.47.
+    """
+    symbol_path = 'ticker__symbol'
+    price_scale = 100
+
+    # The unique (ticker, date) index covers lookups by ticker
+    ticker = models.ForeignKey(Ticker, on_delete=models.CASCADE, db_index=False)
+    date = models.DateField()
+    open_price = models.IntegerField()
+    close_price = models.IntegerField()
+    high_price = models.IntegerField()
+    low_price = models.IntegerField()
+    volume = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['ticker', 'date']
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"{self.ticker_id} - {self.date}"
+
+def daily_price_model():
+    """The model holding daily bars under the configured STOCK_PRICE_STORAGE"""
+    return CompactStockPrice if settings.STOCK_PRICE_STORAGE == 'compact' else StockPrice
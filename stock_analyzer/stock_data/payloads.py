@@ -0,0 +1,138 @@
+# stock_data/payloads.py
+"""
+Columnar parsing of TIME_SERIES_DAILY payloads.
+
+Both of the provider's formats (datatype=csv and datatype=json) parse
+into PriceColumns, whole columns at a time, and StockDataService.
+bulk_upsert_prices takes PriceColumns as they are.
+"""
+import io
+import json
+from decimal import Decimal
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+CSV_COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+JSON_FIELDS = ('1. open', '2. high', '3. low', '4. close', '5. volume')
+
+
+def to_cents(values) -> np.ndarray:
+    """
+    Prices as int64 hundredths, rounded half to even like
+    Decimal.quantize(Decimal('0.01')). Values go through ten-thousandths
+    first, so inputs with up to four decimals round exactly. Raises
+    ValueError for a missing (NaN) or infinite value.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if not np.isfinite(values).all():
+        raise ValueError('Prices must be finite numbers')
+    ten_thousandths = np.rint(values * 10000).astype(np.int64)
+    cents, remainder = np.divmod(ten_thousandths, 100)
+    return cents + ((remainder > 50) | ((remainder == 50) & (cents % 2 == 1)))
+
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(int(cents)).scaleb(-2)
+
+
+class PriceColumns:
+    """
+    One symbol's daily bars as typed columns, oldest first: dates as
+    datetime64[D], prices as int64 cents (the stored precision) and
+    int64 volumes. When a date repeats, its last bar wins.
+    """
+
+    __slots__ = ('dates', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, dates, open, high, low, close, volume):
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        order = np.argsort(dates, kind='stable')
+        # The last of each run of equal dates, in the given order
+        order = order[np.r_[dates[order][1:] != dates[order][:-1], True]] if len(order) else order
+        self.dates = dates[order]
+        self.open = np.asarray(open, dtype=np.int64)[order]
+        self.high = np.asarray(high, dtype=np.int64)[order]
+        self.low = np.asarray(low, dtype=np.int64)[order]
+        self.close = np.asarray(close, dtype=np.int64)[order]
+        self.volume = np.asarray(volume, dtype=np.int64)[order]
+
+    @classmethod
+    def from_values(cls, dates, open, high, low, close, volume) -> 'PriceColumns':
+        """
+        From float, Decimal or numeric string price columns. Raises
+        ValueError for an unparsable date or a missing or non-numeric value.
+        """
+        volume = np.asarray(volume, dtype=np.float64)
+        if not np.isfinite(volume).all():
+            raise ValueError('Volumes must be finite numbers')
+        return cls(
+            np.asarray(dates, dtype='datetime64[D]'),
+            *(to_cents(column) for column in (open, high, low, close)),
+            volume.astype(np.int64)
+        )
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict]) -> 'PriceColumns':
+        """From StockPrice-style row dicts (date, open_price, ..., volume)"""
+        return cls.from_values(*(
+            [row[field] for row in rows]
+            for field in ('date', 'open_price', 'high_price', 'low_price', 'close_price', 'volume')
+        ))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def prices(self) -> tuple:
+        """(open, high, low, close, volume), in StockPrice's PRICE_FIELDS order"""
+        return self.open, self.high, self.low, self.close, self.volume
+
+
+def parse_daily_csv(payload: bytes) -> PriceColumns:
+    """
+    Parse a datatype=csv payload (timestamp,open,high,low,close,volume)
+    with pandas' C parser. Raises ValueError if any row is malformed.
+    """
+    try:
+        frame = pd.read_csv(io.BytesIO(payload), usecols=list(CSV_COLUMNS), dtype={'timestamp': str})
+    except ValueError as e:  # also pandas' ParserError and EmptyDataError
+        raise ValueError(f'Malformed CSV payload: {e}')
+    try:
+        return PriceColumns.from_values(
+            frame['timestamp'].to_numpy(dtype=str),
+            *(frame[column].to_numpy() for column in CSV_COLUMNS[1:])
+        )
+    except ValueError as e:
+        raise ValueError(f'Malformed CSV payload: {e}')
+
+
+def parse_daily_json(data: Dict) -> PriceColumns:
+    """
+    Columns of a parsed datatype=json payload, converted from one string
+    array. Raises ValueError for an error payload or a malformed day.
+    """
+    if 'Error Message' in data:
+        raise ValueError(f"API Error: {data['Error Message']}")
+
+    time_series = data.get('Time Series (Daily)', {})
+    if not time_series:
+        return PriceColumns.from_values(*([] for _ in CSV_COLUMNS))
+
+    try:
+        values = np.array([[day[field] for field in JSON_FIELDS] for day in time_series.values()])
+        return PriceColumns.from_values(np.array(list(time_series)), *values.T)
+    except KeyError as e:
+        raise ValueError(f'Malformed JSON payload: a day has no {e} field')
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Malformed JSON payload: {e}')
+
+
+def parse_daily_payload(payload: bytes) -> PriceColumns:
+    """
+    Parse a raw TIME_SERIES_DAILY payload of either datatype. The provider
+    answers errors in JSON whatever the datatype; those raise ValueError.
+    """
+    if payload.lstrip()[:1] == b'{':
+        return parse_daily_json(json.loads(payload))
+    return parse_daily_csv(payload)
@@ -0,0 +1,259 @@
+# stock_data/price_cache.py
+import threading
+import time
+from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+from django.db.models import Q
+
+from .models import daily_price_model
+
+_GLOBAL_GENERATION_KEY = 'price_series_gen:*'
+
+
+class PriceSeries:
+    """
+    One symbol's daily history as sorted, contiguous NumPy columns.
+    Dates are int32 days since 1970-01-01.
+    """
+
+    __slots__ = ('symbol', 'dates', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, symbol, dates, open, high, low, close, volume):
+        self.symbol = symbol
+        self.dates = dates
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    @classmethod
+    def from_rows(cls, symbol, rows, scale: int = 1) -> 'PriceSeries':
+        """
+        Build from date-ordered (date, open, high, low, close, volume) tuples;
+        stored prices are divided by scale (100 for integer cents).
+        """
+        if not rows:
+            empty = np.empty(0, dtype=np.float64)
+            return cls(symbol, np.empty(0, dtype=np.int32), empty, empty, empty, empty, np.empty(0, dtype=np.int64))
+
+        dates, opens, highs, lows, closes, volumes = zip(*rows)
+        return cls(
+            symbol,
+            np.array(dates, dtype='datetime64[D]').astype(np.int32),
+            np.array(opens, dtype=np.float64) / scale,
+            np.array(highs, dtype=np.float64) / scale,
+            np.array(lows, dtype=np.float64) / scale,
+            np.array(closes, dtype=np.float64) / scale,
+            np.array(volumes, dtype=np.int64)
+        )
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in ('dates', 'open', 'high', 'low', 'close', 'volume'))
+
+    def index_range(self, start_date=None, end_date=None) -> tuple:
+        """(lo, hi) positions of the rows with start_date <= date <= end_date, by binary search"""
+        lo = 0 if not start_date else int(np.searchsorted(self.dates, _to_days(start_date), side='left'))
+        hi = len(self.dates) if not end_date else int(np.searchsorted(self.dates, _to_days(end_date), side='right'))
+        return lo, hi
+
+    def slice(self, start_date=None, end_date=None) -> 'PriceSeries':
+        """Rows with start_date <= date <= end_date (views, no copies)"""
+        lo, hi = self.index_range(start_date, end_date)
+        return PriceSeries(
+            self.symbol,
+            self.dates[lo:hi],
+            self.open[lo:hi],
+            self.high[lo:hi],
+            self.low[lo:hi],
+            self.close[lo:hi],
+            self.volume[lo:hi]
+        )
+
+    def date_strings(self) -> list:
+        return self.dates.astype('datetime64[D]').astype(str).tolist()
+
+    def date_objects(self) -> list:
+        return self.dates.astype('datetime64[D]').tolist()
+
+
+def _to_days(value) -> int:
+    return int(np.datetime64(value, 'D').astype(np.int64))
+
+
+def _price_rows(bounds: dict, model):
+    """values_list query for load_price_series_many, ordered by symbol then date"""
+    symbol = model.symbol_path
+    query = model.objects.filter(**{f'{symbol}__in': list(bounds)})
+    if any(start or end for start, end in bounds.values()):
+        condition = Q()
+        for name, (start_date, end_date) in bounds.items():
+            symbol_condition = Q(**{symbol: name})
+            if start_date:
+                symbol_condition &= Q(date__gte=start_date)
+            if end_date:
+                symbol_condition &= Q(date__lte=end_date)
+            condition |= symbol_condition
+        query = query.filter(condition)
+
+    return query.order_by(symbol, 'date').values_list(
+        symbol, 'date', 'open_price', 'high_price', 'low_price', 'close_price', 'volume'
+    )
+
+
+def _group_series(bounds: dict, rows, scale: int) -> dict:
+    series = {symbol: PriceSeries.from_rows(symbol, []) for symbol in bounds}
+    for symbol, group in groupby(rows, key=itemgetter(0)):
+        series[symbol] = PriceSeries.from_rows(symbol, [row[1:] for row in group], scale)
+    return series
+
+
+def load_price_series_many(bounds: dict, model=None) -> dict:
+    """
+    Load several symbols' histories in one values_list query: an IN filter
+    on symbol plus each symbol's own date bounds. bounds maps symbol to
+    (start_date, end_date), either of which may be None. Rows are grouped
+    into columns in a single pass; symbols without rows get empty series.
+    model may be any table with StockPrice's columns, such as a rollup; it
+    defaults to the configured daily price table.
+    """
+    if not bounds:
+        return {}
+    model = model or daily_price_model()
+    return _group_series(bounds, _price_rows(bounds, model), model.price_scale)
+
+
+async def aload_price_series_many(bounds: dict, model=None) -> dict:
+    """load_price_series_many through the async ORM"""
+    if not bounds:
+        return {}
+    model = model or daily_price_model()
+    return _group_series(bounds, [row async for row in _price_rows(bounds, model)], model.price_scale)
+
+
+class PriceCache:
+    """
+    Per-process LRU of PriceSeries, bounded by total array bytes.
+
+    Writers call invalidate(), which drops the local copy and bumps a
+    generation counter in Django's (shared) cache; other processes notice
+    the new generation on their next lookup. Series are also reloaded once
+    they are ttl seconds old, which bounds staleness should an invalidation
+    be missed (a process-local CACHES backend, a lost counter update).
+    """
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._series = OrderedDict()  # symbol -> (generation, loaded_at, PriceSeries)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str) -> PriceSeries:
+        return self.get_many([symbol])[symbol]
+
+    def get_many(self, symbols) -> dict:
+        """Series for each symbol; all misses are loaded together in one query"""
+        symbols = list(dict.fromkeys(symbols))
+        generations = self._generations(symbols, shared_cache.get_many(self._generation_keys(symbols)))
+        found, missing = self._lookup(symbols, generations)
+        if missing:
+            loaded_at = time.monotonic()
+            loaded = load_price_series_many({symbol: (None, None) for symbol in missing})
+            found.update(self._keep(generations, loaded, loaded_at))
+        return {symbol: found[symbol] for symbol in symbols}
+
+    async def aget_many(self, symbols) -> dict:
+        """get_many for async callers: generations and misses are read without blocking the event loop"""
+        symbols = list(dict.fromkeys(symbols))
+        generations = self._generations(symbols, await shared_cache.aget_many(self._generation_keys(symbols)))
+        found, missing = self._lookup(symbols, generations)
+        if missing:
+            loaded_at = time.monotonic()
+            loaded = await aload_price_series_many({symbol: (None, None) for symbol in missing})
+            found.update(self._keep(generations, loaded, loaded_at))
+        return {symbol: found[symbol] for symbol in symbols}
+
+    @staticmethod
+    def _generation_keys(symbols) -> list:
+        return [_GLOBAL_GENERATION_KEY, *(f'price_series_gen:{symbol}' for symbol in symbols)]
+
+    @staticmethod
+    def _generations(symbols, stamps: dict) -> dict:
+        return {
+            symbol: (stamps.get(_GLOBAL_GENERATION_KEY, 0), stamps.get(f'price_series_gen:{symbol}', 0))
+            for symbol in symbols
+        }
+
+    def _lookup(self, symbols, generations: dict) -> tuple:
+        """(found series, missing symbols) among the current local copies"""
+        found, missing = {}, []
+        expired = time.monotonic() - self.ttl if self.ttl else None
+        with self._lock:
+            for symbol in symbols:
+                entry = self._series.get(symbol)
+                if entry is not None and entry[0] == generations[symbol] and \
+                        (expired is None or entry[1] > expired):
+                    self._series.move_to_end(symbol)
+                    found[symbol] = entry[2]
+                else:
+                    missing.append(symbol)
+        return found, missing
+
+    def _keep(self, generations: dict, loaded: dict, loaded_at: float) -> dict:
+        with self._lock:
+            for symbol, series in loaded.items():
+                self._store(symbol, generations[symbol], loaded_at, series)
+        return loaded
+
+    def _store(self, symbol: str, generation: tuple, loaded_at: float, series: PriceSeries):
+        self._discard(symbol)
+        if series.nbytes > self.max_bytes:
+            return
+        self._series[symbol] = (generation, loaded_at, series)
+        self._bytes += series.nbytes
+        while self._bytes > self.max_bytes:
+            _, (_, _, evicted) = self._series.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def _discard(self, symbol: str):
+        entry = self._series.pop(symbol, None)
+        if entry is not None:
+            self._bytes -= entry[2].nbytes
+
+    def invalidate(self, symbol: Optional[str] = None):
+        """Forget one symbol's series (or every series) in all processes"""
+        key = _GLOBAL_GENERATION_KEY if symbol is None else f'price_series_gen:{symbol}'
+        try:
+            shared_cache.incr(key)
+        except ValueError:
+            shared_cache.set(key, 1, timeout=None)
+
+        with self._lock:
+            if symbol is None:
+                self._series.clear()
+                self._bytes = 0
+            else:
+                self._discard(symbol)
+
+
+_price_cache = None
+_price_cache_lock = threading.Lock()
+
+
+def get_price_cache() -> PriceCache:
+    global _price_cache
+    with _price_cache_lock:
+        if _price_cache is None:
+            _price_cache = PriceCache(settings.STOCK_PRICE_CACHE_MAX_BYTES, settings.STOCK_PRICE_CACHE_TTL)
+    return _price_cache
@@ -0,0 +1,198 @@
+# stock_data/provider_stub.py
+"""
+Local stand-in for the Alpha Vantage TIME_SERIES_DAILY endpoint, used by
+tests and benchmarks so no real quota is spent.
+
+    with ProviderStub() as stub:
+        with override_settings(ALPHA_VANTAGE_BASE_URL=stub.url):
+            fetch_stock_data('AAPL')
+
+Run standalone with: python -m stock_data.provider_stub --port 8765
+"""
+import argparse
+import json
+import threading
+import time
+import zlib
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+COMPACT_SIZE = 100
+
+
+def synthetic_daily_prices(symbol: str, num_days: int = 5000, end_date: date = None) -> dict:
+    """
+    Deterministic OHLCV series for a symbol: a seeded random walk over
+    business days ending at end_date. Returns columns as NumPy arrays,
+    oldest first.
+    """
+    end_date = end_date or date.today()
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+
+    dates = np.busday_offset(np.datetime64(end_date, 'D'), -np.arange(num_days)[::-1], roll='backward')
+    close = 20 + 80 * rng.random() * np.exp(np.cumsum(rng.normal(0.0002, 0.018, num_days)))
+    open_ = close * (1 + rng.normal(0, 0.005, num_days))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.008, num_days)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.008, num_days)))
+    volume = rng.integers(100_000, 50_000_000, num_days)
+
+    return {
+        'date': dates,
+        'open': np.round(open_, 4),
+        'high': np.round(high, 4),
+        'low': np.round(low, 4),
+        'close': np.round(close, 4),
+        'volume': volume
+    }
+
+
+def daily_payload(symbol: str, outputsize: str = 'full', num_days: int = 5000, end_date: date = None) -> dict:
+    """Build a TIME_SERIES_DAILY JSON payload in the provider's format (newest first)"""
+    series = synthetic_daily_prices(symbol, num_days, end_date)
+    count = COMPACT_SIZE if outputsize == 'compact' else num_days
+
+    time_series = {}
+    for i in range(num_days - 1, num_days - 1 - min(count, num_days), -1):
+        time_series[str(series['date'][i])] = {
+            '1. open': f"{series['open'][i]:.4f}",
+            '2. high': f"{series['high'][i]:.4f}",
+            '3. low': f"{series['low'][i]:.4f}",
+            '4. close': f"{series['close'][i]:.4f}",
+            '5. volume': str(series['volume'][i])
+        }
+
+    return {
+        'Meta Data': {
+            '1. Information': 'Daily Prices (open, high, low, close) and Volumes',
+            '2. Symbol': symbol,
+            '3. Last Refreshed': str(series['date'][-1]),
+            '4. Output Size': 'Compact' if outputsize == 'compact' else 'Full size',
+            '5. Time Zone': 'US/Eastern'
+        },
+        'Time Series (Daily)': time_series
+    }
+
+
+def daily_csv(symbol: str, outputsize: str = 'full', num_days: int = 5000, end_date: date = None) -> str:
+    """The datatype=csv form of daily_payload (newest first)"""
+    series = synthetic_daily_prices(symbol, num_days, end_date)
+    count = min(COMPACT_SIZE if outputsize == 'compact' else num_days, num_days)
+
+    lines = ['timestamp,open,high,low,close,volume']
+    for i in range(num_days - 1, num_days - 1 - count, -1):
+        lines.append(
+            f"{series['date'][i]},{series['open'][i]:.4f},{series['high'][i]:.4f},"
+            f"{series['low'][i]:.4f},{series['close'][i]:.4f},{series['volume'][i]}"
+        )
+    return '\r\n'.join(lines) + '\r\n'
+
+
+class ProviderStub:
+    """
+    Threaded local HTTP server answering like the provider.
+    throttle_every / error_every make every Nth request return the
+    provider's rate-limit note or an HTTP 503, to exercise retry paths.
+    Symbols starting with 'INVALID' get the provider's error payload.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, num_days=5000, end_date=None,
+                 throttle_every=0, error_every=0, latency=0.0):
+        self.num_days = num_days
+        self.end_date = end_date
+        self.throttle_every = throttle_every
+        self.error_every = error_every
+        self.latency = latency
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/query'
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                status, body, content_type = stub.respond(params)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def respond(self, params: dict):
+        """Return (status, body bytes, content type) for a query"""
+        with self._lock:
+            self.request_count += 1
+            count = self.request_count
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.error_every and count % self.error_every == 0:
+            return 503, b'Service Unavailable', 'text/plain'
+
+        if self.throttle_every and count % self.throttle_every == 0:
+            note = {'Note': 'Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute.'}
+            return 200, json.dumps(note).encode(), 'application/json'
+
+        symbol = params.get('symbol', '')
+        if params.get('function') != 'TIME_SERIES_DAILY' or symbol.startswith('INVALID'):
+            error = {'Error Message': 'Invalid API call. Please retry or visit the documentation.'}
+            return 200, json.dumps(error).encode(), 'application/json'
+
+        outputsize = params.get('outputsize', 'compact')
+        if params.get('datatype') == 'csv':
+            return 200, daily_csv(symbol, outputsize, self.num_days, self.end_date).encode(), 'application/x-download'
+
+        payload = daily_payload(symbol, outputsize, self.num_days, self.end_date)
+        return 200, json.dumps(payload).encode(), 'application/json'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a local Alpha Vantage stub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--days', type=int, default=5000)
+    parser.add_argument('--throttle-every', type=int, default=0)
+    parser.add_argument('--error-every', type=int, default=0)
+    args = parser.parse_args()
+
+    stub = ProviderStub(args.host, args.port, args.days,
+                        throttle_every=args.throttle_every, error_every=args.error_every)
+    print(f'Serving provider stub at {stub.url}')
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,82 @@
+# stock_data/ratelimit.py
+import asyncio
+import time
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import RateLimitBucket
+
+
+class TokenBucket:
+    """
+    Token bucket whose state lives in the database, so every process and
+    thread calling the provider draws from the same quota.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float):
+        self.name = name
+        self.rate = rate  # tokens added per second
+        self.capacity = capacity
+
+    def _ensure_bucket(self):
+        try:
+            RateLimitBucket.objects.get_or_create(
+                name=self.name,
+                defaults={'tokens': self.capacity, 'refilled_at': time.time()}
+            )
+        except IntegrityError:
+            pass  # created concurrently by another process
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Take tokens if they are available.
+        Returns 0 on success, otherwise the seconds until enough tokens accrue.
+        """
+        self._ensure_bucket()
+        with transaction.atomic():
+            bucket = RateLimitBucket.objects.select_for_update().get(name=self.name)
+            now = time.time()
+            available = min(self.capacity, bucket.tokens + max(0.0, now - bucket.refilled_at) * self.rate)
+
+            if available < tokens:
+                return (tokens - available) / self.rate
+
+            bucket.tokens = available - tokens
+            bucket.refilled_at = now
+            bucket.save(update_fields=['tokens', 'refilled_at'])
+            return 0.0
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """Block until tokens are taken. Returns False if timeout expires first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """acquire() for async callers: waits with asyncio.sleep instead of blocking a thread"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # try_acquire locks the bucket row in a transaction, which the async ORM can't do
+            wait = await sync_to_async(self.try_acquire)(tokens)
+            if wait == 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+def get_provider_rate_limiter() -> TokenBucket:
+    """Shared limiter enforcing the Alpha Vantage quota across all workers"""
+    return TokenBucket(
+        name='alpha_vantage',
+        rate=settings.ALPHA_VANTAGE_CALLS_PER_MINUTE / 60.0,
+        capacity=settings.ALPHA_VANTAGE_BURST
+    )
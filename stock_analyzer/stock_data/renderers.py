@@ -0,0 +1,138 @@
+# stock_data/renderers.py
+"""
+Binary wire formats for the history endpoint, picked by the Accept header.
+
+Each renderer receives {'data': {symbol: PriceSeries}, 'metadata': {...}}
+and encodes the same dates/opens/closes/volumes columns the JSON response
+carries (newest first) as typed arrays. Anything else, such as an error
+payload, is sent as plain JSON.
+"""
+import io
+import json
+from abc import ABC, abstractmethod
+
+import numpy as np
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+
+try:
+    import msgpack
+except ImportError:  # optional: enables application/x-msgpack
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional: enables application/vnd.apache.arrow.stream
+    pa = None
+
+
+def _columns(series) -> dict:
+    """The API's history columns, newest first, as contiguous typed arrays"""
+    return {
+        'dates': np.ascontiguousarray(series.dates[::-1]).astype('datetime64[D]'),
+        'opens': np.ascontiguousarray(series.open[::-1]),
+        'closes': np.ascontiguousarray(series.close[::-1]),
+        'volumes': np.ascontiguousarray(series.volume[::-1])
+    }
+
+
+class ColumnarRenderer(BaseRenderer, ABC):
+    charset = None
+    columnar = True  # tells the view to hand over PriceSeries instead of lists
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, dict) or 'data' not in data:
+            response = (renderer_context or {}).get('response')
+            if response is not None:
+                response['Content-Type'] = 'application/json'
+            return json.dumps(data, default=str).encode()
+        return self.encode(data['data'], data.get('metadata', {}))
+
+    @abstractmethod
+    def encode(self, series_by_symbol: dict, metadata: dict) -> bytes:
+        """The response body for {symbol: PriceSeries} and the response metadata"""
+
+
+class NpzRenderer(ColumnarRenderer):
+    """
+    NumPy .npz archive with one array per column, named '<symbol>/<column>'
+    (np.load(f)['AAPL/closes']). Dates are datetime64[D].
+    """
+    media_type = 'application/x-npz'
+    format = 'npz'
+
+    def encode(self, series_by_symbol, metadata):
+        arrays = {}
+        for symbol, series in series_by_symbol.items():
+            for name, values in _columns(series).items():
+                arrays[f'{symbol}/{name}'] = values
+
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+
+class MsgpackRenderer(ColumnarRenderer):
+    """
+    msgpack document shaped like the JSON response, but each column is
+    {'dtype': <numpy dtype str>, 'data': <raw little-endian bytes>}, so
+    np.frombuffer(col['data'], col['dtype']) loads it without parsing.
+    """
+    media_type = 'application/x-msgpack'
+    format = 'msgpack'
+
+    def encode(self, series_by_symbol, metadata):
+        data = {}
+        for symbol, series in series_by_symbol.items():
+            data[symbol] = {'symbol': symbol, 'timeframe': metadata.get('timeframe', 'daily')}
+            for name, values in _columns(series).items():
+                values = values.astype(values.dtype.newbyteorder('<'), copy=False)
+                data[symbol][name] = {'dtype': values.dtype.str, 'data': values.tobytes()}
+
+        return msgpack.packb({'data': data, 'metadata': metadata}, use_bin_type=True)
+
+
+class ArrowStreamRenderer(ColumnarRenderer):
+    """
+    Arrow IPC stream holding one record batch with columns symbol
+    (dictionary-encoded), date (date32), open, close (float64), volume (int64).
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+
+    def encode(self, series_by_symbol, metadata):
+        symbols = list(series_by_symbol)
+        columns = [_columns(series_by_symbol[symbol]) for symbol in symbols]
+        lengths = [len(column['dates']) for column in columns]
+
+        def concat(name, dtype):
+            if not columns:
+                return np.empty(0, dtype=dtype)
+            return np.concatenate([column[name] for column in columns]).astype(dtype, copy=False)
+
+        batch = pa.record_batch([
+            pa.DictionaryArray.from_arrays(
+                pa.array(np.repeat(np.arange(len(symbols), dtype=np.int32), lengths)),
+                pa.array(symbols, type=pa.string())
+            ),
+            pa.array(concat('dates', 'datetime64[D]'), type=pa.date32()),
+            pa.array(concat('opens', np.float64)),
+            pa.array(concat('closes', np.float64)),
+            pa.array(concat('volumes', np.int64)),
+        ], names=['symbol', 'date', 'open', 'close', 'volume'])
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, batch.schema.with_metadata(
+            {'metadata': json.dumps(metadata)}
+        )) as writer:
+            writer.write_batch(batch)
+        return sink.getvalue().to_pybytes()
+
+
+# JSON (the default) first, then whichever binary formats are installed
+HISTORY_RENDERER_CLASSES = [
+    *api_settings.DEFAULT_RENDERER_CLASSES,
+    NpzRenderer,
+    *([MsgpackRenderer] if msgpack else []),
+    *([ArrowStreamRenderer] if pa else []),
+]
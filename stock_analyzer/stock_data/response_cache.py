@@ -0,0 +1,110 @@
+# stock_data/response_cache.py
+import gzip
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from django.conf import settings
+
+_USE_TTL = object()
+
+
+class ResponseCache:
+    """
+    Gzip-compressed raw provider payloads on local disk, one file per
+    (function, symbol, outputsize, datatype).
+
+    A file's mtime is when it was fetched and drives the TTL; its atime is
+    set explicitly on every hit and drives LRU eviction once the directory
+    grows past max_bytes. Expired entries stay on disk so they can still be
+    replayed without network access.
+    """
+
+    _SUFFIX = '.gz'
+    _UNSAFE = re.compile(r'[^A-Za-z0-9._-]')
+
+    def __init__(self, directory, ttl: float, max_bytes: int):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, function: str, symbol: str, outputsize: str, datatype: str) -> Path:
+        parts = (self._UNSAFE.sub('_', part) for part in (function, symbol, outputsize))
+        return self.directory / ('__'.join(parts) + f'.{self._UNSAFE.sub("_", datatype)}' + self._SUFFIX)
+
+    def get(self, function: str, symbol: str, outputsize: str, max_age=_USE_TTL,
+            datatype: str = 'json') -> Optional[bytes]:
+        """
+        Return the cached payload, or None if missing or older than max_age
+        seconds (defaults to the TTL; None accepts any age).
+        """
+        path = self._path(function, symbol, outputsize, datatype)
+        try:
+            stat = path.stat()
+            max_age = self.ttl if max_age is _USE_TTL else max_age
+            if max_age is not None and time.time() - stat.st_mtime > max_age:
+                return None
+            payload = gzip.decompress(path.read_bytes())
+            os.utime(path, (time.time(), stat.st_mtime))  # mark as recently used
+            return payload
+        except (OSError, EOFError, gzip.BadGzipFile):
+            return None
+
+    def set(self, function: str, symbol: str, outputsize: str, payload: bytes, datatype: str = 'json'):
+        """Store a raw payload atomically, then evict least recently used entries if over budget"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(function, symbol, outputsize, datatype)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(gzip.compress(payload, compresslevel=6))
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for path in self.directory.glob('*' + self._SUFFIX):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+
+    def entries(self) -> Iterator[Tuple[str, str, str, str]]:
+        """Yield (function, symbol, outputsize, datatype) for every cached payload"""
+        if not self.directory.exists():
+            return
+        for path in sorted(self.directory.glob('*' + self._SUFFIX)):
+            stem, _, datatype = path.name[:-len(self._SUFFIX)].rpartition('.')
+            parts = stem.split('__')
+            if len(parts) == 3:
+                yield (*parts, datatype)
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Cache configured in settings, or None when ALPHA_VANTAGE_CACHE_DIR is empty"""
+    if not settings.ALPHA_VANTAGE_CACHE_DIR:
+        return None
+    return ResponseCache(
+        settings.ALPHA_VANTAGE_CACHE_DIR,
+        ttl=settings.ALPHA_VANTAGE_CACHE_TTL,
+        max_bytes=settings.ALPHA_VANTAGE_CACHE_MAX_BYTES
+    )
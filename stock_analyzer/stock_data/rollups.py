@@ -0,0 +1,114 @@
+# stock_data/rollups.py
+"""
+Weekly and monthly OHLCV bars materialized from the daily StockPrice rows.
+
+Bars are keyed by the first calendar day of their period. After daily
+rows are written, update_rollups() recomputes only the periods from the
+earliest written date onwards, so a routine compact refresh touches a
+handful of bars.
+"""
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import WeeklyStockPrice, MonthlyStockPrice
+from .price_cache import PriceSeries, load_price_series_many
+
+TIMEFRAMES = ('daily', 'weekly', 'monthly')
+ROLLUP_MODELS = {
+    'weekly': WeeklyStockPrice,
+    'monthly': MonthlyStockPrice,
+}
+
+
+def period_starts(dates: np.ndarray, timeframe: str) -> np.ndarray:
+    """First day of each date's period, as int32 days since 1970-01-01 (a Thursday)"""
+    if timeframe == 'weekly':
+        return dates - (dates + 3) % 7
+    if timeframe == 'monthly':
+        return dates.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]').astype(np.int32)
+    raise ValueError(f'Unknown rollup timeframe: {timeframe}')
+
+
+def aggregate(series: PriceSeries, timeframe: str) -> PriceSeries:
+    """Resample a date-sorted daily series into one bar per period"""
+    if not len(series):
+        return series
+
+    keys = period_starts(series.dates, timeframe)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+
+    return PriceSeries(
+        series.symbol,
+        keys[starts],
+        series.open[starts],
+        np.maximum.reduceat(series.high, starts),
+        np.minimum.reduceat(series.low, starts),
+        series.close[ends],
+        np.add.reduceat(series.volume, starts)
+    )
+
+
+def _price(value: float) -> Decimal:
+    return Decimal(f'{value:.2f}')
+
+
+def update_rollups(symbol: str, since=None):
+    """
+    Recompute a symbol's weekly and monthly bars for every period from the
+    one containing `since` (a date; None rebuilds the whole history).
+    Bars left without any daily rows are deleted.
+    """
+    # Each timeframe restarts at its own period containing since; the
+    # dailies are loaded from the earliest of those, and bars of a period
+    # starting before its timeframe's start (only partly loaded) are skipped
+    starts = dict.fromkeys(ROLLUP_MODELS)
+    if since is not None:
+        day = np.array([np.datetime64(since, 'D').astype(np.int32)])
+        starts = {
+            timeframe: np.datetime64(int(period_starts(day, timeframe)[0]), 'D').item()
+            for timeframe in ROLLUP_MODELS
+        }
+    first = min(starts.values()) if since is not None else None
+
+    daily = load_price_series_many({symbol: (first, None)})[symbol]
+
+    with transaction.atomic():
+        for timeframe, model in ROLLUP_MODELS.items():
+            start = starts[timeframe]
+            bars = aggregate(daily, timeframe).slice(start_date=start)
+            stale = model.objects.filter(symbol=symbol)
+            if start is not None:
+                stale = stale.filter(date__gte=start)
+            stale.exclude(date__in=bars.date_objects()).delete()
+
+            model.objects.bulk_create(
+                [
+                    model(
+                        symbol=symbol,
+                        date=date,
+                        open_price=_price(open_price),
+                        high_price=_price(high),
+                        low_price=_price(low),
+                        close_price=_price(close),
+                        volume=int(volume)
+                    )
+                    for date, open_price, high, low, close, volume in zip(
+                        bars.date_objects(), bars.open, bars.high, bars.low, bars.close, bars.volume
+                    )
+                ],
+                batch_size=settings.STOCK_DATA_BULK_BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=['symbol', 'date'],
+                update_fields=['open_price', 'high_price', 'low_price', 'close_price', 'volume', 'updated_at']
+            )
+
+
+def delete_rollups(symbols=None):
+    """Drop the bars of the given symbols, or of every symbol"""
+    for model in ROLLUP_MODELS.values():
+        query = model.objects.all() if symbols is None else model.objects.filter(symbol__in=symbols)
+        query.delete()
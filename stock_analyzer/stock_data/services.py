@@ -1,73 +1,333 @@
 # stock_data/services.py
+import httpx
 import requests
+import asyncio
+import json
+import logging
 import os
-from decimal import Decimal
-from datetime import datetime
-from typing import Dict, List, Optional
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+import numpy as np
 
-from .models import StockPrice
+from stock_analyzer.instrumentation import phase
+from .models import CompactStockPrice, daily_price_model
+from .ratelimit import get_provider_rate_limiter
+from .payloads import PriceColumns, from_cents, parse_daily_csv, parse_daily_json, parse_daily_payload
+from .price_cache import PriceSeries, aload_price_series_many, get_price_cache, load_price_series_many
+from .response_cache import get_response_cache
+from .rollups import ROLLUP_MODELS, update_rollups
+from .storage import ticker_ids
 
 load_dotenv()
 
-class AlphaVantageService:
+logger = logging.getLogger(__name__)
+
+# Stored value columns of the daily price tables, besides the (symbol, date) key
+PRICE_FIELDS = ('open_price', 'high_price', 'low_price', 'close_price', 'volume')
+
+class ProviderThrottledError(Exception):
+    """The provider answered with a rate-limit 'Note'/'Information' payload"""
+
+class ProviderMetrics:
+    """Per-process counters and latency totals for provider HTTP calls"""
+
     def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.retries = 0
+            self.throttled = 0
+            self.server_errors = 0
+            self.network_errors = 0
+            self.failures = 0
+            self.latency_total = 0.0
+            self.latency_max = 0.0
+
+    def record_request(self, latency: float, outcome: str = 'ok'):
+        with self._lock:
+            self.requests += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            if outcome == 'throttled':
+                self.throttled += 1
+            elif outcome == 'server_error':
+                self.server_errors += 1
+            elif outcome == 'network_error':
+                self.network_errors += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'server_errors': self.server_errors,
+                'network_errors': self.network_errors,
+                'failures': self.failures,
+                'latency_avg_ms': round(1000 * self.latency_total / self.requests, 2) if self.requests else None,
+                'latency_max_ms': round(1000 * self.latency_max, 2)
+            }
+
+provider_metrics = ProviderMetrics()
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_provider_session() -> requests.Session:
+    """Process-wide keep-alive session with a connection pool for the provider"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.ALPHA_VANTAGE_POOL_SIZE
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+    return _session
+
+def _json_body(content: bytes) -> Optional[Dict]:
+    """The parsed body if the provider answered in JSON (data, errors or throttle notes), else None"""
+    return json.loads(content) if content.lstrip()[:1] == b'{' else None
+
+def _is_throttled(data: Optional[Dict]) -> bool:
+    return data is not None and 'Time Series (Daily)' not in data and ('Note' in data or 'Information' in data)
+
+class AlphaVantageService:
+    def __init__(self, rate_limiter=None, session=None, cache=None):
         self.api_key = os.environ.get('ALPHA_VANTAGE_API_KEY')
-        self.base_url = 'https://www.alphavantage.co/query'
-        
-    def fetch_daily_prices(self, symbol: str) -> Optional[List[Dict]]:
+        self.base_url = settings.ALPHA_VANTAGE_BASE_URL
+        # Shared quota across processes; pass a stub limiter in tests
+        self.rate_limiter = rate_limiter or get_provider_rate_limiter()
+        self.session = session or get_provider_session()
+        self.timeout = (settings.ALPHA_VANTAGE_CONNECT_TIMEOUT, settings.ALPHA_VANTAGE_READ_TIMEOUT)
+        self.max_retries = settings.ALPHA_VANTAGE_MAX_RETRIES
+        # Compressed raw payloads on local disk; None when disabled
+        self.cache = get_response_cache() if cache is None else cache
+        # 'csv' payloads are smaller and parse faster than 'json'
+        self.datatype = settings.ALPHA_VANTAGE_DATATYPE
+
+    def _daily_params(self, symbol: str, outputsize: str) -> Dict:
+        return {
+            'function': 'TIME_SERIES_DAILY',
+            'symbol': symbol,
+            'outputsize': outputsize,
+            'datatype': self.datatype,
+            'apikey': self.api_key
+        }
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with jitter: half fixed, half random"""
+        delay = min(settings.ALPHA_VANTAGE_BACKOFF_MAX, settings.ALPHA_VANTAGE_BACKOFF_BASE * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _get_payload(self, params: Dict) -> Tuple[bytes, Optional[Dict]]:
+        """
+        GET the provider with retries on network errors, 5XX responses and
+        throttle payloads. Returns the raw body and, if it is JSON, the
+        parsed JSON. Raises the last error once retries run out.
+        """
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                provider_metrics.record_retry()
+                time.sleep(self._backoff_delay(attempt))
+
+            self.rate_limiter.acquire()
+            started = time.perf_counter()
+            try:
+                with phase('http_fetch'):
+                    response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                provider_metrics.record_request(time.perf_counter() - started, 'network_error')
+                last_error = e
+                continue
+
+            latency = time.perf_counter() - started
+            if response.status_code >= 500:
+                provider_metrics.record_request(latency, 'server_error')
+                last_error = requests.HTTPError(f'{response.status_code} Server Error', response=response)
+                continue
+
+            response.raise_for_status()  # 4XX errors are not retried
+            data = _json_body(response.content)
+
+            # The provider signals throttling with a 200 and a JSON message
+            # instead of data, whichever datatype was requested
+            if _is_throttled(data):
+                provider_metrics.record_request(latency, 'throttled')
+                last_error = ProviderThrottledError(data.get('Note') or data.get('Information'))
+                continue
+
+            provider_metrics.record_request(latency)
+            return response.content, data
+
+        provider_metrics.record_failure()
+        raise last_error
+
+    def fetch_daily_prices(self, symbol: str, outputsize: str = 'full', use_cache: bool = True) -> Optional[PriceColumns]:
         """
         Fetch daily stock prices for a given symbol.
-        Returns list of price data or None if error occurs.
+        outputsize='full' gets up to 20 years of data, 'compact' the latest 100 days.
+        Payloads younger than the cache TTL are served from the local response cache.
+        Returns the prices as columns, or None if an error occurs.
         """
         try:
-            params = {
-                'function': 'TIME_SERIES_DAILY',
-                'symbol': symbol,
-                'outputsize': 'full',  # gets up to 20 years of data
-                'apikey': self.api_key
-            }
-            
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()  # Raises exception for 4XX/5XX status codes
-            
-            data = response.json()
-            
-            # Check for API error messages
-            if "Error Message" in data:
-                raise ValueError(f"API Error: {data['Error Message']}")
-                
-            time_series = data.get('Time Series (Daily)', {})
-            
-            processed_data = []
-            for date, values in time_series.items():
-                processed_data.append({
-                    'symbol': symbol,
-                    'date': datetime.strptime(date, '%Y-%m-%d').date(),
-                    'open_price': Decimal(values['1. open']),
-                    'high_price': Decimal(values['2. high']),
-                    'low_price': Decimal(values['3. low']),
-                    'close_price': Decimal(values['4. close']),
-                    'volume': int(values['5. volume'])
-                })
-            
-            return processed_data
+            cache = self.cache if use_cache else None
+            payload = cache.get('TIME_SERIES_DAILY', symbol, outputsize, datatype=self.datatype) if cache else None
+            if payload is not None:
+                with phase('parse'):
+                    return parse_daily_payload(payload)
+
+            payload, data = self._get_payload(self._daily_params(symbol, outputsize))
+            with phase('parse'):
+                prices = parse_daily_json(data) if data is not None else parse_daily_csv(payload)
+
+            if self.cache and len(prices):
+                self.cache.set('TIME_SERIES_DAILY', symbol, outputsize, payload, datatype=self.datatype)
+
+            return prices
             
+        except ProviderThrottledError as e:
+            logger.warning("Provider rate limit hit for %s after %d retries: %s", symbol, self.max_retries, e)
+            return None
         except requests.RequestException as e:
-            print(f"Network error occurred: {e}")
+            logger.error("Network error fetching %s: %s", symbol, e)
             return None
         except ValueError as e:
-            print(f"Data processing error: {e}")
+            logger.error("Data processing error for %s: %s", symbol, e)
             return None
-        except Exception as e:
-            print(f"Unexpected error: {e}")
+        except Exception:
+            logger.exception("Unexpected error fetching %s", symbol)
             return None
         
+class AsyncAlphaVantageService(AlphaVantageService):
+    """
+    AlphaVantageService over an httpx.AsyncClient, so many symbols can be
+    fetched concurrently from one event loop. Retries, throttle handling,
+    the shared rate limiter and the response cache behave as in the sync
+    service. The client is bound to the running loop; see provider_client().
+    """
+
+    def __init__(self, client: httpx.AsyncClient, rate_limiter=None, cache=None):
+        super().__init__(rate_limiter=rate_limiter, session=client, cache=cache)
+
+    async def _aget_payload(self, params: Dict) -> Tuple[bytes, Optional[Dict]]:
+        """_get_payload over the async client"""
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                provider_metrics.record_retry()
+                await asyncio.sleep(self._backoff_delay(attempt))
+
+            await self.rate_limiter.aacquire()
+            started = time.perf_counter()
+            try:
+                with phase('http_fetch'):
+                    response = await self.session.get(self.base_url, params=params)
+            except (httpx.NetworkError, httpx.TimeoutException) as e:
+                provider_metrics.record_request(time.perf_counter() - started, 'network_error')
+                last_error = e
+                continue
+
+            latency = time.perf_counter() - started
+            if response.status_code >= 500:
+                provider_metrics.record_request(latency, 'server_error')
+                last_error = httpx.HTTPStatusError(
+                    f'{response.status_code} Server Error', request=response.request, response=response
+                )
+                continue
+
+            response.raise_for_status()  # 4XX errors are not retried
+            data = _json_body(response.content)
+
+            if _is_throttled(data):
+                provider_metrics.record_request(latency, 'throttled')
+                last_error = ProviderThrottledError(data.get('Note') or data.get('Information'))
+                continue
+
+            provider_metrics.record_request(latency)
+            return response.content, data
+
+        provider_metrics.record_failure()
+        raise last_error
+
+    async def afetch_daily_prices(self, symbol: str, outputsize: str = 'full',
+                                  use_cache: bool = True) -> Optional[PriceColumns]:
+        """fetch_daily_prices over the async client; None if an error occurs"""
+        try:
+            cache = self.cache if use_cache else None
+            payload = None
+            if cache:
+                payload = await sync_to_async(cache.get, thread_sensitive=False)(
+                    'TIME_SERIES_DAILY', symbol, outputsize, datatype=self.datatype
+                )
+            if payload is not None:
+                with phase('parse'):
+                    return parse_daily_payload(payload)
+
+            payload, data = await self._aget_payload(self._daily_params(symbol, outputsize))
+            with phase('parse'):
+                prices = parse_daily_json(data) if data is not None else parse_daily_csv(payload)
+
+            if self.cache and len(prices):
+                await sync_to_async(self.cache.set, thread_sensitive=False)(
+                    'TIME_SERIES_DAILY', symbol, outputsize, payload, datatype=self.datatype
+                )
+
+            return prices
+
+        except ProviderThrottledError as e:
+            logger.warning("Provider rate limit hit for %s after %d retries: %s", symbol, self.max_retries, e)
+            return None
+        except httpx.HTTPError as e:
+            logger.error("Network error fetching %s: %s", symbol, e)
+            return None
+        except ValueError as e:
+            logger.error("Data processing error for %s: %s", symbol, e)
+            return None
+        except Exception:
+            logger.exception("Unexpected error fetching %s", symbol)
+            return None
+
+
+def provider_client() -> httpx.AsyncClient:
+    """Async client for the provider, pooled like get_provider_session(); use as `async with`"""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(settings.ALPHA_VANTAGE_READ_TIMEOUT, connect=settings.ALPHA_VANTAGE_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=settings.ALPHA_VANTAGE_POOL_SIZE,
+            max_keepalive_connections=settings.ALPHA_VANTAGE_POOL_SIZE
+        )
+    )
+
 class StockDataService:
     @staticmethod
     def get_stock_history(symbol, start_date=None, end_date=None):
-        """Raw database fetching"""
-        query = StockPrice.objects.filter(symbol=symbol)
+        """Raw database fetching, as rows of the configured daily price table"""
+        model = daily_price_model()
+        query = model.objects.filter(**{model.symbol_path: symbol})
         
         if start_date:
             query = query.filter(date__gte=start_date)
@@ -75,3 +335,170 @@ class StockDataService:
             query = query.filter(date__lte=end_date)
             
         return query.order_by('-date')
+
+    @staticmethod
+    def get_price_series(symbol, start_date=None, end_date=None) -> PriceSeries:
+        """Date range of a symbol's columnar history, served from the in-process price cache"""
+        return get_price_cache().get(symbol).slice(start_date, end_date)
+
+    @staticmethod
+    def get_price_series_many(bounds: Dict, timeframe: str = 'daily') -> Dict[str, PriceSeries]:
+        """
+        Columnar histories for {symbol: (start_date, end_date)} with a single
+        query for everything not already cached. With the price cache
+        disabled, the date bounds are applied in that query instead.
+        Weekly and monthly bars are read from their rollup tables.
+        """
+        if timeframe != 'daily':
+            return load_price_series_many(bounds, model=ROLLUP_MODELS[timeframe])
+
+        cache = get_price_cache()
+        if not cache.max_bytes:
+            return load_price_series_many(bounds)
+
+        series = cache.get_many(bounds)
+        return {
+            symbol: series[symbol].slice(start_date, end_date)
+            for symbol, (start_date, end_date) in bounds.items()
+        }
+
+    @staticmethod
+    async def aget_price_series_many(bounds: Dict, timeframe: str = 'daily') -> Dict[str, PriceSeries]:
+        """get_price_series_many through the async ORM"""
+        if timeframe != 'daily':
+            return await aload_price_series_many(bounds, model=ROLLUP_MODELS[timeframe])
+
+        cache = get_price_cache()
+        if not cache.max_bytes:
+            return await aload_price_series_many(bounds)
+
+        series = await cache.aget_many(bounds)
+        return {
+            symbol: series[symbol].slice(start_date, end_date)
+            for symbol, (start_date, end_date) in bounds.items()
+        }
+
+    @staticmethod
+    def get_history_page(bounds: Dict, page_size: int, after: Optional[Tuple] = None,
+                         timeframe: str = 'daily') -> List[Tuple]:
+        """
+        One keyset page of (symbol, date, open, close, volume) rows for
+        {symbol: (start_date, end_date)}, ordered by symbol then newest date
+        first. after is the (symbol, date) of the previous page's last row.
+        Prices come back as stored, except integer cents are scaled to units.
+        """
+        model = ROLLUP_MODELS.get(timeframe) or daily_price_model()
+        symbol = model.symbol_path
+        condition = Q()
+        for name, (start_date, end_date) in bounds.items():
+            symbol_condition = Q(**{symbol: name})
+            if start_date:
+                symbol_condition &= Q(date__gte=start_date)
+            if end_date:
+                symbol_condition &= Q(date__lte=end_date)
+            condition |= symbol_condition
+
+        query = model.objects.filter(**{f'{symbol}__in': list(bounds)}).filter(condition)
+        if after:
+            last_symbol, last_date = after
+            query = query.filter(
+                Q(**{f'{symbol}__gt': last_symbol}) | Q(**{symbol: last_symbol, 'date__lt': last_date})
+            )
+
+        rows = list(
+            query.order_by(symbol, '-date')
+            .values_list(symbol, 'date', 'open_price', 'close_price', 'volume')[:page_size]
+        )
+        scale = model.price_scale
+        if scale != 1:
+            rows = [(name, day, open_price / scale, close / scale, volume)
+                    for name, day, open_price, close, volume in rows]
+        return rows
+
+    @staticmethod
+    def get_latest_date(symbol):
+        """Most recent stored date for a symbol, or None if nothing is stored"""
+        model = daily_price_model()
+        return model.objects.filter(**{model.symbol_path: symbol}).aggregate(latest=Max('date'))['latest']
+
+    @staticmethod
+    async def aget_latest_date(symbol):
+        """get_latest_date through the async ORM"""
+        model = daily_price_model()
+        return (await model.objects.filter(**{model.symbol_path: symbol}).aaggregate(latest=Max('date')))['latest']
+
+    @staticmethod
+    def bulk_upsert_prices(symbol: str, prices, batch_size: Optional[int] = None) -> Dict[str, int]:
+        """
+        Insert or update daily prices for one symbol using batched
+        bulk_create(update_conflicts=True). prices is a PriceColumns (or a
+        list of row dicts); it is matched against the stored rows column by
+        column, and only new or changed days are written. Weekly/monthly
+        rollups are refreshed from the earliest written day. Rows go to the
+        configured daily price table (StockPrice or CompactStockPrice).
+        Returns inserted/updated/unchanged counts.
+        """
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        if not isinstance(prices, PriceColumns):
+            prices = PriceColumns.from_rows(prices)
+        if not len(prices):
+            return counts
+
+        model = daily_price_model()
+        if model is CompactStockPrice:
+            key, to_stored = {'ticker_id': ticker_ids([symbol])[symbol]}, int
+        else:
+            key, to_stored = {'symbol': symbol}, from_cents
+
+        # One query for the stored rows the payload overlaps with, compared
+        # at the stored precision so re-imports don't count as updates
+        columns = list(zip(*model.objects.filter(
+            **key, date__gte=prices.dates[0].item()
+        ).values_list('date', *PRICE_FIELDS))) or [[] for _ in range(6)]
+        if model.price_scale == 1:
+            stored = PriceColumns.from_values(*columns)
+        else:  # already integer cents
+            stored = PriceColumns(np.array(columns[0], dtype='datetime64[D]'), *columns[1:])
+        position = np.minimum(np.searchsorted(stored.dates, prices.dates), max(len(stored) - 1, 0))
+        found = (position < len(stored)) & (stored.dates[position] == prices.dates) if len(stored) else \
+            np.zeros(len(prices), dtype=bool)
+        unchanged = found.copy()
+        for new, old in zip(prices.prices(), stored.prices()):
+            unchanged[found] &= new[found] == old[position[found]]
+
+        write = np.flatnonzero(~unchanged)
+        counts['inserted'] = int((~found).sum())
+        counts['unchanged'] = int(unchanged.sum())
+        counts['updated'] = len(prices) - counts['inserted'] - counts['unchanged']
+
+        opens, highs, lows, closes, volumes = (column[write].tolist() for column in prices.prices())
+        to_write = [
+            model(
+                **key,
+                date=day,
+                open_price=to_stored(open_price),
+                high_price=to_stored(high),
+                low_price=to_stored(low),
+                close_price=to_stored(close),
+                volume=volume
+            )
+            for day, open_price, high, low, close, volume in zip(
+                prices.dates[write].tolist(), opens, highs, lows, closes, volumes
+            )
+        ]
+
+        with transaction.atomic():
+            model.objects.bulk_create(
+                to_write,
+                batch_size=batch_size or settings.STOCK_DATA_BULK_BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=list(model._meta.unique_together[0]),
+                update_fields=[*PRICE_FIELDS, 'updated_at']
+            )
+            if to_write:
+                update_rollups(symbol, since=to_write[0].date)
+
+        if to_write:
+            get_price_cache().invalidate(symbol)
+
+        return counts
@@ -0,0 +1,94 @@
+# stock_data/storage.py
+"""
+Moving daily prices between the two storage layouts.
+
+STOCK_PRICE_STORAGE = 'decimal' keeps them in StockPrice (symbol string,
+numeric(10, 2) prices); 'compact' keeps them in CompactStockPrice (a
+two-byte Ticker id and integer cents). Rows are only moved on request,
+by convert_price_storage; the migration creating the compact tables
+leaves them where they are.
+"""
+from typing import Callable, Dict, Optional
+
+from django.db import transaction
+
+from .models import CompactStockPrice, StockPrice, Ticker
+from .payloads import from_cents
+
+PRICE_FIELDS = ('open_price', 'high_price', 'low_price', 'close_price')
+# Largest price CompactStockPrice's integer columns hold, in cents
+MAX_COMPACT_CENTS = 2 ** 31 - 1
+
+
+def ticker_ids(symbols, ticker=Ticker) -> Dict[str, int]:
+    """{symbol: Ticker id} for symbols, creating the tickers that don't exist yet"""
+    symbols = list(symbols)
+    ids = dict(ticker.objects.filter(symbol__in=symbols).values_list('symbol', 'id'))
+    missing = [symbol for symbol in symbols if symbol not in ids]
+    if missing:
+        ticker.objects.bulk_create([ticker(symbol=symbol) for symbol in missing], ignore_conflicts=True)
+        ids.update(ticker.objects.filter(symbol__in=missing).values_list('symbol', 'id'))
+    return ids
+
+
+def to_compact(stock_price=StockPrice, compact_price=CompactStockPrice, ticker=Ticker,
+               batch_size: int = 5000, progress: Optional[Callable] = None) -> int:
+    """
+    Move every StockPrice row into CompactStockPrice, one symbol per
+    transaction, and return the number of rows moved. Raises ValueError
+    (before writing that symbol) if a price doesn't fit in integer cents.
+    """
+    symbols = list(stock_price.objects.order_by('symbol').values_list('symbol', flat=True).distinct())
+    ids = ticker_ids(symbols, ticker)
+    moved = 0
+    for symbol in symbols:
+        with transaction.atomic():
+            rows = stock_price.objects.filter(symbol=symbol)
+            converted = []
+            for day, *prices, volume in rows.values_list('date', *PRICE_FIELDS, 'volume').iterator(batch_size):
+                cents = [int(price.scaleb(2)) for price in prices]
+                if max(cents) > MAX_COMPACT_CENTS:
+                    raise ValueError(f'{symbol} {day}: price too large for compact storage')
+                converted.append(compact_price(
+                    ticker_id=ids[symbol], date=day, volume=volume, **dict(zip(PRICE_FIELDS, cents))
+                ))
+
+            compact_price.objects.bulk_create(
+                converted,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['ticker', 'date'],
+                update_fields=[*PRICE_FIELDS, 'volume', 'updated_at']
+            )
+            rows.delete()
+        moved += len(converted)
+        if progress:
+            progress(symbol, len(converted))
+    return moved
+
+
+def to_decimal(stock_price=StockPrice, compact_price=CompactStockPrice, ticker=Ticker,
+               batch_size: int = 5000, progress: Optional[Callable] = None) -> int:
+    """The reverse of to_compact: move every CompactStockPrice row back into StockPrice"""
+    tickers = list(ticker.objects.filter(id__in=compact_price.objects.values('ticker_id')).order_by('symbol'))
+    moved = 0
+    for ticker_row in tickers:
+        with transaction.atomic():
+            rows = compact_price.objects.filter(ticker_id=ticker_row.id)
+            converted = [
+                stock_price(symbol=ticker_row.symbol, date=day, volume=volume,
+                            **{field: from_cents(cents) for field, cents in zip(PRICE_FIELDS, prices)})
+                for day, *prices, volume in rows.values_list('date', *PRICE_FIELDS, 'volume').iterator(batch_size)
+            ]
+            stock_price.objects.bulk_create(
+                converted,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['symbol', 'date'],
+                update_fields=[*PRICE_FIELDS, 'volume', 'updated_at']
+            )
+            rows.delete()
+        moved += len(converted)
+        if progress:
+            progress(ticker_row.symbol, len(converted))
+    return moved
@@ -1,20 +1,65 @@
 # stock_data/tasks.py
-from .models import StockPrice
-from .services import AlphaVantageService, StockDataService
-from django.db import transaction
+from stock_analyzer.instrumentation import phase
+from .models import ImportJob, daily_price_model
+from .payloads import parse_daily_payload
+from .services import AlphaVantageService, AsyncAlphaVantageService, StockDataService, provider_client
+from .price_cache import get_price_cache
+from .response_cache import get_response_cache
+from .rollups import ROLLUP_MODELS, delete_rollups
+from .indicators import get_indicator_cache
+from asgiref.sync import async_to_sync, sync_to_async
 from datetime import datetime, timedelta
-import time
+from django.conf import settings
+from django.core import signing
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+import asyncio
+import hashlib
+import json
+import threading
+import numpy as np
+from functools import partial
 
-def fetch_stock_data(symbol: str) -> dict:
+HISTORY_CURSOR_SALT = 'stock_data.history_cursor'
+
+def choose_outputsize(symbol: str, full_resync: bool = False) -> str:
+    """
+    Pick the provider output size for a refresh: 'compact' (latest 100 days)
+    when the stored history is recent enough, otherwise 'full'.
+    """
+    if full_resync:
+        return 'full'
+
+    return _outputsize_after(StockDataService.get_latest_date(symbol))
+
+async def achoose_outputsize(symbol: str, full_resync: bool = False) -> str:
+    """choose_outputsize through the async ORM"""
+    if full_resync:
+        return 'full'
+    return _outputsize_after(await StockDataService.aget_latest_date(symbol))
+
+def _outputsize_after(latest) -> str:
+    if latest is None:
+        return 'full'
+
+    gap = (datetime.now().date() - latest).days
+    return 'compact' if gap <= settings.STOCK_DATA_COMPACT_MAX_GAP_DAYS else 'full'
+
+def fetch_stock_data(symbol: str, full_resync: bool = False) -> dict:
     """
     Fetch and store stock data for a given symbol.
+    Only new days are requested when the stored history is recent;
+    full_resync=True always pulls and reconciles the full history.
     Returns dictionary with status and message.
     """
     service = AlphaVantageService()
     
     try:
         # Fetch the data
-        data = service.fetch_daily_prices(symbol)
+        outputsize = choose_outputsize(symbol, full_resync)
+        # A resync bypasses the response cache so it sees the provider's current history
+        data = service.fetch_daily_prices(symbol, outputsize=outputsize, use_cache=not full_resync)
         
         if not data:
             return {
@@ -23,23 +68,17 @@ def fetch_stock_data(symbol: str) -> dict:
             }
             
         # Store the data
-        with transaction.atomic():
-            for price_data in data:
-                StockPrice.objects.update_or_create(
-                    symbol=price_data['symbol'],
-                    date=price_data['date'],
-                    defaults={
-                        'open_price': price_data['open_price'],
-                        'high_price': price_data['high_price'],
-                        'low_price': price_data['low_price'],
-                        'close_price': price_data['close_price'],
-                        'volume': price_data['volume']
-                    }
-                )
-                
+        with phase('upsert'):
+            counts = StockDataService.bulk_upsert_prices(symbol, data)
+
         return {
             'status': 'success',
-            'message': f'Successfully updated data for {symbol}'
+            'message': (
+                f"Successfully updated data for {symbol}: {counts['inserted']} inserted, "
+                f"{counts['updated']} updated, {counts['unchanged']} unchanged"
+            ),
+            'outputsize': outputsize,
+            **counts
         }
         
     except Exception as e:
@@ -48,27 +87,356 @@ def fetch_stock_data(symbol: str) -> dict:
             'message': f'Error processing {symbol}: {str(e)}'
         }
 
+async def afetch_stock_data(symbol: str, service: AsyncAlphaVantageService, full_resync: bool = False) -> dict:
+    """
+    fetch_stock_data for async callers. The provider call is awaited; the
+    upsert runs in Django's sync thread, as it needs a transaction.
+    """
+    try:
+        outputsize = await achoose_outputsize(symbol, full_resync)
+        data = await service.afetch_daily_prices(symbol, outputsize=outputsize, use_cache=not full_resync)
+
+        if not data:
+            return {
+                'status': 'error',
+                'message': f'Failed to fetch data for {symbol}'
+            }
+
+        with phase('upsert'):
+            counts = await sync_to_async(StockDataService.bulk_upsert_prices)(symbol, data)
+
+        return {
+            'status': 'success',
+            'message': (
+                f"Successfully updated data for {symbol}: {counts['inserted']} inserted, "
+                f"{counts['updated']} updated, {counts['unchanged']} unchanged"
+            ),
+            'outputsize': outputsize,
+            **counts
+        }
+
+    except Exception as e:
+        return {
+            'status': 'error',
+            'message': f'Error processing {symbol}: {str(e)}'
+        }
+
+def replay_cached_prices(symbols=None, clear: bool = False, progress=None) -> dict:
+    """
+    Rebuild daily price rows from the on-disk provider response cache
+    without any network access, ignoring cache TTLs. With clear=True the
+    replayed symbols' rows (or the whole table if symbols is None) are
+    deleted first. Returns per-symbol fetch-style results.
+    """
+    cache = get_response_cache()
+    if cache is None:
+        raise ValueError('Provider response cache is disabled (ALPHA_VANTAGE_CACHE_DIR is empty)')
+
+    # Full histories first, then compact payloads, which may hold newer days
+    payloads = {}
+    for function, symbol, outputsize, datatype in cache.entries():
+        if function != 'TIME_SERIES_DAILY' or (symbols and symbol not in symbols):
+            continue
+        payloads.setdefault(symbol, []).append((outputsize, datatype))
+
+    if clear:
+        model = daily_price_model()
+        stale = model.objects.all() if symbols is None else model.objects.filter(**{f'{model.symbol_path}__in': symbols})
+        stale.delete()
+        delete_rollups(symbols)
+        if symbols is None:
+            get_price_cache().invalidate()
+        else:
+            for symbol in symbols:
+                get_price_cache().invalidate(symbol)
+
+    results = {}
+    for symbol in sorted(payloads):
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        try:
+            for outputsize, datatype in sorted(payloads[symbol], key=lambda entry: entry[0] != 'full'):
+                payload = cache.get('TIME_SERIES_DAILY', symbol, outputsize, max_age=None, datatype=datatype)
+                if payload is None:
+                    continue
+                prices = parse_daily_payload(payload)
+                for key, value in StockDataService.bulk_upsert_prices(symbol, prices).items():
+                    counts[key] += value
+            results[symbol] = {'status': 'success', **counts}
+        except Exception as e:
+            results[symbol] = {'status': 'error', 'message': f'Error replaying {symbol}: {str(e)}'}
+
+        if progress:
+            progress(symbol, results[symbol])
+
+    return results
+
+def run_import_job(job_id: int) -> ImportJob:
+    """
+    Import every symbol of a job, saving per-symbol results as they finish.
+    The provider quota is enforced by AlphaVantageService's shared rate limiter.
+    """
+    job = ImportJob.objects.get(id=job_id)
+    job.status = 'running'
+    job.started_at = job.heartbeat_at = timezone.now()
+    job.save(update_fields=['status', 'started_at', 'heartbeat_at'])
+
+    try:
+        for symbol in job.symbols:
+            job.results[symbol] = fetch_stock_data(symbol, full_resync=job.full_resync)
+            job.heartbeat_at = timezone.now()
+            job.save(update_fields=['results', 'heartbeat_at'])
+        job.status = 'completed'
+    except Exception as e:
+        job.status = 'failed'
+        job.error = str(e)
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    return job
+
+async def arun_import_job(job: ImportJob) -> ImportJob:
+    """
+    Import every symbol of a job concurrently on the running event loop,
+    at most ALPHA_VANTAGE_POOL_SIZE at a time; the shared rate limiter
+    still paces the provider calls. Results are saved as symbols finish.
+    """
+    job.status = 'running'
+    job.started_at = job.heartbeat_at = timezone.now()
+    await job.asave(update_fields=['status', 'started_at', 'heartbeat_at'])
+
+    slots = asyncio.Semaphore(settings.ALPHA_VANTAGE_POOL_SIZE)
+
+    async def fetch(symbol, service):
+        async with slots:
+            return symbol, await afetch_stock_data(symbol, service, full_resync=job.full_resync)
+
+    try:
+        async with provider_client() as client:
+            service = AsyncAlphaVantageService(client)
+            for finished in asyncio.as_completed([fetch(symbol, service) for symbol in job.symbols]):
+                symbol, result = await finished
+                job.results[symbol] = result
+                job.heartbeat_at = timezone.now()
+                await job.asave(update_fields=['results', 'heartbeat_at'])
+        job.status = 'completed'
+    except Exception as e:
+        job.status = 'failed'
+        job.error = str(e)
+
+    job.finished_at = timezone.now()
+    await job.asave(update_fields=['status', 'error', 'finished_at'])
+    return job
+
+def _run_import_job_in_thread(job_id: int, concurrent: bool = False):
+    try:
+        if concurrent:
+            async_to_sync(arun_import_job)(ImportJob.objects.get(id=job_id))
+        else:
+            run_import_job(job_id)
+    finally:
+        connection.close()
+
+def expire_stale_import_jobs() -> int:
+    """
+    Fail the jobs whose runner is gone, as their background thread dies
+    with a restarted or redeployed worker: running jobs without a
+    heartbeat for IMPORT_JOB_STALE_SECONDS and pending jobs never started
+    in that time. Returns the number of jobs failed.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.IMPORT_JOB_STALE_SECONDS)
+    return ImportJob.objects.filter(
+        Q(status='running', heartbeat_at__lt=cutoff)
+        | Q(status='running', heartbeat_at__isnull=True, started_at__lt=cutoff)
+        | Q(status='pending', created_at__lt=cutoff)
+    ).update(status='failed', error='Interrupted: the worker running this job stopped', finished_at=now)
+
+def start_import_job(symbols, full_resync: bool = False, concurrent: bool = False) -> ImportJob:
+    """
+    Create an import job and run it in a background thread; concurrent=True
+    fetches its symbols concurrently with arun_import_job.
+    """
+    expire_stale_import_jobs()
+    job = ImportJob.objects.create(
+        symbols=[symbol.upper() for symbol in symbols],
+        full_resync=full_resync
+    )
+    thread = threading.Thread(
+        target=_run_import_job_in_thread, args=(job.id, concurrent), name=f'import-job-{job.id}', daemon=True
+    )
+    transaction.on_commit(thread.start)
+    return job
+
+def format_history(symbol: str, series, timeframe: str = 'daily') -> dict:
+    """Parallel history arrays for the API, newest first"""
+    return {
+        'symbol': symbol,
+        'timeframe': timeframe,
+        'dates': series.date_strings()[::-1],
+        'opens': series.open[::-1].tolist(),
+        'closes': series.close[::-1].tolist(),
+        'volumes': series.volume[::-1].tolist()
+    }
+
 def get_stock_data_task(symbol: str, start_date=None, end_date=None):
-    data = StockDataService.get_stock_history(
+    """Columnar history for one symbol, newest first"""
+    series = StockDataService.get_price_series(
         symbol=symbol,
         start_date=start_date,
         end_date=end_date
     )
-    
-    prices = [{
-        'date': stock.date,
-        'open': stock.open_price,
-        'close': stock.close_price,
-        'volume': stock.volume
-    } for stock in data]
+    return format_history(symbol, series)
 
-    return {
-        'symbol': symbol,
-        'timeframe': 'daily',
-        'data': prices,
-        'metadata': {
-            'count': len(prices),
-            'start_date': start_date,
-            'end_date': end_date
+def get_multiple_stock_data_task(bounds: dict, timeframe: str = 'daily') -> dict:
+    """
+    Columnar histories for {symbol: (start_date, end_date)}, loaded with
+    one query for all symbols not already in the price cache.
+    """
+    with phase('db_load'):
+        series = StockDataService.get_price_series_many(bounds, timeframe)
+    with phase('serialize'):
+        return {symbol: format_history(symbol, series[symbol], timeframe) for symbol in bounds}
+
+async def aget_multiple_stock_data_task(bounds: dict, timeframe: str = 'daily') -> dict:
+    """get_multiple_stock_data_task through the async ORM"""
+    with phase('db_load'):
+        series = await StockDataService.aget_price_series_many(bounds, timeframe)
+    with phase('serialize'):
+        return {symbol: format_history(symbol, series[symbol], timeframe) for symbol in bounds}
+
+def get_indicators_task(symbols, indicators, start_date=None, end_date=None) -> dict:
+    """
+    Indicator values for each symbol between start_date and end_date.
+    indicators is a list of (name, resolved params). Values are computed
+    over the full stored history, so the range start has no warm-up gap,
+    and are memoized per symbol, indicator and parameters.
+    """
+    cache = get_indicator_cache()
+    series = get_price_cache().get_many(symbols)
+
+    results = {}
+    for symbol in symbols:
+        full = series[symbol]
+        lo, hi = full.index_range(start_date, end_date)
+
+        values = []
+        for name, params in indicators:
+            outputs = cache.compute(full, name, params)
+            values.append({
+                'name': name,
+                'params': params,
+                'values': {
+                    field: [None if np.isnan(value) else value for value in column[lo:hi].tolist()]
+                    for field, column in outputs.items()
+                }
+            })
+
+        results[symbol] = {
+            'symbol': symbol,
+            'timeframe': 'daily',
+            'dates': full.slice(start_date, end_date).date_strings(),
+            'indicators': values
         }
-    }
\ No newline at end of file
+    return results
+
+def _bounds_fingerprint(bounds: dict, timeframe: str) -> str:
+    key = json.dumps([timeframe, sorted(bounds.items())], default=str)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def get_stock_data_page_task(bounds: dict, page_size: int, cursor: str = None,
+                             timeframe: str = 'daily') -> dict:
+    """
+    One keyset-paginated page of history for {symbol: (start_date, end_date)}.
+    Rows are walked in (symbol, newest date first) order; a symbol can span
+    pages, in which case its arrays continue on the next page. Returns
+    the page's results and an opaque next_cursor (None on the last page).
+    Raises ValueError for a cursor that is malformed or from another request.
+    """
+    fingerprint = _bounds_fingerprint(bounds, timeframe)
+    after = None
+    if cursor:
+        try:
+            position = signing.loads(cursor, salt=HISTORY_CURSOR_SALT)
+        except signing.BadSignature:
+            raise ValueError('Invalid cursor')
+        if position.get('f') != fingerprint:
+            raise ValueError('Cursor does not belong to this request')
+        after = (position['s'], position['d'])
+
+    # One extra row tells us whether another page follows
+    rows = StockDataService.get_history_page(bounds, page_size + 1, after=after, timeframe=timeframe)
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    # Every requested symbol the page walks past is included, with empty
+    # arrays if it has no rows, as in the unpaginated response
+    first = after[0] if after else None
+    last = rows[-1][0] if has_more else None
+    symbols = {symbol for symbol in bounds if (first is None or symbol > first) and (last is None or symbol <= last)}
+    symbols.update(row[0] for row in rows)
+    results = {
+        symbol: {
+            'symbol': symbol,
+            'timeframe': timeframe,
+            'dates': [],
+            'opens': [],
+            'closes': [],
+            'volumes': []
+        }
+        for symbol in sorted(symbols)
+    }
+    for symbol, date, open_price, close_price, volume in rows:
+        history = results[symbol]
+        history['dates'].append(str(date))
+        history['opens'].append(float(open_price))
+        history['closes'].append(float(close_price))
+        history['volumes'].append(volume)
+
+    next_cursor = None
+    if has_more:
+        last_symbol, last_date = rows[-1][0], rows[-1][1]
+        next_cursor = signing.dumps(
+            {'s': last_symbol, 'd': str(last_date), 'f': fingerprint},
+            salt=HISTORY_CURSOR_SALT,
+            compress=True
+        )
+
+    return {'results': results, 'next_cursor': next_cursor}
+
+def stream_stock_data_task(bounds: dict, requested_count: int, chunk_size: int = None,
+                           timeframe: str = 'daily'):
+    """
+    Yield the history response for {symbol: (start_date, end_date)} as JSON
+    text chunks, in the same shape as get_stock_data_view's response.
+    Rows are read with a chunked iterator and one symbol is held in memory
+    at a time, so memory stays flat however many symbols are requested.
+    """
+    chunk_size = chunk_size or settings.STOCK_HISTORY_STREAM_CHUNK_SIZE
+    dumps = partial(json.dumps, separators=(',', ':'))
+    model = ROLLUP_MODELS.get(timeframe) or daily_price_model()
+    scale = model.price_scale
+
+    yield '{"data":{'
+    for index, (symbol, (start_date, end_date)) in enumerate(bounds.items()):
+        query = model.objects.filter(**{model.symbol_path: symbol})
+        if start_date:
+            query = query.filter(date__gte=start_date)
+        if end_date:
+            query = query.filter(date__lte=end_date)
+        rows = query.order_by('-date').values_list('date', 'open_price', 'close_price', 'volume')
+
+        dates, opens, closes, volumes = [], [], [], []
+        for date, open_price, close_price, volume in rows.iterator(chunk_size=chunk_size):
+            dates.append(str(date))
+            opens.append(float(open_price) / scale)
+            closes.append(float(close_price) / scale)
+            volumes.append(volume)
+
+        yield (
+            (',' if index else '')
+            + f'{dumps(symbol)}:{{"symbol":{dumps(symbol)},"timeframe":{dumps(timeframe)},'
+            + f'"dates":{dumps(dates)},"opens":{dumps(opens)},'
+            + f'"closes":{dumps(closes)},"volumes":{dumps(volumes)}}}'
+        )
+
+    yield '},"metadata":' + dumps({'requested_count': requested_count, 'returned_count': len(bounds)}) + '}'
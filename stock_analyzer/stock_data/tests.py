@@ -1,3 +1,770 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import ROUND_HALF_EVEN, Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .backfill import _copy_data, load_file
+from .indicators import INDICATORS, IndicatorCache, resolve_params
+from .models import CompactStockPrice, ImportJob, MonthlyStockPrice, StockPrice, WeeklyStockPrice
+from .payloads import PriceColumns, parse_daily_csv, parse_daily_json, parse_daily_payload, to_cents
+from .price_cache import PriceCache, PriceSeries, get_price_cache
+from .provider_stub import ProviderStub, synthetic_daily_prices
+from .ratelimit import TokenBucket
+from .renderers import msgpack, pa
+from .rollups import ROLLUP_MODELS, update_rollups
+from .services import (
+    AlphaVantageService, AsyncAlphaVantageService, StockDataService, _is_throttled, provider_client, provider_metrics
+)
+from .storage import MAX_COMPACT_CENTS, to_compact, to_decimal
+from .tasks import afetch_stock_data, fetch_stock_data, run_import_job
+
+PRICE_COLUMNS = ('date', 'open', 'high', 'low', 'close', 'volume')
+STUB_END_DATE = date(2024, 6, 28)
+
+
+@contextmanager
+def provider_stub(num_days: int = 300, **options):
+    """ProviderStub with the quota, retries and response cache out of the way"""
+    with ProviderStub(num_days=num_days, end_date=STUB_END_DATE, **options) as stub:
+        with override_settings(
+            ALPHA_VANTAGE_BASE_URL=stub.url,
+            ALPHA_VANTAGE_CACHE_DIR='',
+            ALPHA_VANTAGE_CALLS_PER_MINUTE=10 ** 9,
+            ALPHA_VANTAGE_BURST=10 ** 9,
+            ALPHA_VANTAGE_MAX_RETRIES=0
+        ):
+            yield stub
+
+
+def synthetic_columns(symbol: str, num_days: int, end_date: date) -> PriceColumns:
+    prices = synthetic_daily_prices(symbol, num_days, end_date)
+    return PriceColumns.from_values(*(prices[name] for name in PRICE_COLUMNS))
+
+
+def stored_bars(symbol: str) -> dict:
+    return {
+        timeframe: list(
+            model.objects.filter(symbol=symbol).order_by('date')
+            .values_list('date', 'open_price', 'high_price', 'low_price', 'close_price', 'volume')
+        )
+        for timeframe, model in ROLLUP_MODELS.items()
+    }
+
+
+class PayloadTests(TestCase):
+    CSV_HEADER = b'timestamp,open,high,low,close,volume\n'
+
+    def day(self, open='1.0000', high='2.0000', low='0.5000', close='1.5000', volume='100'):
+        return {'1. open': open, '2. high': high, '3. low': low, '4. close': close, '5. volume': volume}
+
+    def test_cents_round_half_to_even(self):
+        self.assertEqual(
+            to_cents([0.005, 0.015, 0.025, 0.035, 1.005, 2.675, 1.0051, 1.0049, 99999.995]).tolist(),
+            [0, 2, 2, 4, 100, 268, 101, 100, 10000000]
+        )
+        values = np.round(np.random.default_rng(5).uniform(0, 1000, 2000), 4)
+        self.assertEqual(to_cents(values).tolist(), [
+            int(Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_EVEN) * 100) for value in values
+        ])
+        with self.assertRaises(ValueError):
+            to_cents([1.0, np.nan])
+
+    def test_constructors(self):
+        from_strings = PriceColumns.from_values(
+            ['2024-01-03', '2024-01-02'], ['1.005', '2'], ['1.015', '2'], ['1', '2'], ['1.025', '2'], ['10', '20']
+        )
+        from_rows = PriceColumns.from_rows([
+            {'date': date(2024, 1, 3), 'open_price': Decimal('1.005'), 'high_price': Decimal('1.015'),
+             'low_price': Decimal('1'), 'close_price': Decimal('1.025'), 'volume': 10},
+            {'date': date(2024, 1, 2), 'open_price': Decimal('2'), 'high_price': Decimal('2'),
+             'low_price': Decimal('2'), 'close_price': Decimal('2'), 'volume': 20},
+        ])
+        for columns in (from_strings, from_rows):
+            self.assertEqual(columns.dates.astype(str).tolist(), ['2024-01-02', '2024-01-03'])
+            self.assertEqual([column.tolist() for column in columns.prices()],
+                             [[200, 100], [200, 102], [200, 100], [200, 102], [20, 10]])
+            self.assertEqual(columns.open.dtype, np.int64)
+
+        with self.assertRaises(ValueError):
+            PriceColumns.from_values(['2024-01-02'], [1], [1], [1], [1], [np.nan])
+        with self.assertRaises(ValueError):
+            PriceColumns.from_values(['not a date'], [1], [1], [1], [1], [1])
+
+    def test_duplicate_dates_keep_the_last_bar(self):
+        columns = PriceColumns.from_values(
+            ['2024-01-03', '2024-01-02', '2024-01-03', '2024-01-02'], [3, 2, 4, 5], [3, 2, 4, 5], [3, 2, 4, 5],
+            [3, 2, 4, 5], [1, 2, 3, 4]
+        )
+        self.assertEqual(columns.dates.astype(str).tolist(), ['2024-01-02', '2024-01-03'])
+        self.assertEqual(columns.close.tolist(), [500, 400])
+        self.assertEqual(columns.volume.tolist(), [4, 3])
+
+        parsed = parse_daily_csv(self.CSV_HEADER + b'2024-01-02,1,1,1,1,1\n2024-01-02,2,2,2,2,2\n')
+        self.assertEqual((len(parsed), parsed.close.tolist()), (1, [200]))
+
+    def test_csv_and_json_parse_alike(self):
+        csv = parse_daily_csv(
+            self.CSV_HEADER + b'2024-01-03,1.0050,2.0000,0.5000,1.5150,100\n2024-01-02,1.0000,2.0000,0.5000,1.5000,200\n'
+        )
+        json_columns = parse_daily_json({'Time Series (Daily)': {
+            '2024-01-03': self.day(open='1.0050', close='1.5150'), '2024-01-02': self.day(volume='200')
+        }})
+        for columns in (csv, json_columns):
+            self.assertEqual(columns.dates.astype(str).tolist(), ['2024-01-02', '2024-01-03'])
+            self.assertEqual(columns.open.tolist(), [100, 100])
+            self.assertEqual(columns.close.tolist(), [150, 152])
+            self.assertEqual(columns.volume.tolist(), [200, 100])
+
+        self.assertEqual(len(parse_daily_payload(b'{"Time Series (Daily)": {}}')), 0)
+        self.assertEqual(len(parse_daily_payload(self.CSV_HEADER)), 0)
+
+    def test_malformed_payloads_raise_value_error(self):
+        bad_csv = {
+            'non-numeric price': self.CSV_HEADER + b'2024-01-02,1,2,0.5,abc,10\n',
+            'missing price': self.CSV_HEADER + b'2024-01-02,1,2,0.5,,10\n',
+            'missing volume': self.CSV_HEADER + b'2024-01-02,1,2,0.5,1,\n',
+            'bad date': self.CSV_HEADER + b'2024-13-02,1,2,0.5,1,10\n',
+            'missing column': b'timestamp,open,high,low\n2024-01-02,1,2,0.5\n',
+            'empty body': b'',
+        }
+        for name, payload in bad_csv.items():
+            with self.subTest(name), self.assertRaisesRegex(ValueError, 'Malformed CSV payload'):
+                parse_daily_csv(payload)
+
+        bad_json = {
+            'missing field': {'2024-01-02': {'1. open': '1'}},
+            'non-numeric price': {'2024-01-02': self.day(close='n/a')},
+            'bad date': {'2024-02-30': self.day()},
+            'not an object': {'2024-01-02': None},
+        }
+        for name, series in bad_json.items():
+            with self.subTest(name), self.assertRaisesRegex(ValueError, 'Malformed JSON payload'):
+                parse_daily_json({'Time Series (Daily)': series})
+        with self.assertRaisesRegex(ValueError, 'API Error'):
+            parse_daily_json({'Error Message': 'Invalid API call'})
+
+
+class RollupTests(TestCase):
+    def test_incremental_update_matches_full_rebuild(self):
+        # 2024-03-01 is a Friday, so the refreshed month starts inside the
+        # week of 2024-02-26, which must still be built from all its days
+        prices = synthetic_columns('ROLL', 120, date(2024, 4, 30))
+        cutoff = int(np.searchsorted(prices.dates, np.datetime64('2024-03-01')))
+        StockDataService.bulk_upsert_prices(
+            'ROLL', PriceColumns(prices.dates[:cutoff], *(column[:cutoff] for column in prices.prices()))
+        )
+
+        # Revise the closes from 2024-02-27 on and add the new days in one write
+        prices.close[cutoff - 3:] += 7
+        StockDataService.bulk_upsert_prices('ROLL', prices)
+        incremental = stored_bars('ROLL')
+
+        update_rollups('ROLL')
+        self.assertEqual(incremental, stored_bars('ROLL'))
+        self.assertTrue(WeeklyStockPrice.objects.filter(symbol='ROLL', date=date(2024, 2, 26)).exists())
+        self.assertTrue(MonthlyStockPrice.objects.filter(symbol='ROLL', date=date(2024, 3, 1)).exists())
+
+    def test_since_mid_period_keeps_earlier_bars(self):
+        StockDataService.bulk_upsert_prices('ROLL', synthetic_columns('ROLL', 60, date(2024, 3, 29)))
+        full = stored_bars('ROLL')
+
+        for since in (date(2024, 3, 1), date(2024, 3, 14), date(2024, 2, 29)):
+            update_rollups('ROLL', since=since)
+            self.assertEqual(full, stored_bars('ROLL'))
+
+
+class BackfillTests(TestCase):
+    def test_prices_are_rounded_half_to_even_before_copy(self):
+        frame = pd.DataFrame({
+            'symbol': ['HALF', 'HALF'],
+            'date': pd.to_datetime(['2024-06-27', '2024-06-28']),
+            'open': [1.005, 1.015],
+            'high': [2.125, 2.135],
+            'low': [0.125, 0.1251],
+            'close': [10.0, 99999.995],
+            'volume': [100, 200],
+        })
+        self.assertEqual(_copy_data(frame).splitlines(), [
+            'HALF,2024-06-27,1.00,2.12,0.12,10.00,100',
+            'HALF,2024-06-28,1.02,2.14,0.13,100000.00,200',
+        ])
+
+
+    def test_rows_without_a_symbol_are_skipped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/prices.csv'
+            with open(path, 'w') as f:
+                f.write(
+                    'symbol,date,open,high,low,close,volume\n'
+                    'BLNK,2024-06-27,1,2,0.5,1.5,100\n'
+                    ',2024-06-28,1,2,0.5,1.5,100\n'
+                    '  ,2024-06-28,1,2,0.5,1.5,100\n'
+                )
+            # pandas < 3 reads blank cells as NaN in object columns, as on the pinned version
+            with pd.option_context('future.infer_string', False):
+                summary = load_file(path)
+
+        self.assertEqual(summary['skipped'], 2)
+        self.assertEqual(list(StockPrice.objects.values_list('symbol', flat=True).distinct()), ['BLNK'])
+
+
+class IndicatorTests(TestCase):
+    PARAMS = [
+        ('sma', {'period': 5}), ('ema', {}), ('rsi', {}), ('rsi', {'period': 3}),
+        ('macd', {}), ('bollinger', {'period': 10, 'num_std': 1.5}),
+    ]
+
+    def setUp(self):
+        prices = synthetic_daily_prices('IND', 120, date(2024, 6, 28))
+        self.series = PriceSeries(
+            'IND', prices['date'].astype('datetime64[D]').astype(np.int32),
+            *(np.array(prices[name], dtype=np.float64) for name in ('open', 'high', 'low', 'close')),
+            np.array(prices['volume'], dtype=np.int64)
+        )
+
+    def prefix(self, length):
+        series = self.series
+        return PriceSeries(series.symbol, *(getattr(series, name)[:length] for name in PriceSeries.__slots__[1:]))
+
+    def test_incremental_extension_matches_full_recompute(self):
+        for name, params in self.PARAMS:
+            params = resolve_params(name, params)
+            cache = IndicatorCache(10)
+            for length in (5, 14, 15, 16, 40, 41, 120):
+                with self.subTest(name=name, params=params, length=length):
+                    outputs = cache.compute(self.prefix(length), name, params)
+                    full, _ = INDICATORS[name][0](self.series.close[:length], **params)
+                    self.assertEqual(set(outputs), set(full))
+                    for field in full:
+                        np.testing.assert_allclose(outputs[field], full[field], rtol=1e-12)
+
+    def test_changed_history_is_recomputed(self):
+        cache = IndicatorCache(10)
+        params = resolve_params('ema', {})
+        cache.compute(self.prefix(60), 'ema', params)
+        self.series.close[10] += 1
+        full, _ = INDICATORS['ema'][0](self.series.close, **params)
+        np.testing.assert_allclose(cache.compute(self.series, 'ema', params)['ema'], full['ema'], rtol=1e-12)
+
+    def test_rsi_is_wilders(self):
+        close = self.series.close[:40]
+        period = 14
+        changes = np.diff(close)
+        gain, loss = np.clip(changes[:period], 0, None).mean(), np.clip(-changes[:period], 0, None).mean()
+        expected = [np.nan] * period + [100 - 100 / (1 + gain / loss)]
+        for change in changes[period:]:
+            gain = (gain * (period - 1) + max(change, 0)) / period
+            loss = (loss * (period - 1) + max(-change, 0)) / period
+            expected.append(100 - 100 / (1 + gain / loss))
+
+        values, _ = INDICATORS['rsi'][0](close, period=period)
+        np.testing.assert_allclose(values['rsi'], expected, rtol=1e-12)
+
+    def test_view(self):
+        StockDataService.bulk_upsert_prices('IND', synthetic_columns('IND', 60, date(2024, 6, 28)))
+        response = self.client.post('/api/stocks/indicators/', json.dumps({
+            'symbols': ['ind'],
+            'indicators': [{'name': 'sma', 'period': 5}, {'name': 'rsi'}, {'name': 'ema'}],
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        data = response.json()['data']['IND']
+        self.assertEqual(len(data['dates']), 60)
+        sma, rsi, ema = (indicator['values'] for indicator in data['indicators'])
+        self.assertEqual(sma['sma'][:4], [None] * 4)
+        self.assertIsNotNone(sma['sma'][4])
+        self.assertEqual(rsi['rsi'][:14], [None] * 14)
+        self.assertIsNotNone(rsi['rsi'][14])
+        self.assertIsNotNone(ema['ema'][0])
+
+        for symbols in (['IND', 5], ['IND', ''], 'IND'):
+            with self.subTest(symbols=symbols), self.assertLogs('django.request', 'WARNING'):
+                response = self.client.post('/api/stocks/indicators/', json.dumps({
+                    'symbols': symbols, 'indicators': [{'name': 'sma'}]
+                }), content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+
+class PriceStorageTests(TestCase):
+    def setUp(self):
+        get_price_cache().invalidate()
+        for symbol, num_days in (('STA', 80), ('STB', 30)):
+            StockDataService.bulk_upsert_prices(symbol, synthetic_columns(symbol, num_days, date(2024, 3, 29)))
+        self.decimal_rows = self.stored()
+
+    def stored(self):
+        return list(StockPrice.objects.order_by('symbol', 'date').values_list(
+            'symbol', 'date', 'open_price', 'high_price', 'low_price', 'close_price', 'volume'
+        ))
+
+    def test_round_trip(self):
+        self.assertEqual(to_compact(), 110)
+        self.assertFalse(StockPrice.objects.exists())
+        symbol, day, *prices, volume = self.decimal_rows[0]
+        compact = CompactStockPrice.objects.get(ticker__symbol=symbol, date=day)
+        self.assertEqual(
+            [compact.open_price, compact.high_price, compact.low_price, compact.close_price, compact.volume],
+            [int(price * 100) for price in prices] + [volume]
+        )
+
+        self.assertEqual(to_decimal(), 110)
+        self.assertFalse(CompactStockPrice.objects.exists())
+        self.assertEqual(self.stored(), self.decimal_rows)
+
+    def test_price_too_large_for_compact_storage(self):
+        too_large = Decimal(MAX_COMPACT_CENTS + 1).scaleb(-2)
+        StockPrice.objects.filter(symbol='STB', date=date(2024, 3, 29)).update(high_price=too_large)
+        with self.assertRaisesRegex(ValueError, 'STB 2024-03-29: price too large'):
+            to_compact()
+        # STA had been moved in its own transaction; STB is left as it was
+        self.assertEqual(CompactStockPrice.objects.filter(ticker__symbol='STA').count(), 80)
+        self.assertEqual(StockPrice.objects.filter(symbol='STB').count(), 30)
+        self.assertFalse(CompactStockPrice.objects.filter(ticker__symbol='STB').exists())
+
+    def responses(self):
+        history = json.dumps([{'symbol': 'STA', 'start_date': '2024-02-01'}, {'symbol': 'STB'}, {'symbol': 'NONE'}])
+        closes = StockDataService.get_price_series('STA').close
+        backtest = json.dumps({'predictions': (closes * 1.03).tolist(), 'force': True})
+        responses = {}
+        for name, url, body in (
+            ('history', '/api/stocks/history/', history),
+            ('weekly', '/api/stocks/history/?timeframe=weekly', history),
+            ('page', '/api/stocks/history/?page_size=50', history),
+            ('backtest', '/backtest/STA/', backtest),
+        ):
+            response = self.client.post(url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 200, response.content)
+            responses[name] = response.json()
+        for key in ('backtest_id', 'cached'):
+            responses['backtest'].pop(key)
+        responses['backtest']['trades'] = [
+            {key: trade[key] for key in ('entry_date', 'entry_price', 'exit_date', 'exit_price', 'shares')}
+            for trade in responses['backtest']['trades']
+        ]
+        return responses
+
+    def test_layouts_serve_the_same_responses(self):
+        decimal = self.responses()
+        self.assertGreater(decimal['backtest']['num_trades'], 0)
+        with override_settings(STOCK_PRICE_STORAGE='compact'):
+            call_command('convert_price_storage', 'compact', stdout=io.StringIO())
+            self.assertFalse(StockPrice.objects.exists())
+            self.assertEqual(self.responses(), decimal)
+
+            # Writes go to the compact table too
+            counts = StockDataService.bulk_upsert_prices('STB', synthetic_columns('STB', 31, date(2024, 4, 1)))
+            self.assertEqual(counts['inserted'], 1)
+            self.assertEqual(CompactStockPrice.objects.filter(ticker__symbol='STB').count(), 31)
+            self.assertFalse(StockPrice.objects.exists())
+
+
+class PriceCacheTests(TestCase):
+    def setUp(self):
+        StockDataService.bulk_upsert_prices('CACHE', synthetic_columns('CACHE', 30, date(2024, 3, 29)))
+
+    def test_invalidation_from_another_process(self):
+        # A separate instance stands in for another worker: the write
+        # invalidates through this process's cache, via the shared CACHES
+        worker = PriceCache(10 ** 8)
+        first = worker.get('CACHE')
+        self.assertIs(worker.get('CACHE'), first)
+
+        StockDataService.bulk_upsert_prices('CACHE', synthetic_columns('CACHE', 31, date(2024, 4, 1)))
+        self.assertEqual(len(worker.get('CACHE')), 31)
+
+    def test_entries_expire_after_ttl(self):
+        cache = PriceCache(10 ** 8, ttl=60)
+        first = cache.get('CACHE')
+        with mock.patch('stock_data.price_cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNot(cache.get('CACHE'), first)
+
+
+class HistoryPageTests(TestCase):
+    def setUp(self):
+        StockDataService.bulk_upsert_prices('AAA', synthetic_columns('AAA', 5, date(2024, 3, 29)))
+        StockDataService.bulk_upsert_prices('CCC', synthetic_columns('CCC', 3, date(2024, 3, 29)))
+        self.body = json.dumps([{'symbol': symbol} for symbol in ('AAA', 'BBB', 'CCC', 'DDD')])
+
+    def post(self, query=''):
+        response = self.client.post(f'/api/stocks/history/{query}', self.body, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_pages_join_into_the_unpaginated_response(self):
+        pages = [self.post('?page_size=3')]
+        while pages[-1]['metadata']['next_cursor']:
+            pages.append(self.post(f"?page_size=3&cursor={pages[-1]['metadata']['next_cursor']}"))
+        self.assertEqual([list(page['data']) for page in pages], [['AAA'], ['AAA', 'BBB', 'CCC'], ['CCC', 'DDD']])
+
+        joined = {}
+        for page in pages:
+            for symbol, history in page['data'].items():
+                if symbol in joined:
+                    for name in ('dates', 'opens', 'closes', 'volumes'):
+                        joined[symbol][name] += history[name]
+                else:
+                    joined[symbol] = history
+        self.assertEqual(joined, self.post()['data'])
+
+
+class HistoryStreamTests(TestCase):
+    def setUp(self):
+        StockDataService.bulk_upsert_prices('STRA', synthetic_columns('STRA', 40, date(2024, 3, 29)))
+        StockDataService.bulk_upsert_prices('STRB', synthetic_columns('STRB', 25, date(2024, 3, 29)))
+        self.body = json.dumps([
+            {'symbol': 'STRA', 'start_date': '2024-03-01', 'end_date': '2024-03-20'},
+            {'symbol': 'STRB'},
+            {'symbol': 'STRA', 'start_date': '2024-03-04'},  # the later request for a symbol wins
+            {'symbol': 'STRC'},
+            {'symbol': 'STRB', 'start_date': '2025-01-01'},
+        ])
+
+    def post(self, query):
+        return self.client.post(f'/api/stocks/history/{query}', self.body, content_type='application/json')
+
+    @override_settings(STOCK_HISTORY_STREAM_CHUNK_SIZE=7)
+    def test_stream_matches_the_regular_response(self):
+        for timeframe in ('daily', 'weekly'):
+            with self.subTest(timeframe):
+                expected = self.post(f'?timeframe={timeframe}').json()
+                response = self.post(f'?timeframe={timeframe}&stream=1')
+                self.assertTrue(response.streaming)
+                streamed = json.loads(b''.join(response.streaming_content))
+                self.assertEqual(streamed, expected)
+                self.assertEqual(list(streamed['data']), ['STRA', 'STRB', 'STRC'])
+                self.assertEqual(streamed['data']['STRB']['dates'], [])
+
+
+class HistoryRendererTests(TestCase):
+    COLUMNS = ('dates', 'opens', 'closes', 'volumes')
+
+    def setUp(self):
+        StockDataService.bulk_upsert_prices('RNDA', synthetic_columns('RNDA', 40, date(2024, 3, 29)))
+        StockDataService.bulk_upsert_prices('RNDB', synthetic_columns('RNDB', 25, date(2024, 3, 29)))
+        self.body = json.dumps([
+            {'symbol': 'RNDA', 'start_date': '2024-03-01'}, {'symbol': 'RNDB'}, {'symbol': 'NONE'}
+        ])
+
+    def post(self, accept, body=None):
+        return self.client.post('/api/stocks/history/', body or self.body, content_type='application/json',
+                                HTTP_ACCEPT=accept)
+
+    def expected(self):
+        response = self.post('application/json')
+        self.assertEqual(response.status_code, 200)
+        return {
+            symbol: {name: history[name] for name in self.COLUMNS}
+            for symbol, history in response.json()['data'].items()
+        }
+
+    def decoded(self, columns):
+        return {
+            'dates': np.asarray(columns['dates'], dtype='datetime64[D]').astype(str).tolist(),
+            'opens': np.asarray(columns['opens'], dtype=np.float64).tolist(),
+            'closes': np.asarray(columns['closes'], dtype=np.float64).tolist(),
+            'volumes': np.asarray(columns['volumes'], dtype=np.int64).tolist(),
+        }
+
+    def test_npz(self):
+        response = self.post('application/x-npz')
+        self.assertEqual(response['Content-Type'], 'application/x-npz')
+        archive = np.load(io.BytesIO(response.content))
+        decoded = {
+            symbol: self.decoded({name: archive[f'{symbol}/{name}'] for name in self.COLUMNS})
+            for symbol in ('RNDA', 'RNDB', 'NONE')
+        }
+        self.assertEqual(decoded, self.expected())
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack(self):
+        response = self.post('application/x-msgpack')
+        body = msgpack.unpackb(response.content, raw=False)
+        decoded = {
+            symbol: self.decoded({
+                name: np.frombuffer(history[name]['data'], history[name]['dtype']) for name in self.COLUMNS
+            })
+            for symbol, history in body['data'].items()
+        }
+        self.assertEqual(decoded, self.expected())
+        self.assertEqual(body['metadata']['returned_count'], 3)
+
+    @skipUnless(pa, 'pyarrow is not installed')
+    def test_arrow(self):
+        response = self.post('application/vnd.apache.arrow.stream')
+        table = pa.ipc.open_stream(response.content).read_all().to_pandas()
+        decoded = {
+            symbol: self.decoded({
+                'dates': rows['date'], 'opens': rows['open'], 'closes': rows['close'], 'volumes': rows['volume']
+            })
+            for symbol, rows in ((symbol, table[table['symbol'] == symbol]) for symbol in ('RNDA', 'RNDB', 'NONE'))
+        }
+        self.assertEqual(decoded, self.expected())
+
+    def test_errors_fall_back_to_json(self):
+        accepts = ['application/x-npz', *(['application/x-msgpack'] if msgpack else []),
+                   *(['application/vnd.apache.arrow.stream'] if pa else [])]
+        for accept in accepts:
+            with self.subTest(accept), self.assertLogs('django.request', 'WARNING'):
+                response = self.post(accept, body=json.dumps({'symbol': 'RNDA'}))
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertIn('error', json.loads(response.content))
+
+
+@override_settings(IMPORT_JOB_STALE_SECONDS=600)
+class StaleImportJobTests(TestCase):
+    def test_abandoned_jobs_are_failed(self):
+        long_ago = timezone.now() - timedelta(hours=1)
+        running = ImportJob.objects.create(symbols=['A'], status='running', started_at=long_ago, heartbeat_at=long_ago)
+        pending = ImportJob.objects.create(symbols=['B'])
+        ImportJob.objects.filter(id=pending.id).update(created_at=long_ago)
+        alive = ImportJob.objects.create(
+            symbols=['C'], status='running', started_at=long_ago, heartbeat_at=timezone.now()
+        )
+
+        response = self.client.get(f'/api/stocks/import/{running.id}/')
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertIn('Interrupted', response.json()['error'])
+
+        statuses = dict(ImportJob.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[pending.id], 'failed')
+        self.assertEqual(statuses[alive.id], 'running')
+
+
+class ImportJobTests(TestCase):
+    def start(self, symbols):
+        # The job's thread start is captured, not run: the tests run the job themselves
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                '/api/stocks/import/', json.dumps({'symbols': symbols}), content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        return response.json()
+
+    def status(self, job):
+        return self.client.get(job['status_url']).json()
+
+    def test_lifecycle(self):
+        with provider_stub() as stub:
+            job = self.start(['aapl', 'INVALID1'])
+            self.assertEqual(job['status'], 'pending')
+            self.assertEqual(self.status(job)['progress'], {'completed': 0, 'total': 2})
+
+            seen = []
+
+            def fetch(symbol, full_resync=False):
+                seen.append(self.status(job)['status'])
+                return fetch_stock_data(symbol, full_resync)
+
+            with mock.patch('stock_data.tasks.fetch_stock_data', side_effect=fetch), \
+                    self.assertLogs('stock_data.services', 'ERROR'):
+                run_import_job(job['job_id'])
+
+        status = self.status(job)
+        self.assertEqual(seen, ['running', 'running'])
+        self.assertEqual(status['status'], 'completed')
+        self.assertEqual(status['progress'], {'completed': 2, 'total': 2})
+        self.assertEqual(status['results']['AAPL']['status'], 'success')
+        self.assertEqual(status['results']['AAPL']['inserted'], 300)
+        self.assertEqual(status['results']['INVALID1']['status'], 'error')
+        self.assertIsNotNone(status['finished_at'])
+        self.assertEqual(stub.request_count, 2)
+
+    def test_unexpected_error_fails_the_job(self):
+        job = self.start(['AAPL'])
+        with mock.patch('stock_data.tasks.fetch_stock_data', side_effect=RuntimeError('database went away')):
+            run_import_job(job['job_id'])
+
+        status = self.status(job)
+        self.assertEqual(status['status'], 'failed')
+        self.assertEqual(status['error'], 'database went away')
+
+    def test_symbols_must_be_a_list_of_strings(self):
+        for url in ('/api/stocks/import/', '/api/stocks/import/async/'):
+            for body in ({'symbols': 'AAPL'}, {'symbols': []}, {}, {'symbols': ['AAPL', 5]}, {'symbols': ['AAPL', ' ']}):
+                with self.subTest(url=url, body=body), self.assertLogs('django.request', 'WARNING'):
+                    response = self.client.post(url, json.dumps(body), content_type='application/json')
+                    self.assertEqual(response.status_code, 400)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_unknown_job(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.client.get('/api/stocks/import/999999/').status_code, 404)
+
+
+class FullResyncTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_settings = override_settings(ALPHA_VANTAGE_CACHE_DIR=cache_dir.name)
+
+    def test_resync_bypasses_the_response_cache(self):
+        with provider_stub() as stub, self.cache_settings:
+            self.assertEqual(fetch_stock_data('AAA')['status'], 'success')
+            self.assertEqual(fetch_stock_data('AAA')['status'], 'success')
+            self.assertEqual(stub.request_count, 1)
+
+            self.assertEqual(fetch_stock_data('AAA', full_resync=True)['status'], 'success')
+            self.assertEqual(stub.request_count, 2)
+
+    async def test_async_resync_bypasses_the_response_cache(self):
+        with provider_stub() as stub, self.cache_settings:
+            async with provider_client() as client:
+                service = AsyncAlphaVantageService(client)
+                self.assertEqual((await afetch_stock_data('AAA', service))['status'], 'success')
+                self.assertEqual((await afetch_stock_data('AAA', service))['status'], 'success')
+                self.assertEqual(stub.request_count, 1)
+
+                result = await afetch_stock_data('AAA', service, full_resync=True)
+                self.assertEqual(result['status'], 'success')
+                self.assertEqual(stub.request_count, 2)
+
+
+class BackgroundImportJobTests(TransactionTestCase):
+    def test_job_runs_in_the_background(self):
+        with provider_stub(latency=0.05):
+            for url in ('/api/stocks/import/', '/api/stocks/import/async/'):
+                response = self.client.post(
+                    url, json.dumps({'symbols': ['MSFT', 'IBM']}), content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 202)
+
+                # Wait for the job's thread rather than polling: SQLite's
+                # shared in-memory test database locks tables across threads
+                name = f"import-job-{response.json()['job_id']}"
+                for thread in threading.enumerate():
+                    if thread.name == name:
+                        thread.join(timeout=10)
+
+                status = self.client.get(response.json()['status_url']).json()
+                self.assertEqual(status['status'], 'completed', url)
+                self.assertEqual({result['status'] for result in status['results'].values()}, {'success'})
+
+
+class TokenBucketTests(TestCase):
+    def test_burst_then_refill(self):
+        bucket = TokenBucket('test', rate=2, capacity=2)
+        with mock.patch('stock_data.ratelimit.time.time', return_value=1000.0):
+            self.assertEqual(bucket.try_acquire(), 0)
+            self.assertEqual(bucket.try_acquire(), 0)
+            self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+        with mock.patch('stock_data.ratelimit.time.time', return_value=1000.5):
+            self.assertEqual(bucket.try_acquire(), 0)
+            self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+
+    def test_acquire_gives_up_at_timeout(self):
+        bucket = TokenBucket('test', rate=0.1, capacity=1)
+        self.assertTrue(bucket.acquire())
+        started = time.monotonic()
+        self.assertFalse(bucket.acquire(timeout=1))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_provider_calls_are_paced(self):
+        bucket = TokenBucket('test', rate=20, capacity=1)
+        with provider_stub(num_days=50) as stub:
+            service = AlphaVantageService(rate_limiter=bucket)
+            started = time.monotonic()
+            for symbol in ('A', 'B', 'C', 'D', 'E'):
+                self.assertEqual(len(service.fetch_daily_prices(symbol)), 50)
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(stub.request_count, 5)
+        # One call is covered by the burst, the other four wait 1/20 s each
+        self.assertGreaterEqual(elapsed, 4 / 20 * 0.9)
+
+
+class ProviderRetryTests(TestCase):
+    def setUp(self):
+        provider_metrics.reset()
+
+    def fetch(self, **settings):
+        with override_settings(**settings), mock.patch('stock_data.services.time.sleep') as sleep:
+            prices = AlphaVantageService().fetch_daily_prices('AAPL')
+        return prices, [call.args[0] for call in sleep.call_args_list]
+
+    def test_throttle_body_detection(self):
+        self.assertTrue(_is_throttled({'Note': 'Thank you for using Alpha Vantage!'}))
+        self.assertTrue(_is_throttled({'Information': 'API rate limit reached'}))
+        self.assertFalse(_is_throttled({'Time Series (Daily)': {}, 'Information': 'Daily Prices'}))
+        self.assertFalse(_is_throttled({'Error Message': 'Invalid API call'}))
+        self.assertFalse(_is_throttled(None))  # a CSV body
+
+    def test_throttled_responses_are_retried(self):
+        with provider_stub(throttle_every=2) as stub:
+            stub.request_count = 1  # the first request is the throttled one
+            prices, delays = self.fetch(ALPHA_VANTAGE_MAX_RETRIES=2)
+
+        self.assertEqual(len(prices), 300)
+        self.assertEqual(stub.request_count, 3)
+        self.assertEqual(len(delays), 1)
+        metrics = provider_metrics.snapshot()
+        self.assertEqual((metrics['requests'], metrics['throttled'], metrics['retries']), (2, 1, 1))
+
+    def test_server_errors_are_retried_with_backoff(self):
+        with provider_stub(error_every=2) as stub:
+            stub.request_count = 1
+            prices, delays = self.fetch(ALPHA_VANTAGE_MAX_RETRIES=3, ALPHA_VANTAGE_BACKOFF_BASE=2)
+
+        self.assertEqual(len(prices), 300)
+        # Attempt 1 backs off for half of 2 s fixed plus up to 1 s of jitter
+        self.assertEqual(len(delays), 1)
+        self.assertTrue(1 <= delays[0] <= 2, delays)
+        metrics = provider_metrics.snapshot()
+        self.assertEqual((metrics['requests'], metrics['server_errors'], metrics['retries']), (2, 1, 1))
+        self.assertEqual(metrics['failures'], 0)
+
+    def test_gives_up_after_max_retries(self):
+        with provider_stub(error_every=1) as stub, self.assertLogs('stock_data.services', 'ERROR'):
+            prices, delays = self.fetch(
+                ALPHA_VANTAGE_MAX_RETRIES=2, ALPHA_VANTAGE_BACKOFF_BASE=2, ALPHA_VANTAGE_BACKOFF_MAX=3
+            )
+
+        self.assertIsNone(prices)
+        self.assertEqual(stub.request_count, 3)
+        # Exponential delays 2 s then 4 s capped at 3 s, each half fixed and half jitter
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(1 <= delays[0] <= 2 and 1.5 <= delays[1] <= 3, delays)
+        metrics = provider_metrics.snapshot()
+        self.assertEqual(
+            (metrics['requests'], metrics['server_errors'], metrics['retries'], metrics['failures']), (3, 3, 2, 1)
+        )
+
+    def test_persistent_throttling_gives_up(self):
+        with provider_stub(throttle_every=1) as stub, self.assertLogs('stock_data.services', 'WARNING'):
+            prices, delays = self.fetch(ALPHA_VANTAGE_MAX_RETRIES=1)
+
+        self.assertIsNone(prices)
+        self.assertEqual(stub.request_count, 2)
+        metrics = provider_metrics.snapshot()
+        self.assertEqual((metrics['throttled'], metrics['retries'], metrics['failures']), (2, 1, 1))
+
+    def test_network_errors_are_counted(self):
+        with provider_stub(), self.assertLogs('stock_data.services', 'ERROR'):
+            # Nothing listens on the discard port
+            prices, delays = self.fetch(ALPHA_VANTAGE_BASE_URL='http://127.0.0.1:9/query', ALPHA_VANTAGE_MAX_RETRIES=1)
+
+        self.assertIsNone(prices)
+        metrics = provider_metrics.snapshot()
+        self.assertEqual((metrics['network_errors'], metrics['retries'], metrics['failures']), (2, 1, 1))
+
+    def test_metrics_endpoint(self):
+        with provider_stub(error_every=2) as stub:
+            stub.request_count = 1
+            self.fetch(ALPHA_VANTAGE_MAX_RETRIES=1)
+
+        metrics = self.client.get('/api/stocks/provider/metrics/').json()
+        self.assertEqual(metrics, provider_metrics.snapshot())
+        self.assertEqual((metrics['requests'], metrics['server_errors'], metrics['retries']), (2, 1, 1))
+        self.assertIsNotNone(metrics['latency_avg_ms'])
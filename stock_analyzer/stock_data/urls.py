@@ -3,5 +3,10 @@ from . import views
 
 urlpatterns = [
     path('stocks/import/', views.fetch_multiple_stocks, name='import_stocks'),
+    path('stocks/import/async/', views.fetch_multiple_stocks_async, name='import_stocks_async'),
+    path('stocks/import/<int:job_id>/', views.import_job_status, name='import_job_status'),
+    path('stocks/provider/metrics/', views.provider_metrics_view, name='provider_metrics'),
     path('stocks/history/', views.get_stock_data_view, name='stock_history'),
+    path('stocks/history/async/', views.get_stock_data_async_view, name='stock_history_async'),
+    path('stocks/indicators/', views.indicators_view, name='stock_indicators'),
 ]
\ No newline at end of file
@@ -1,33 +1,85 @@
 # stock_data/views.py
-from rest_framework.decorators import api_view
+import json
+
+from asgiref.sync import sync_to_async
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
-from .tasks import fetch_stock_data, get_stock_data_task
-import time
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .models import ImportJob
+from .renderers import HISTORY_RENDERER_CLASSES
+from .rollups import TIMEFRAMES
+from .indicators import resolve_params
+from .services import StockDataService, provider_metrics
+from .tasks import (
+    start_import_job, expire_stale_import_jobs, get_multiple_stock_data_task,
+    aget_multiple_stock_data_task, get_stock_data_page_task, stream_stock_data_task, get_indicators_task
+)
+
+def _symbols_error(symbols):
+    """Why symbols isn't a non-empty list of non-empty strings, or None"""
+    if not symbols or not isinstance(symbols, list):
+        return 'Please provide a list of symbols'
+    if not all(isinstance(symbol, str) and symbol.strip() for symbol in symbols):
+        return 'Symbols must be non-empty strings'
+    return None
 
 @api_view(['POST'])
 def fetch_multiple_stocks(request):
     # Get symbols from request body
-    symbols = request.data.get('symbols', [])
+    symbols = request.data.get('symbols')
+    full_resync = bool(request.data.get('full_resync', False))
     
-    if not symbols:
-        return Response({
-            'error': 'No symbols provided'
-        }, status=400)
+    error = _symbols_error(symbols)
+    if error:
+        return Response({'error': error}, status=400)
     
-    results = []
-    for symbol in symbols:
-        # Fetch data for each symbol
-        result = fetch_stock_data(symbol.upper())
-        results.append(result)
-        
-        # Respect API rate limits (5 calls per minute for free tier)
-        time.sleep(12)  # Wait 12 seconds between calls
+    # Imports run in the background; the provider quota is enforced by a
+    # shared rate limiter instead of sleeping inside the request
+    job = start_import_job(symbols, full_resync=full_resync)
     
     return Response({
-        'results': results
-    })
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': reverse('import_job_status', args=[job.id])
+    }, status=202)
+
+@api_view(['GET'])
+def import_job_status(request, job_id):
+    expire_stale_import_jobs()
+    try:
+        job = ImportJob.objects.get(id=job_id)
+    except ImportJob.DoesNotExist:
+        return Response({'error': f'Import job {job_id} not found'}, status=404)
+
+    return Response(_job_payload(job))
+
+def _job_payload(job: ImportJob) -> dict:
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'full_resync': job.full_resync,
+        'progress': {
+            'completed': len(job.results),
+            'total': len(job.symbols)
+        },
+        'results': job.results,
+        'error': job.error or None,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at
+    }
+
+@api_view(['GET'])
+def provider_metrics_view(request):
+    """Retry counts and latency of provider calls made by this process"""
+    return Response(provider_metrics.snapshot())
 
 @api_view(['POST'])
+@renderer_classes(HISTORY_RENDERER_CLASSES)
 def get_stock_data_view(request):
     stock_requests = request.data
     
@@ -37,38 +89,187 @@ def get_stock_data_view(request):
             status=400
         )
 
-    results = {}
+    bounds = _history_bounds(stock_requests)
+
+    # ?timeframe=weekly|monthly reads the materialized rollup bars instead of dailies
+    timeframe = request.query_params.get('timeframe', 'daily')
+    if timeframe not in TIMEFRAMES:
+        return Response({'error': f"timeframe must be one of {', '.join(TIMEFRAMES)}"}, status=400)
+
+    # Binary formats (Accept: application/x-npz, application/x-msgpack or
+    # application/vnd.apache.arrow.stream) encode the columns straight from the arrays
+    if getattr(request.accepted_renderer, 'columnar', False):
+        return Response({
+            'data': StockDataService.get_price_series_many(bounds, timeframe),
+            'metadata': {
+                'requested_count': len(stock_requests),
+                'returned_count': len(bounds),
+                'timeframe': timeframe
+            }
+        })
+
+    # ?page_size=N (and ?cursor=<next_cursor>) walks the history in
+    # bounded pages using keyset pagination on (symbol, date)
+    if 'page_size' in request.query_params or 'cursor' in request.query_params:
+        try:
+            page_size = int(request.query_params.get('page_size', settings.STOCK_HISTORY_PAGE_SIZE))
+        except ValueError:
+            return Response({'error': 'page_size must be an integer'}, status=400)
+        if not 1 <= page_size <= settings.STOCK_HISTORY_MAX_PAGE_SIZE:
+            return Response({
+                'error': f'page_size must be between 1 and {settings.STOCK_HISTORY_MAX_PAGE_SIZE}'
+            }, status=400)
+
+        try:
+            page = get_stock_data_page_task(
+                bounds, page_size, request.query_params.get('cursor'), timeframe=timeframe
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+        return Response({
+            'data': page['results'],
+            'metadata': {
+                'requested_count': len(stock_requests),
+                'returned_count': len(page['results']),
+                'page_size': page_size,
+                'next_cursor': page['next_cursor']
+            }
+        })
+
+    # ?stream=1 sends the same JSON incrementally for very long histories
+    if request.query_params.get('stream') in ('1', 'true'):
+        return StreamingHttpResponse(
+            stream_stock_data_task(bounds, requested_count=len(stock_requests), timeframe=timeframe),
+            content_type='application/json'
+        )
+
+    results = get_multiple_stock_data_task(bounds, timeframe)
+
+    return Response({
+        'data': results,
+        'metadata': {
+            'requested_count': len(stock_requests),
+            'returned_count': len(results)
+        }
+    })
+
+def _history_bounds(stock_requests) -> dict:
+    """{symbol: (start_date, end_date)}; later requests for the same symbol win, as each symbol is returned once"""
+    bounds = {}
     for stock_req in stock_requests:
         symbol = stock_req.get('symbol')
-        start_date = stock_req.get('start_date')
-        end_date = stock_req.get('end_date')
-        
+
         if not symbol:
             continue
-            
-        stock_data = get_stock_data_task(
-            symbol=symbol,
-            start_date=start_date,
-            end_date=end_date
-        )
-        
-        # Get the prices list from stock_data['data']
-        prices = stock_data['data']
-        
-        # Restructure into parallel arrays
-        results[symbol] = {
-            'symbol': symbol,
-            'timeframe': 'daily',
-            'dates': [str(price['date']) for price in prices],
-            'opens': [float(price['open']) for price in prices],
-            'closes': [float(price['close']) for price in prices],
-            'volumes': [int(price['volume']) for price in prices]
+
+        bounds[symbol] = (stock_req.get('start_date'), stock_req.get('end_date'))
+    return bounds
+
+def _json_body(request):
+    """Parsed JSON request body for the plain Django async views, or None if it isn't valid JSON"""
+    try:
+        return json.loads(request.body or b'null')
+    except ValueError:
+        return None
+
+# The async views below are plain Django views (DRF's api_view is sync
+# only), so under ASGI they run on the event loop instead of a thread.
+
+@csrf_exempt
+@require_POST
+async def fetch_multiple_stocks_async(request):
+    """
+    Queue an import job like stocks/import/, answering 202 at once; the
+    job's symbols are fetched concurrently in the background, up to the
+    provider rate limit. Poll the status URL for progress.
+    """
+    data = _json_body(request)
+    symbols = data.get('symbols') if isinstance(data, dict) else None
+
+    error = _symbols_error(symbols)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+
+    job = await sync_to_async(start_import_job)(
+        symbols, full_resync=bool(data.get('full_resync', False)), concurrent=True
+    )
+
+    return JsonResponse({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': reverse('import_job_status', args=[job.id])
+    }, status=202)
+
+@csrf_exempt
+@require_POST
+async def get_stock_data_async_view(request):
+    """Same JSON as stocks/history/ (with ?timeframe), loaded through the async ORM"""
+    stock_requests = _json_body(request)
+
+    if not stock_requests or not isinstance(stock_requests, list):
+        return JsonResponse({'error': 'Please provide an array of stock requests'}, status=400)
+
+    bounds = _history_bounds(stock_requests)
+
+    timeframe = request.GET.get('timeframe', 'daily')
+    if timeframe not in TIMEFRAMES:
+        return JsonResponse({'error': f"timeframe must be one of {', '.join(TIMEFRAMES)}"}, status=400)
+
+    results = await aget_multiple_stock_data_task(bounds, timeframe)
+
+    return JsonResponse({
+        'data': results,
+        'metadata': {
+            'requested_count': len(stock_requests),
+            'returned_count': len(results)
         }
+    })
+
+@api_view(['POST'])
+def indicators_view(request):
+    """
+    Technical indicators over stored daily closes.
+
+    {"symbols": ["AAPL"], "start_date": "2020-01-01", "end_date": null,
+     "indicators": [{"name": "sma", "period": 50}, {"name": "macd"}]}
+
+    Available: sma, ema (period), rsi (period), macd (fast, slow, signal),
+    bollinger (period, num_std). SMA, Bollinger and RSI are null until
+    their period has passed; EMA and MACD are seeded with the first close,
+    so they have values from the first bar.
+    """
+    symbols = request.data.get('symbols')
+    indicators = request.data.get('indicators')
+
+    error = _symbols_error(symbols)
+    if error:
+        return Response({'error': error}, status=400)
+    if not indicators or not isinstance(indicators, list):
+        return Response({'error': 'Please provide a list of indicators'}, status=400)
+
+    specs = []
+    try:
+        for indicator in indicators:
+            if not isinstance(indicator, dict) or 'name' not in indicator:
+                raise ValueError('Each indicator needs a name')
+            params = {key: value for key, value in indicator.items() if key != 'name'}
+            specs.append((indicator['name'], resolve_params(indicator['name'], params)))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+    symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+    results = get_indicators_task(
+        symbols,
+        specs,
+        start_date=request.data.get('start_date'),
+        end_date=request.data.get('end_date')
+    )
 
     return Response({
         'data': results,
         'metadata': {
-            'requested_count': len(stock_requests),
+            'requested_count': len(symbols),
             'returned_count': len(results)
         }
-    })
\ No newline at end of file
+    })